@@ -0,0 +1,118 @@
+#! /usr/bin/env python
+
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- bench_hourly_prices.py --
+
+Compares the vectorized reshape of hourly power prices against the original
+row-by-row loop on a synthetic multi-year, multi-node workbook.
+
+Usage (from src/python):
+  python -m benchmarks.bench_hourly_prices --years 10 --nodes 5
+"""
+
+import os
+import argparse
+import datetime
+import math
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import write_power_workbook
+from modules.client_data import _melt_hourly_prices
+from modules.utils import convert_to_numeric
+
+
+def legacy_hourly_prices(df, product_id):
+    '''
+    Original implementation (one dict per hour).
+    '''
+    list_of_records = list()
+    cur_row = 0
+    while cur_row < len(df.index):
+        if isinstance(df.iat[cur_row, 4], datetime.date):
+            for h in range(0, 24):
+                if not math.isnan(df.iat[cur_row, h + 6]):
+                    record = dict({
+                        "datehour": datetime.datetime(
+                            df.iat[cur_row, 4].year,
+                            df.iat[cur_row, 4].month,
+                            df.iat[cur_row, 4].day, h, 0),
+                        "product_id": product_id,
+                        "price": convert_to_numeric(df.iat[cur_row, h + 6])
+                    })
+                    list_of_records.append(record)
+        cur_row += 1
+    return pd.DataFrame(list_of_records)
+
+
+def _time(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    aparser = argparse.ArgumentParser(
+        description='Benchmark of the hourly power prices reshape')
+    aparser.add_argument('--years', type=int, default=10)
+    aparser.add_argument('--nodes', type=int, default=5)
+    args = aparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        f_name = os.path.join(tmp_dir, 'power prices.xlsx')
+        print('Writing synthetic workbook ({} years, {} nodes)'
+              .format(args.years, args.nodes))
+        write_power_workbook(f_name, args.years, args.nodes)
+        df = pd.read_excel(f_name)
+
+    df_old, t_old = _time(legacy_hourly_prices, df, 1101)
+    df_new, t_new = _time(_melt_hourly_prices, df, 1101, 'UTC', None,
+                          'Node')
+
+    # The nodes are averaged by hour
+    df_old = df_old.groupby('datehour', as_index=False)['price'].mean()
+    same = len(df_old) == len(df_new) and \
+        np.allclose(df_old['price'].values, df_new['price'].values) and \
+        (pd.to_datetime(df_old['datehour']).values ==
+         df_new['datehour'].values).all()
+    print('Records: {:,} (identical output: {})'.format(len(df_new), same))
+    print('Row loop  : {:8.3f} s'.format(t_old))
+    print('Vectorized: {:8.3f} s ({:.0f}x faster)'
+          .format(t_new, t_old / t_new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#! /usr/bin/env python
+
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- bench_make_dataset.py --
+
+Benchmarks make_dataset on synthetic client's data (see synthetic_data.py)
+and compares the results against a stored baseline.
+
+The build is run twice:
+  - end to end, as a separate process (make_dataset.py load --report), for
+    the wall time and peak resident memory of the whole run and the wall time
+    and throughput of its main phases;
+  - stage by stage, in this process (parsing the workbooks, inserting the
+    records, utility tables, validation, fact table, dispatch margins,
+    commitment, rollups), each stage being measured on its own. The stages
+    are run a second time to measure their peak memory with tracemalloc,
+    which slows them down too much to time them in the same pass.
+
+Results are compared with the baseline recorded for the same scale in
+baseline.json; the exit code is 1 if a stage is slower or uses more memory
+than its baseline by more than the tolerance.
+
+Usage (from src/python):
+  python -m benchmarks.bench_make_dataset --years 2 --nodes 2 --plants 2
+  python -m benchmarks.bench_make_dataset --save_baseline
+"""
+
+import os
+import sys
+import json
+import argparse
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+import yaml
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from benchmarks.synthetic_data import write_client_data
+from modules.bulk_writer import BulkWriter
+from modules.client_data import _client_sources
+from modules.client_data import _parse_file
+from modules.utility_tables import create_utility_tables
+from modules.data_quality import validate_data
+from modules.fact_tables import refresh_fact_hourly
+from modules.fact_tables import refresh_rollups
+from modules.analytics import create_dispatch_margins
+from modules.commitment import create_commitment
+from modules.instrumentation import reset_report
+from modules.instrumentation import stage
+from modules.instrumentation import count_rows
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                'baseline.json')
+
+
+def _result(wall, rows, peak_mb):
+    '''
+    Returns the measures of a stage.
+    '''
+    return OrderedDict([
+        ('wall_s', round(wall, 3)),
+        ('rows', rows),
+        ('rows_per_s', round(rows / wall, 1) if rows and wall else None),
+        ('peak_mb', peak_mb)
+    ])
+
+
+def end_to_end(cfg_name, db_name, load_profile='fast', batch_size=0):
+    '''
+    Runs make_dataset.py in a separate process and returns the measures of
+    the run and of its main phases.
+    '''
+    report_name = db_name + '.json'
+    command = [sys.executable, os.path.join(ROOT, 'make_dataset.py'), 'load',
+               '-c', cfg_name, '-d', db_name, '--load_profile', load_profile,
+               '--batch_size', str(batch_size), '--report', report_name]
+    start = time.perf_counter()
+    subprocess.check_call(command, cwd=ROOT)
+    wall = time.perf_counter() - start
+    with open(report_name, 'r') as f_in:
+        report = json.load(f_in)
+    # Peak memory of the largest child process (i.e., the build)
+    peak_mb = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        scale = 1 << 20 if platform.system() == 'Darwin' else 1 << 10
+        peak_mb = round(peak / scale, 1)
+    rows = sum(s['rows_out'] for s in report['stages']
+               if ' / ' not in s['name'])
+    results = OrderedDict([('end to end', _result(wall, rows, peak_mb))])
+    for s in report['stages']:
+        if ' / ' not in s['name']:
+            results['end to end / ' + s['name']] = _result(
+                s['wall_s'], s['rows_out'] or s['rows_in'], None)
+    return results
+
+
+def _measure(results, name, trace, func, *args):
+    '''
+    Runs func(*args) as the stage name and records its wall time and rows
+    (counted by the modules, see instrumentation.count_rows) or, if trace is
+    True, its peak memory allocated (tracemalloc). Returns the result of func.
+    '''
+    if not trace:
+        with stage(name) as record:
+            value = func(*args)
+        results[name] = _result(record.wall,
+                                record.rows_out or record.rows_in, None)
+        return value
+    tracemalloc.start()
+    try:
+        value = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results[name] = round(peak / (1 << 20), 1)
+    return value
+
+
+def _parse(sources, batch_size):
+    '''
+    Parses the client's sheets into records (dictionaries of arrays).
+    '''
+    by_file = OrderedDict()
+    for source in sources:
+        by_file.setdefault(source.f_in_name, list()).append(source)
+    parsed = list()
+    for file_sources in by_file.values():
+        for source, arrays in zip(file_sources,
+                                  _parse_file(file_sources, batch_size)):
+            count_rows(rows_in=len(arrays[source.time_col]))
+            parsed.append((source, arrays))
+    return parsed
+
+
+def _insert(conn, parsed, insert_batch_size):
+    '''
+    Inserts parsed records into their tables.
+    '''
+    with BulkWriter(conn, insert_batch_size) as writer:
+        for source, arrays in parsed:
+            writer.insert_arrays(source.table, arrays)
+
+
+def by_stage(cfg_name, db_name, batch_size=0, trace=False):
+    '''
+    Runs the stages of the build one by one in this process and returns
+    their measures (their peak memory if trace is True, see _measure).
+    '''
+    with open(cfg_name, 'r') as f_in:
+        cfg = yaml.safe_load(f_in)
+    parameters = cfg['Parameters']
+    insert_batch_size = parameters.get('InsertBatchSize')
+    reset_report()
+    results = OrderedDict()
+    conn = sqlite3.connect(db_name)
+    try:
+        for fn in parameters['SQLFiles']:
+            with open(fn, 'r') as f_in:
+                conn.executescript(f_in.read())
+        sources = _client_sources(conn.cursor(), cfg['Client'],
+                                  parameters.get('TimeZone', 'UTC'))
+        parsed = _measure(results, 'parse workbooks', trace, _parse, sources,
+                          batch_size)
+        _measure(results, 'insert records', trace, _insert, conn, parsed,
+                 insert_batch_size)
+        del parsed
+        _measure(results, 'utility tables', trace, create_utility_tables,
+                 conn, parameters['StartDate'], parameters['EndDate'],
+                 parameters['StartPeak'], parameters['EndPeak'],
+                 insert_batch_size, parameters.get('Interval', 60),
+                 parameters.get('Seasons', 'northern'))
+        _measure(results, 'validation', trace, validate_data, conn,
+                 cfg.get('DataQuality', {}).get('ZScore', 6.0),
+                 parameters.get('TimeZone', 'UTC'),
+                 parameters.get('Interval', 60), insert_batch_size)
+        products = cfg.get('Analytics', {}).get('Products')
+        _measure(results, 'fact table', trace, refresh_fact_hourly, conn,
+                 products)
+        _measure(results, 'dispatch margins', trace, create_dispatch_margins,
+                 conn, cfg['Analytics']['Plants'], insert_batch_size)
+        _measure(results, 'commitment', trace, create_commitment, conn,
+                 cfg['Analytics']['Plants'], insert_batch_size)
+        _measure(results, 'rollups', trace, refresh_rollups, conn)
+    finally:
+        conn.close()
+    return results
+
+
+def compare(results, baseline, tolerance, min_wall=0.05, min_mb=1.0):
+    '''
+    Prints the results next to the baseline and returns the names of the
+    stages that regressed: slower or using more memory than their baseline
+    by more than tolerance (ratio), differences of less than min_wall
+    seconds and min_mb MB being ignored.
+    '''
+    regressions = list()
+    print('{:<44} {:>8} {:>8} {:>7} {:>12} {:>8} {:>8}'.format(
+        'Stage', 'Wall (s)', 'Base', 'Change', 'Rows/s', 'Peak MB', 'Base'))
+    for name, result in results.items():
+        base = baseline.get(name, dict())
+        status = list()
+        change = ''
+        if base.get('wall_s'):
+            change = '{:+.0%}'.format(result['wall_s'] / base['wall_s'] - 1)
+            if result['wall_s'] > base['wall_s'] * (1 + tolerance) and \
+                    result['wall_s'] - base['wall_s'] > min_wall:
+                status.append('slower')
+        if base.get('peak_mb') and result['peak_mb'] is not None and \
+                result['peak_mb'] > base['peak_mb'] * (1 + tolerance) and \
+                result['peak_mb'] - base['peak_mb'] > min_mb:
+            status.append('more memory')
+        if status:
+            regressions.append(name)
+        print('{:<44} {:>8.3f} {:>8} {:>7} {:>12} {:>8} {:>8} {}'.format(
+            name, result['wall_s'], base.get('wall_s', '-'), change,
+            '{:,.0f}'.format(result['rows_per_s'])
+            if result['rows_per_s'] else '-',
+            result['peak_mb'] if result['peak_mb'] is not None else '-',
+            base.get('peak_mb') or '-', ', '.join(status)).rstrip())
+    return regressions
+
+
+def main():
+    aparser = argparse.ArgumentParser(
+        description='Benchmark of make_dataset on synthetic data')
+    aparser.add_argument('--years', type=float, default=1)
+    aparser.add_argument('--nodes', type=int, default=1)
+    aparser.add_argument('--plants', type=int, default=1)
+    aparser.add_argument('--seed', type=int, default=0)
+    aparser.add_argument('--format', dest='file_format', default='xlsx',
+                         choices=['xlsx', 'csv'],
+                         help='format of the client\'s files, default xlsx')
+    aparser.add_argument('--batch_size', type=int, default=0,
+                         help='stream the workbooks by batches of rows')
+    aparser.add_argument('--load_profile', default='fast',
+                         help='load profile of the end to end run')
+    aparser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                         help='baseline file, default baseline.json')
+    aparser.add_argument('--save_baseline', action='store_true',
+                         help='record the results as the new baseline')
+    aparser.add_argument('--tolerance', type=float, default=0.25,
+                         help='regression tolerance, default 0.25 (25%%)')
+    args = aparser.parse_args()
+
+    scale = 'years={:g} nodes={} plants={} batch_size={} profile={}{}'.format(
+        args.years, args.nodes, args.plants, args.batch_size,
+        args.load_profile,
+        ' format={}'.format(args.file_format)
+        if args.file_format != 'xlsx' else '')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print('Writing synthetic data ({})'.format(scale))
+        cfg_name = write_client_data(os.path.join(tmp_dir, 'data'),
+                                     args.years, args.nodes, args.plants,
+                                     args.seed,
+                                     file_format=args.file_format)
+        results = end_to_end(cfg_name, os.path.join(tmp_dir, 'e2e.db'),
+                             args.load_profile, args.batch_size)
+        stages = by_stage(cfg_name, os.path.join(tmp_dir, 'stages.db'),
+                          args.batch_size)
+        peaks = by_stage(cfg_name, os.path.join(tmp_dir, 'memory.db'),
+                         args.batch_size, trace=True)
+        for name, result in stages.items():
+            result['peak_mb'] = peaks[name]
+        results.update(stages)
+
+    baselines = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f_in:
+            baselines = json.load(f_in, object_pairs_hook=OrderedDict)
+    baseline = baselines.get(scale, dict()).get('stages', dict())
+    if not baseline:
+        print('No baseline for this scale in \'{}\''.format(args.baseline))
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baselines[scale] = OrderedDict([
+            ('recorded', time.strftime('%Y-%m-%d')),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('stages', results)])
+        with open(args.baseline, 'w') as f_out:
+            json.dump(baselines, f_out, indent=2)
+            f_out.write('\n')
+        print('Baseline written into \'{}\''.format(args.baseline))
+    elif regressions:
+        print('Regressions: {}'.format(', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- bench_startup.py --
+
+Measures the startup time of make_dataset.py: wall time of commands that do
+little work (--version, create-db on a new database) against the bare
+interpreter, over several runs. Timings depend on the machine, so the time
+above the interpreter's own startup is the figure to compare.
+
+The modules imported by these commands are listed with python -X importtime;
+the exit code is 1 if one of them imports a heavy dependency (e.g., pandas),
+which should only be imported by the commands that need it.
+
+Usage (from src/python):
+  python -m benchmarks.bench_startup --runs 20
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+import tempfile
+import time
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Dependencies that must not be imported when starting up
+HEAVY_MODULES = ('numpy', 'pandas', 'openpyxl')
+
+
+def commands(db_name):
+    '''
+    Returns the commands timed (name, arguments of the interpreter).
+    '''
+    script = os.path.join(ROOT, 'make_dataset.py')
+    return [
+        ('python -c pass', ['-c', 'pass']),
+        ('make_dataset.py --version', [script, '--version']),
+        ('make_dataset.py create-db', [script, 'create-db', '-d', db_name])]
+
+
+def run(args, db_name, options=()):
+    '''
+    Runs the interpreter with args (from src/python, on a new database) and
+    returns its wall time (in seconds) and its standard error.
+    '''
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable] + list(options) + args,
+                             cwd=ROOT, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        raise SystemExit('** {} failed:\n{}'.format(
+            ' '.join(args), process.stderr))
+    return elapsed, process.stderr
+
+
+def imported_modules(args, db_name):
+    '''
+    Returns the top-level packages imported by the interpreter run with args
+    (see python -X importtime).
+    '''
+    _, stderr = run(args, db_name, ['-X', 'importtime'])
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            if name != 'imported package':
+                modules.add(name.split('.')[0])
+    return modules
+
+
+def main():
+    aparser = argparse.ArgumentParser(
+        description='Startup time of make_dataset.py')
+    aparser.add_argument('--runs', type=int, default=20)
+    args = aparser.parse_args()
+
+    heavy = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_name = os.path.join(tmp_dir, 'startup.db')
+        print('{:<28} {:>9} {:>12} {:>16}'.format(
+            'Command', 'Min (ms)', 'Median (ms)', 'Above python (ms)'))
+        interpreter = None
+        for name, cmd_args in commands(db_name):
+            times = [run(cmd_args, db_name)[0] * 1000
+                     for _ in range(args.runs)]
+            median = statistics.median(times)
+            if interpreter is None:
+                interpreter = median
+            print('{:<28} {:>9.1f} {:>12.1f} {:>16.1f}'.format(
+                name, min(times), median, median - interpreter))
+            heavy.extend((name, module) for module in sorted(
+                imported_modules(cmd_args, db_name) & set(HEAVY_MODULES)))
+
+    if heavy:
+        raise SystemExit('** Heavy modules imported at startup: {}'.format(
+            ', '.join('{} by {}'.format(module, name)
+                      for name, module in heavy)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- bench_streaming_memory.py --
+
+Measures with tracemalloc the peak memory used for loading hourly power prices
+from workbooks of increasing size, reading whole workbooks or streaming them
+by batches, with and without the parse cache (whose entries are then written
+and read back by batches). The streaming peak must stay flat: from the
+smallest to the largest workbook, it may grow by at most --tolerance of the
+growth of the whole-workbook peak. It does not stay exactly flat since
+openpyxl's read-only parser keeps the emptied element of each row read (about
+80 bytes per row) until the end of the sheet.
+
+The streamed loads of the prices and of the generation (both in local time,
+with DST changes) must also write the same records as the whole ones, row for
+row. By default, the numbers of nodes and the batch sizes are such that the
+rows of a day are split between batches. The peak memory of the generation,
+one row per hour, is not checked.
+
+Usage (from src/python):
+  python -m benchmarks.bench_streaming_memory --years 1 2 4 --nodes 1 3 \
+      --batch_size 100 500
+"""
+
+import os
+import argparse
+import shutil
+import sqlite3
+import tempfile
+import tracemalloc
+
+from benchmarks.synthetic_data import write_generation_workbook
+from benchmarks.synthetic_data import write_power_workbook
+from benchmarks.synthetic_data import node_names
+from modules.bulk_writer import BulkWriter
+from modules.client_data import _client_sources
+from modules.client_data import _load_sources
+from modules.parse_cache import ParseCache
+
+SQL_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        '..', '..', 'sql', 'create_tables.sql')
+
+TIMEZONE = 'US/Pacific'
+
+
+def load(source, db_name, batch_size, cache_dir=None):
+    '''
+    Loads a source of client's data (see client_data._spec_sources) into a
+    new database, with the parse cache of directory cache_dir if given.
+    Returns the peak memory (in bytes) allocated by python during the load
+    and the records of the table loaded.
+    '''
+    if os.path.exists(db_name):
+        os.remove(db_name)
+    conn = sqlite3.connect(db_name)
+    try:
+        with open(SQL_FILE, 'r') as f_sql:
+            conn.executescript(f_sql.read())
+        tracemalloc.start()
+        with BulkWriter(conn) as writer:
+            cursor = conn.cursor()
+            sources = _client_sources(cursor, {"Sources": [source]},
+                                      TIMEZONE)
+            _load_sources(writer, cursor, sources, batch_size,
+                          cache=ParseCache(cache_dir)
+                          if cache_dir is not None else None)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        records = conn.execute('select * from {} order by 1, 2;'
+                               .format(sources[0].table)).fetchall()
+    finally:
+        conn.close()
+    return peak, records
+
+
+def load_cached(source, db_name, batch_size, cache_dir):
+    '''
+    Loads a source twice with a new parse cache: parsing the file and
+    writing the cache, then reading the cache. Returns the highest of the
+    peaks and the records of both loads (see load).
+    '''
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir)
+    cold, records = load(source, db_name, batch_size, cache_dir)
+    warm, cached = load(source, db_name, batch_size, cache_dir)
+    if not os.listdir(cache_dir):
+        raise SystemExit('** Nothing written into the parse cache')
+    return max(cold, warm), (records, cached)
+
+
+def main():
+    aparser = argparse.ArgumentParser(
+        description='Peak memory of whole-workbook vs streaming ingestion')
+    aparser.add_argument('--years', type=int, nargs='+', default=[1, 2, 4])
+    aparser.add_argument('--nodes', type=int, nargs='+', default=[1, 3])
+    aparser.add_argument('--batch_size', type=int, nargs='+',
+                         default=[100, 500])
+    aparser.add_argument('--tolerance', type=float, default=0.25,
+                         help='maximum growth of the streaming peak relative '
+                         'to the growth of the whole-workbook peak')
+    aparser.add_argument('--no_cache', action='store_true',
+                         help='only stream without the parse cache')
+    args = aparser.parse_args()
+
+    wholes = dict()  # Whole-workbook peaks by nodes
+    peaks = dict()  # Streaming peaks by (nodes, batch size, cache)
+    different = list()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_name = os.path.join(tmp_dir, 'bench.db')
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        caches = [False] if args.no_cache else [False, True]
+        f_power = os.path.join(tmp_dir, 'power.xlsx')
+        f_generation = os.path.join(tmp_dir, 'generation.xlsx')
+        generation = {"Layout": 'generation', "Files": f_generation,
+                      "HeaderRow": 2, "SkipRows": 2, "DateColumn": 'Time',
+                      "ValueColumn": 'Gross Output', "Series": 'PP'}
+
+        def stream(source, batch_size, cache, expected):
+            if cache:
+                peak, records = load_cached(source, db_name, batch_size,
+                                            cache_dir)
+                return peak, records == (expected, expected)
+            peak, records = load(source, db_name, batch_size)
+            return peak, records == expected
+
+        print('{:>6} {:>6} {:>6} {:>6} {:>10} {:>11} {:>15} {:>5}'.format(
+            'Years', 'Nodes', 'Batch', 'Cache', 'Rows', 'Whole (MB)',
+            'Streaming (MB)', 'Same'))
+        for years in sorted(args.years):
+            write_generation_workbook(f_generation, years,
+                                      timezone=TIMEZONE)
+            hours = load(generation, db_name, 0)[1]
+            for batch_size in args.batch_size:
+                for cache in caches:
+                    if not stream(generation, batch_size, cache, hours)[1]:
+                        different.append(('generation', years, 1,
+                                          batch_size, cache))
+            for nodes in args.nodes:
+                write_power_workbook(f_power, years, nodes,
+                                     timezone=TIMEZONE)
+                power = {"Layout": 'hourly_prices', "Files": f_power,
+                         "SeriesColumn": 'Node',
+                         "Series": dict((node, 'DAH')
+                                        for node in node_names(nodes))}
+                whole, prices = load(power, db_name, 0)
+                wholes.setdefault(nodes, list()).append(whole)
+                for batch_size in args.batch_size:
+                    for cache in caches:
+                        streaming, same = stream(power, batch_size, cache,
+                                                 prices)
+                        peaks.setdefault((nodes, batch_size, cache),
+                                         list()).append(streaming)
+                        if not same:
+                            different.append(('prices', years, nodes,
+                                              batch_size, cache))
+                        print('{:>6} {:>6} {:>6} {:>6} {:>10,} {:>11.1f} '
+                              '{:>15.1f} {:>5}'.format(
+                                  years, nodes, batch_size,
+                                  'on' if cache else 'off', len(prices),
+                                  whole / 2 ** 20, streaming / 2 ** 20,
+                                  'yes' if same else 'no'))
+
+    if different:
+        raise SystemExit('** Streamed loads differ from whole ones (table, '
+                         'years, nodes, batch size, cache): {}'
+                         .format(different))
+    if len(args.years) > 1:
+        growth = max(
+            (values[-1] - values[0]) / (wholes[key[0]][-1] - wholes[key[0]][0])
+            for key, values in peaks.items())
+        print('Growth of the streaming peak: {:.1%} of the whole-workbook '
+              'one'.format(growth))
+        if growth > args.tolerance:
+            raise SystemExit('** Streaming peak memory grows with the file '
+                             'size')
+
+
+if __name__ == "__main__":
+    main()
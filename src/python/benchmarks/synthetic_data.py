@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- synthetic_data.py --
+
+Writes synthetic client's data (workbooks or CSV files) in the exact
+layouts expected by modules/client_data.py (power prices with one column
+per hour ending, gas and carbon prices with their header offsets, hourly
+generation), at a configurable scale (years x nodes x plants), along with a
+configuration file and the reference data of the extra plants so
+make_dataset can load them.
+
+Usage (from src/python):
+  python -m benchmarks.synthetic_data --years 5 --nodes 3 --plants 2 \
+      --out /tmp/synthetic
+  python make_dataset.py -c /tmp/synthetic/config.yml --db /tmp/synthetic.db
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import yaml
+from openpyxl import Workbook
+
+SQL_FILE = os.path.realpath(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', '..', 'sql',
+    'create_tables.sql'))
+
+# Reference plant (see create_tables.sql) and attributes of the analyses
+PLANT = 'PP'
+PLANT_ID = 10000
+PLANT_ATTRIBUTES = {"OMPmin": 3.55, "OM": 2.80, "OMDuct": 1.87,
+                    "TransportCost": 0.04, "CarbonFactor": 117,
+                    "StartCost": 2500, "MinUpTime": 6, "MinDownTime": 4}
+
+
+def plant_names(plants):
+    '''
+    Returns the names of the synthetic plants: the reference plant followed
+    by copies named PP2, PP3, etc.
+    '''
+    return [PLANT] + ['{}{}'.format(PLANT, i) for i in range(2, plants + 1)]
+
+
+def node_names(nodes):
+    '''
+    Returns the names of the nodes of the synthetic power prices.
+    '''
+    return ['NODE_{}'.format(n) for n in range(nodes)]
+
+
+def _dates(years, start):
+    '''
+    Returns the days of the period covered by the synthetic data.
+    '''
+    return pd.date_range(start, periods=int(round(years * 365.25)))
+
+
+def _local_hours(days, timezone):
+    '''
+    Returns the local clock hours (naive) of the days, the hour skipped when
+    DST starts being missing and the one repeated when it ends appearing
+    twice. Without timezone, all the days have 24 hours.
+    '''
+    if timezone is None:
+        return pd.date_range(days[0], periods=len(days) * 24, freq='h')
+    first = days[0].tz_localize(timezone)
+    last = (days[-1] + pd.Timedelta(days=1)).tz_localize(timezone)
+    utc = pd.date_range(first.tz_convert('UTC'), last.tz_convert('UTC'),
+                        freq='h', inclusive='left')
+    return utc.tz_convert(timezone).tz_localize(None)
+
+
+def write_power_workbook(f_name, years, nodes, seed=0, start='2010-01-01',
+                         timezone=None):
+    '''
+    Writes a workbook with the same layout as 'power prices.xlsx': one row
+    per day and node (the nodes of a day on consecutive rows) and 25 columns
+    of hours ending. With a timezone, the hour skipped when DST starts is
+    empty and the 25th hour is only filled when DST ends.
+    '''
+    rng = np.random.RandomState(seed)
+    dates = _dates(years, start)
+    n_rows = len(dates) * nodes
+    shape = 8 * np.sin((np.arange(25) - 8) / 24 * 2 * np.pi)
+    prices = 30 + shape + 10 * rng.standard_normal((n_rows, 25))
+    prices[:, 24] = np.nan  # The 25th hour is only used on time change
+    if timezone is not None:
+        hours = pd.Series(_local_hours(dates, timezone))
+        per_day = hours.groupby(hours.dt.normalize()).agg(['size', 'nunique'])
+        per_day = per_day.reindex(dates).fillna(24).values
+        spring = np.repeat(per_day[:, 0] == 23, nodes)
+        autumn = np.repeat(per_day[:, 0] == 25, nodes)
+        # Skipped hour (2am, hour ending 3) and repeated one (hour 25)
+        prices[spring, 2] = np.nan
+        prices[autumn, 24] = 30 + 10 * rng.standard_normal(autumn.sum())
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('prices')
+    ws.append(['UOM', 'Interval', 'MarketType', 'Node', 'OPRDate',
+               'Price Type'] + list(range(1, 26)))
+    nodes_names = node_names(nodes)
+    for i, day in enumerate(np.repeat(dates.to_pydatetime(), nodes)):
+        ws.append(['US$/MWh', 'ENDING', 'DAM', nodes_names[i % nodes], day,
+                   'LMP'] + [None if np.isnan(p) else round(float(p), 5)
+                             for p in prices[i]])
+    wb.save(f_name)
+
+
+def write_daily_prices_workbook(f_name, years, seed=0, start='2010-01-01'):
+    '''
+    Writes a workbook with the same layout as 'gas and carbon prices.xlsx':
+    sheet Gas (prices by delivery date) and sheet Carbon (prices of the
+    business days), the most recent days first. The first 3 gas and 4 carbon
+    rows (dates after the period) are skipped by the loader.
+    '''
+    rng = np.random.RandomState(seed + 1)
+    dates = _dates(years, start)[::-1]
+    gas = 3 + np.cumsum(0.05 * rng.standard_normal(len(dates))).clip(-2, 5)
+    carbon = 12 + np.cumsum(0.1 * rng.standard_normal(len(dates))).clip(-8)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Gas')
+    ws.append(['Price Hub', 'Units', 'Trade Date', 'Delivery Date',
+               'Wtd Avg Index $', 'Daily Volume (mmBtu)'])
+    extra = [dates[0] + pd.Timedelta(days=d) for d in (3, 2, 1)]
+    for day, price in list(zip(extra, [gas[0]] * 3)) + list(zip(dates, gas)):
+        ws.append(['GP Z1', 'USD/mmBtu',
+                   (day - pd.Timedelta(days=1)).to_pydatetime(),
+                   day.to_pydatetime(), round(float(price), 4), 300000])
+    ws = wb.create_sheet('Carbon')
+    ws.append(['Date', 'Carbon Spot Price'])
+    extra = [dates[0] + pd.Timedelta(days=d) for d in (4, 3, 2, 1)]
+    business = dates.weekday < 5
+    for day, price in list(zip(extra, [carbon[0]] * 4)) + \
+            list(zip(dates[business], carbon[business])):
+        ws.append([day.to_pydatetime(), round(float(price), 2)])
+    wb.save(f_name)
+
+
+def write_generation_workbook(f_name, years, seed=0, start='2010-01-01',
+                              timezone=None, capacity=77.5):
+    '''
+    Writes a workbook with the same layout as 'generation.xlsx': 2 empty
+    rows, 3 rows of headers, then one row per local clock hour (the hour
+    repeated when DST ends appearing twice).
+    '''
+    rng = np.random.RandomState(seed + 2)
+    dates = _dates(years, start)
+    hours = _local_hours(dates, timezone)
+    # The plant runs on 70% of the days
+    on = rng.random_sample(len(dates)) < 0.7
+    day = dates.get_indexer(hours.normalize())
+    output = np.where(on[day],
+                      capacity * (0.6 + 0.4 * rng.random_sample(len(hours))),
+                      0.0)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Total Generation')
+    ws.append([None] * 5)
+    ws.append([None] * 5)
+    ws.append(['Date', 'Time', 'Gross Output', 'Auxillary', 'Net Output'])
+    ws.append([dates[0].to_pydatetime(),
+               (dates[-1] + pd.Timedelta(days=1)).to_pydatetime(),
+               None, None, None])
+    ws.append([None, None, 'MWh', None, 'MWh'])
+    for hour, value in zip(hours.to_pydatetime(), output):
+        ws.append([None, hour, float(value), 0.025, float(value) * 0.975])
+    wb.save(f_name)
+
+
+def _to_csv(f_name, sheet_name=0):
+    '''
+    Converts a sheet of a workbook into a CSV file (same name, extension
+    .csv, the sheet name being appended if given) and returns its name.
+    '''
+    f_csv = os.path.splitext(f_name)[0] + \
+        (' {}.csv'.format(sheet_name) if sheet_name else '.csv')
+    pd.read_excel(f_name, sheet_name=sheet_name, header=None) \
+        .to_csv(f_csv, header=False, index=False)
+    return f_csv
+
+
+def write_client_data(directory, years=1, nodes=1, plants=1, seed=0,
+                      start='2015-01-01', timezone='US/Pacific',
+                      file_format='xlsx'):
+    '''
+    Writes the files of the synthetic client's data (workbooks or, if
+    file_format is 'csv', CSV files with the same layouts), the reference
+    data of the extra plants and a configuration file for make_dataset into
+    directory. Returns the name of the configuration file.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    power = os.path.join(directory, 'power prices.xlsx')
+    daily = os.path.join(directory, 'gas and carbon prices.xlsx')
+    write_power_workbook(power, years, nodes, seed, start, timezone)
+    write_daily_prices_workbook(daily, years, seed, start)
+    gas = carbon = daily
+    generation = dict()  # Plant by file name
+    for i, name in enumerate(plant_names(plants)):
+        f_name = os.path.join(directory, 'generation {}.xlsx'.format(name))
+        write_generation_workbook(f_name, years, seed + 10 * i, start,
+                                  timezone)
+        if file_format == 'csv':
+            f_csv = _to_csv(f_name)
+            os.remove(f_name)
+            f_name = f_csv
+        generation[os.path.basename(f_name)] = name
+    if file_format == 'csv':
+        power = _to_csv(power)
+        gas, carbon = _to_csv(daily, 'Gas'), _to_csv(daily, 'Carbon')
+        for f_name in (os.path.splitext(power)[0] + '.xlsx', daily):
+            os.remove(f_name)
+
+    # Extra plants are copies of the reference one
+    plants_sql = os.path.join(directory, 'plants.sql')
+    with open(plants_sql, 'w') as f_out:
+        for i, name in enumerate(plant_names(plants)[1:], 2):
+            f_out.write(
+                'insert or replace into tbl_ref_power_plants '
+                'select {id}, \'{name}\', type, powermin, powermax, duct, '
+                'efficiency_pmin, heatrate_pmin, efficiency, heatrate, '
+                'efficiency_duct, heatrate_duct, country, market_name, '
+                'market_id, latitude, longitude '
+                'from tbl_ref_power_plants where id = {ref};\n'
+                .format(id=PLANT_ID + i - 1, name=name, ref=PLANT_ID))
+
+    dates = _dates(years, start)
+    cfg = {
+        "Parameters": {
+            "StartDate": str(dates[0].date()),
+            "EndDate": str(dates[-1].date()),
+            "StartPeak": 6,
+            "EndPeak": 21,
+            "TimeZone": timezone or 'UTC',
+            "Interval": 60,
+            "Seasons": 'northern',
+            "InsertBatchSize": 50000,
+            "SQLFiles": [SQL_FILE, plants_sql]
+        },
+        "Client": {
+            "Sources": [
+                {"Name": 'power spot prices', "Layout": 'hourly_prices',
+                 "Files": power, "DateColumn": 'OPRDate',
+                 "SeriesColumn": 'Node',
+                 "Series": dict((node, 'DAH') for node in node_names(nodes))},
+                {"Name": 'gas cash prices', "Layout": 'daily_prices',
+                 "Files": gas, "Sheet": 'Gas', "SkipRows": 3,
+                 "DateColumn": 'Delivery Date',
+                 "ValueColumn": 'Wtd Avg Index $', "Series": 'Z1'},
+                {"Name": 'carbon prices', "Layout": 'daily_prices',
+                 "Files": carbon, "Sheet": 'Carbon', "SkipRows": 4,
+                 "DateColumn": 'Date', "ValueColumn": 'Carbon Spot Price',
+                 "Series": 'Carbon'},
+                {"Name": 'generation', "Layout": 'generation',
+                 "Files": os.path.join(directory, 'generation *.' +
+                                       file_format),
+                 "HeaderRow": 2, "SkipRows": 2, "DateColumn": 'Time',
+                 "ValueColumn": 'Gross Output', "Series": generation}]
+        },
+        "Analytics": {
+            "Plants": dict((name, dict(PLANT_ATTRIBUTES))
+                           for name in plant_names(plants))
+        }
+    }
+    cfg_name = os.path.join(directory, 'config.yml')
+    with open(cfg_name, 'w') as f_out:
+        yaml.safe_dump(cfg, f_out, default_flow_style=False)
+    return cfg_name
+
+
+def main():
+    aparser = argparse.ArgumentParser(
+        description='Writes synthetic client\'s data and its configuration')
+    aparser.add_argument('--out', required=True,
+                         help='directory of the workbooks and config.yml')
+    aparser.add_argument('--years', type=float, default=1)
+    aparser.add_argument('--nodes', type=int, default=1)
+    aparser.add_argument('--plants', type=int, default=1)
+    aparser.add_argument('--seed', type=int, default=0)
+    aparser.add_argument('--start', default='2015-01-01')
+    aparser.add_argument('--timezone', default='US/Pacific')
+    aparser.add_argument('--format', dest='file_format', default='xlsx',
+                         choices=['xlsx', 'csv'])
+    args = aparser.parse_args()
+    cfg_name = write_client_data(args.out, args.years, args.nodes,
+                                 args.plants, args.seed, args.start,
+                                 args.timezone, args.file_format)
+    print('Configuration written into {}'.format(cfg_name))
+
+
+if __name__ == "__main__":
+    main()
@@ -35,7 +35,15 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 -- make_dataset.py --
 
 Utility used to collect of series of data provided by client and populate a
-SQLite database file.
+SQLite database file. It has the following commands:
+  - create-db: just create the tables of the database;
+  - load: populate the database with client's data and compute the
+    analytics (the default when no command is given);
+  - calendar: rebuild the utility tables of the calendar;
+  - validate: check the historical tables (see tbl_dq_issues).
+
+Modules (and pandas) are imported by the commands needing them, so the
+light commands start quickly.
 
 To do:
   - None at the moment
@@ -46,18 +54,52 @@ import os
 import argparse
 import logging
 import sqlite3
-import yaml
-
-from modules.client_data import populate_client_data
-from modules.client_data import ClientDataError
+from contextlib import contextmanager
 
-from modules.utility_tables import create_utility_tables
-from modules.utility_tables import UtilTablesError
+from modules.load_profile import LOAD_PROFILES
 
 __version__ = "0.1a"
 
 logger = logging.getLogger('make_dataset')
 
+COMMANDS = ('create-db', 'load', 'calendar', 'validate')
+
+# Entries of the configuration file needed by each command
+REQUIRED = {
+    "create-db": (('Parameters', 'SQLFiles'), ),
+    "calendar": (('Parameters', 'StartDate'), ('Parameters', 'EndDate'),
+                 ('Parameters', 'StartPeak'), ('Parameters', 'EndPeak')),
+    "validate": ()
+}
+REQUIRED['load'] = REQUIRED['create-db'] + REQUIRED['calendar'] + \
+    (('Client', ), )
+
+# Hourly tables keyed by UTC hour (column datehour_utc); the ones of
+# databases created by earlier builds only have the local hour (datehour)
+UTC_TABLES = ('tbl_hist_generation', 'tbl_hist_intradayprices',
+              'tbl_fact_hourly', 'tbl_calc_dispatch_margins')
+
+# Errors of the modules (checked only if the module was imported) and the
+# messages logged for them
+ERRORS = (
+    ('modules.client_data', 'ClientDataError',
+     '** Error in parsing client\'s data.'),
+    ('modules.utility_tables', 'UtilTablesError',
+     '** Error in creating utility tables.'),
+    ('modules.data_quality', 'DataQualityError',
+     '** Error in validating client\'s data.'),
+    ('modules.fact_tables', 'FactTablesError',
+     '** Error in refreshing fact tables.'),
+    ('modules.analytics', 'AnalyticsError',
+     '** Error in computing dispatch margins.'),
+    ('modules.commitment', 'CommitmentError',
+     '** Error in computing optimal commitment.'),
+    ('modules.simulation', 'SimulationError',
+     '** Error in simulating margins.'),
+    ('modules.bulk_writer', 'BulkWriterError',
+     '** Error in writing records: {}'),
+    ('sqlite3', 'Error', '** Error in the database: {}'))
+
 
 def _intro():
     '''
@@ -75,82 +117,503 @@ def _flush(conn, statements):
     cursor.executescript(''.join(statements))
 
 
-def make_dataset():
+@contextmanager
+def _phase(name):
     '''
-    Implementation of make_dataset.
+    Records a phase of the build in the run report and logs its wall time.
     '''
+    from modules.instrumentation import stage
+    with stage(name) as record:
+        yield record
+    logger.info('. {} done in {:.2f} s'.format(name, record.wall))
+
 
-    # Define and read the various user's options
+def _parse_args(argv):
+    '''
+    Defines and reads the various user's options.
+    '''
     _description = 'Populates client\'s data into a SQLite database'
     _epilog = 'Contact research@pyxidr.com for further information.'
     aparser = argparse.ArgumentParser(description=_description,
                                       epilog=_epilog)
     aparser.add_argument('-v', '--version', action='version',
                          version='%(prog)s {}'.format(__version__))
+
+    # Options of all the commands
+    common = argparse.ArgumentParser(add_help=False)
     default_config_file = \
         '{}/config.yml'.format(os.path.dirname(os.path.realpath(__file__)))
-    aparser.add_argument('-c', '--config', dest='config',
-                         default=default_config_file,
-                         type=argparse.FileType('r'),
-                         help='configuration file, default config.yml')
-    aparser.add_argument('-d', '--db', dest='database',
-                         type=argparse.FileType('w'),
-                         help='SQLite database file',
-                         required=True)
-    aparser.add_argument('-V', '--verbose', dest='verbose',
-                         action='store_true', help='verbose')
-    aparser.add_argument('--create_db', dest='create_db',
-                         action='store_true',
-                         help='just create database without populating it')
-
-    args = aparser.parse_args()
+    common.add_argument('-c', '--config', dest='config',
+                        default=default_config_file,
+                        type=argparse.FileType('r'),
+                        help='configuration file, default config.yml')
+    common.add_argument('-d', '--db', dest='database',
+                        type=argparse.FileType('a'),
+                        help='SQLite database file',
+                        required=True)
+    common.add_argument('-V', '--verbose', dest='verbose',
+                        action='store_true', help='verbose')
+    wal = argparse.ArgumentParser(add_help=False)
+    wal.add_argument('--wal', dest='wal', action='store_true',
+                     help='leave the database in WAL mode so queries ' +
+                     'are not blocked while it is updated')
+    issues = argparse.ArgumentParser(add_help=False)
+    issues.add_argument('--fail_on_issues', dest='fail_on_issues',
+                        action='store_true',
+                        help='stop if the data quality checks find more ' +
+                        'issues than DataQuality/MaxIssues of the ' +
+                        'configuration file')
 
-    if args.verbose:
-        logging.basicConfig(format='%(message)s', level=logging.INFO)
+    commands = aparser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+    commands.add_parser('create-db', parents=[common, wal],
+                        help='just create database without populating it')
+    load = commands.add_parser('load', parents=[common, wal, issues],
+                               help='populate the database with client\'s ' +
+                               'data and compute the analytics')
+    load.add_argument('--batch_size', dest='batch_size',
+                      type=int, default=0,
+                      help='stream client\'s workbooks by batches of ' +
+                      'BATCH_SIZE rows, default 0 (read whole workbooks)')
+    load.add_argument('--incremental', dest='incremental',
+                      action='store_true',
+                      help='only load client\'s files that changed ' +
+                      'since the last load (new or changed days)')
+    load.add_argument('--workers', dest='workers', type=int, default=1,
+                      help='number of processes parsing client\'s ' +
+                      'files, default 1')
+    load.add_argument('--no_cache', dest='no_cache',
+                      action='store_true',
+                      help='parse client\'s files even if they are in ' +
+                      'the parse cache')
+    load.add_argument('--load_profile', dest='load_profile',
+                      choices=sorted(LOAD_PROFILES), default='default',
+                      help='SQLite settings used while loading data, ' +
+                      'default \'default\' (\'fast\' tunes PRAGMAs ' +
+                      'and builds the secondary indexes after the load)')
+    load.add_argument('--export_store', dest='export_store',
+                      help='export the historical series as memory-' +
+                      'mapped NumPy arrays into directory EXPORT_STORE')
+    load.add_argument('--report', dest='report',
+                      help='write the timing, rows and memory of each ' +
+                      'stage into REPORT (JSON)')
+    load.add_argument('--profile', dest='profile',
+                      help='write cProfile statistics of the run into ' +
+                      'PROFILE (see pstats; workers are not profiled)')
+    commands.add_parser('calendar', parents=[common],
+                        help='rebuild the utility tables of the calendar')
+    commands.add_parser('validate', parents=[common, issues],
+                        help='check the historical tables (see ' +
+                        'tbl_dq_issues)')
 
-    _intro()
+    return aparser.parse_args(_legacy_args(argv))
 
-    # Read the various paramters from the configuration file
-    with open(args.config.name, 'r') as ymlfile:
+
+def _legacy_args(argv):
+    '''
+    Translates the options used before the commands existed: no command
+    means load and --create_db means create-db.
+    '''
+    if any(arg in COMMANDS or arg in ('-h', '--help', '-v', '--version')
+           for arg in argv):
+        return argv
+    if '--create_db' in argv:
+        return ['create-db'] + [arg for arg in argv if arg != '--create_db']
+    return ['load'] + argv
+
+
+def _read_config(f_name, command):
+    '''
+    Reads the configuration file and checks the entries used by command.
+    '''
+    import yaml
+    with open(f_name, 'r') as ymlfile:
         try:
-            cfg = yaml.load(ymlfile)
-        except yaml.parser.ParserError:
-            logger.error('** Error in parsing file {}.'
-                         .format(args.config.name))
+            # Same as yaml.safe_load, with the C parser when available
+            cfg = yaml.load(ymlfile, Loader=getattr(yaml, 'CSafeLoader',
+                                                    yaml.SafeLoader))
+        except (yaml.YAMLError, ValueError) as err:
+            logger.error('** Error in parsing file {}: {}'
+                         .format(f_name, err))
             sys.exit(2)
+    problems = _check_config(cfg, command)
+    for problem in problems:
+        logger.error('** Error in configuration file {}: {}.'
+                     .format(f_name, problem))
+    if problems:
+        sys.exit(2)
+    return cfg
+
 
+def _check_config(cfg, command):
+    '''
+    Returns the problems found in the entries of the configuration file
+    used by command.
+    '''
+    if not isinstance(cfg, dict) or \
+            not isinstance(cfg.get('Parameters'), dict):
+        return ['no Parameters section']
+    problems = ['missing {}'.format('/'.join(keys))
+                for keys in REQUIRED[command]
+                if _entry(cfg, keys) is None]
+    parameters = cfg['Parameters']
+    if command in ('create-db', 'load'):
+        sql_files = parameters.get('SQLFiles')
+        if sql_files is not None and (not isinstance(sql_files, list) or
+                                      not all(os.path.isfile(str(fn))
+                                              for fn in sql_files)):
+            problems.append('Parameters/SQLFiles must list existing files')
+    if command in ('calendar', 'load'):
+        dates = [_date(parameters.get(key)) for key in ('StartDate',
+                                                        'EndDate')]
+        if None in dates:
+            problems.append('Parameters/StartDate and EndDate must be '
+                            'dates (YYYY-MM-DD)')
+        elif dates[0] > dates[1]:
+            problems.append('Parameters/StartDate is after EndDate')
+        for key in ('StartPeak', 'EndPeak'):
+            if not isinstance(parameters.get(key), int) or \
+                    not 0 <= parameters[key] <= 23:
+                problems.append('Parameters/{} must be an hour (0 to 23)'
+                                .format(key))
+    interval = parameters.get('Interval', 60)
+    if not isinstance(interval, int) or interval <= 0 or 60 % interval:
+        problems.append('Parameters/Interval must divide an hour (e.g., '
+                        '60, 30, 15 or 5 minutes)')
+    batch_size = parameters.get('InsertBatchSize', 1)
+    if not isinstance(batch_size, int) or batch_size <= 0:
+        problems.append('Parameters/InsertBatchSize must be a positive '
+                        'integer')
+    if command == 'load':
+        if not isinstance(cfg.get('Client', dict()), dict):
+            problems.append('Client must be a section')
+        if 'Analytics' in cfg:
+            analytics = cfg['Analytics']
+            if not isinstance(analytics, dict) or \
+                    not isinstance(analytics.get('Plants'), dict):
+                problems.append('missing Analytics/Plants')
+            elif 'Simulation' in analytics:
+                problems.extend(_check_simulation(analytics['Simulation']))
+    if command in ('validate', 'load') and 'DataQuality' in cfg:
+        quality = cfg['DataQuality']
+        if not isinstance(quality, dict) or \
+                not isinstance(quality.get('ZScore', 6), (int, float)) or \
+                not isinstance(quality.get('MaxIssues', dict()), dict):
+            problems.append('DataQuality needs a number ZScore and a '
+                            'section MaxIssues')
+    return problems
+
+
+def _check_simulation(simulation):
+    '''
+    Returns the problems found in the section Analytics/Simulation of the
+    configuration file.
+    '''
+    if not isinstance(simulation, dict) or any(
+            simulation.get(key) is None
+            for key in ('StartDate', 'EndDate', 'Paths')):
+        return ['Analytics/Simulation needs StartDate, EndDate and Paths']
+    problems = list()
+    dates = [_date(simulation[key]) for key in ('StartDate', 'EndDate')]
+    if None in dates:
+        problems.append('Analytics/Simulation/StartDate and EndDate must be '
+                        'dates (YYYY-MM-DD)')
+    elif dates[0] > dates[1]:
+        problems.append('Analytics/Simulation/StartDate is after EndDate')
+    for key in ('Paths', 'BlockDays', 'ChunkSize'):
+        value = simulation.get(key, 1)
+        if not isinstance(value, int) or isinstance(value, bool) or \
+                value <= 0:
+            problems.append('Analytics/Simulation/{} must be a positive '
+                            'integer'.format(key))
+    seed = simulation.get('Seed')
+    if seed is not None and (not isinstance(seed, int) or seed < 0):
+        problems.append('Analytics/Simulation/Seed must be a non-negative '
+                        'integer')
+    return problems
+
+
+def _entry(cfg, keys):
+    '''
+    Returns the entry of the configuration file at keys (None if missing).
+    '''
+    for key in keys:
+        if not isinstance(cfg, dict) or key not in cfg:
+            return None
+        cfg = cfg[key]
+    return cfg
+
+
+def _date(value):
+    '''
+    Returns value as a date (None if it is not a date).
+    '''
+    import datetime
+    if isinstance(value, datetime.date):
+        return value
     try:
-        # Open a connection to the database
-        conn = sqlite3.connect(args.database.name)
+        return datetime.datetime.strptime(str(value), '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _error_message(err):
+    '''
+    Returns the message logged for an error raised by a module (None for
+    other errors).
+    '''
+    for module, name, message in ERRORS:
+        if module in sys.modules and \
+                isinstance(err, getattr(sys.modules[module], name)):
+            return message.format(err)
+    return None
+
+
+def _check_schema(conn):
+    '''
+    Stops if the database was created by an earlier version whose hourly
+    tables (see UTC_TABLES) are not keyed by UTC hour: the SQL files only
+    create the missing tables, so they would be kept as they are.
+    '''
+    cursor = conn.cursor()
+    for table in UTC_TABLES:
+        columns = [row[1] for row in cursor.execute(
+            'pragma table_info({});'.format(table)).fetchall()]
+        if 'datehour' in columns and 'datehour_utc' not in columns:
+            logger.error('** The database was created by an earlier version '
+                         '({} has no column datehour_utc): delete it and '
+                         'run create-db again.'.format(table))
+            sys.exit(2)
+
+
+def _create_tables(conn, cfg):
+    '''
+    Executes the SQL files creating the tables.
+    '''
+    from modules.instrumentation import stage
+    _check_schema(conn)
+    with _phase('Creating tables'):
         for fn in cfg['Parameters']['SQLFiles']:
-            logger.info('. Executing \'{}\''.format(os.path.basename(fn)))
-            statements = []
-            for statement in open(fn, 'r').readlines():
-                statements.append(statement)
-            _flush(conn, statements)
-        if not args.create_db:
+            logger.info('. Executing \'{}\''
+                        .format(os.path.basename(fn)))
+            with stage(os.path.basename(fn)):
+                statements = []
+                for statement in open(fn, 'r').readlines():
+                    statements.append(statement)
+                _flush(conn, statements)
+
+
+def _create_calendar(conn, cfg):
+    '''
+    Creates the utility tables of the calendar.
+    '''
+    from modules.utility_tables import create_utility_tables
+    with _phase('Creating utility tables'):
+        create_utility_tables(conn, cfg['Parameters']['StartDate'],
+                              cfg['Parameters']['EndDate'],
+                              cfg['Parameters']['StartPeak'],
+                              cfg['Parameters']['EndPeak'],
+                              cfg['Parameters'].get('InsertBatchSize'),
+                              cfg['Parameters'].get('Interval', 60),
+                              cfg['Parameters'].get('Seasons', 'northern'))
+
+
+def _check_data(conn, cfg, fail_on_issues=False):
+    '''
+    Checks the historical data against the calendar and returns the number
+    of issues by check.
+    '''
+    from modules.data_quality import validate_data
+    from modules.data_quality import check_thresholds
+    quality = cfg.get('DataQuality', {})
+    with _phase('Validating client\'s data'):
+        issues = validate_data(conn, quality.get('ZScore', 6.0),
+                               cfg['Parameters'].get('TimeZone', 'UTC'),
+                               cfg['Parameters'].get('Interval', 60),
+                               cfg['Parameters'].get('InsertBatchSize'))
+    if fail_on_issues:
+        check_thresholds(issues, quality.get('MaxIssues', {}))
+    return issues
+
+
+def create_db(conn, cfg, args):
+    '''
+    Implementation of command create-db.
+    '''
+    from modules.load_profile import restore_pragmas
+    _create_tables(conn, cfg)
+    restore_pragmas(conn, [], args.wal)
+
+
+def calendar(conn, cfg, args):
+    '''
+    Implementation of command calendar.
+    '''
+    _create_calendar(conn, cfg)
+
+
+def validate(conn, cfg, args):
+    '''
+    Implementation of command validate.
+    '''
+    _check_data(conn, cfg, args.fail_on_issues)
+
+
+def load(conn, cfg, args):
+    '''
+    Implementation of command load.
+    '''
+    from modules.client_data import populate_client_data
+    from modules.fact_tables import refresh_fact_hourly
+    from modules.fact_tables import refresh_rollups
+    from modules.analytics import create_dispatch_margins
+    from modules.commitment import create_commitment
+    from modules.simulation import create_simulated_margins
+    from modules.parse_cache import ParseCache
+    from modules.incremental import record_load
+    from modules.timeseries_store import export_store
+    from modules.instrumentation import run_report
+    from modules.instrumentation import write_report
+    from modules.load_profile import apply_load_profile
+    from modules.load_profile import restore_pragmas
+    from modules.load_profile import drop_secondary_indexes
+    from modules.load_profile import create_indexes
+
+    report = run_report()
+    report.info.update([('version', __version__),
+                        ('database', args.database.name),
+                        ('config', args.config.name),
+                        ('load_profile', args.load_profile),
+                        ('workers', args.workers),
+                        ('batch_size', args.batch_size),
+                        ('incremental', args.incremental),
+                        ('status', 'failed')])
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    saved_pragmas = None
+    try:
+        saved_pragmas = apply_load_profile(conn, args.load_profile)
+        _create_tables(conn, cfg)
+        # Indexes are used for merging records in incremental mode
+        fast_load = args.load_profile == 'fast' and not args.incremental
+        if fast_load:
+            # Indexes are built once the data is loaded (or the load failed)
+            indexes = drop_secondary_indexes(conn)
+        try:
             # Populate client's data
-            populate_client_data(conn, cfg['Client'])
+            insert_batch_size = cfg['Parameters'].get('InsertBatchSize')
+            cache = None
+            if 'ParseCache' in cfg['Parameters'] and not args.no_cache:
+                cache = ParseCache(
+                    cfg['Parameters']['ParseCache']['Directory'],
+                    cfg['Parameters']['ParseCache']['MaxSizeMB'])
+            with _phase('Populating client\'s data'):
+                first_day = populate_client_data(
+                    conn, cfg['Client'], args.batch_size, insert_batch_size,
+                    args.incremental, args.workers, cache,
+                    cfg['Parameters'].get('TimeZone', 'UTC'))
             # Create some utility tables
-            create_utility_tables(conn, cfg['Parameters']['StartDate'],
-                                  cfg['Parameters']['EndDate'],
-                                  cfg['Parameters']['StartPeak'],
-                                  cfg['Parameters']['EndPeak'])
-    except ClientDataError:
-        logger.error('** Error in parsing client\'s data.')
-        if conn:
-            conn.close()
-        sys.exit(2)
+            _create_calendar(conn, cfg)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if fast_load:
+                with _phase('Building indexes and statistics'):
+                    create_indexes(conn, indexes)
+        # Check the historical data against the calendar
+        report.info['data_quality'] = _check_data(conn, cfg,
+                                                  args.fail_on_issues)
+        # Join the historical data (only the days that changed in
+        # incremental mode)
+        products = cfg.get('Analytics', {}).get('Products')
+        if not args.incremental or first_day is not None:
+            with _phase('Refreshing fact tables'):
+                refresh_fact_hourly(conn, products,
+                                    first_day if args.incremental
+                                    else None)
+        # Compute the dispatch margins of the plants
+        if 'Analytics' in cfg:
+            with _phase('Computing dispatch margins'):
+                create_dispatch_margins(conn, cfg['Analytics']['Plants'],
+                                        insert_batch_size)
+            with _phase('Computing optimal commitment'):
+                create_commitment(conn, cfg['Analytics']['Plants'],
+                                  insert_batch_size, args.workers)
+        # Simulate the margins of the plants
+        if 'Simulation' in cfg.get('Analytics', {}):
+            with _phase('Simulating margins'):
+                create_simulated_margins(
+                    conn, cfg['Analytics']['Plants'],
+                    cfg['Analytics']['Simulation'],
+                    cfg['Parameters'].get('Seasons', 'northern'),
+                    cfg['Parameters'].get('Interval', 60),
+                    insert_batch_size, args.workers)
+        # Aggregate the facts and margins by day and period
+        if not args.incremental or first_day is not None:
+            with _phase('Refreshing rollup tables'):
+                refresh_rollups(conn, first_day if args.incremental
+                                else None)
+        # Tell the readers that the data changed
+        if not args.incremental or first_day is not None:
+            version = record_load(conn, args.incremental, first_day)
+            logger.info('. Load version {}'.format(version))
+            report.info['load_version'] = version
+        if args.export_store:
+            with _phase('Exporting time series'):
+                export_store(conn, args.export_store,
+                             cfg['Parameters']['StartDate'],
+                             cfg['Parameters']['EndDate'],
+                             cfg['Parameters'].get('TimeZone', 'UTC'),
+                             cfg['Parameters'].get('Interval', 60))
+        report.info['status'] = 'done'
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if saved_pragmas is not None:
+            restore_pragmas(conn, saved_pragmas, args.wal)
+        if args.profile:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            logger.info('. cProfile statistics written into \'{}\''
+                        .format(args.profile))
+        if args.report:
+            write_report(args.report)
+            logger.info('. Run report written into \'{}\''
+                        .format(args.report))
 
-    except UtilTablesError:
-        logger.error('** Error in creating utility tables.')
-        if conn:
-            conn.close()
-        sys.exit(2)
 
+def make_dataset():
+    '''
+    Implementation of make_dataset.
+    '''
+    args = _parse_args(sys.argv[1:])
+
+    if args.verbose:
+        logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    _intro()
+
+    # Read the various paramters from the configuration file
+    cfg = _read_config(args.config.name, args.command)
+
+    # Open a connection to the database
+    conn = sqlite3.connect(args.database.name)
+    try:
+        {"create-db": create_db, "load": load, "calendar": calendar,
+         "validate": validate}[args.command](conn, cfg, args)
+    except Exception as err:
+        message = _error_message(err)
+        if message is None:
+            raise
+        logger.error(message)
+        sys.exit(2)
     finally:
-        if conn:
-            conn.close()
+        conn.close()
 
 
 if __name__ == "__main__":
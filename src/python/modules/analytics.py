@@ -0,0 +1,275 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- analytics.py --
+
+Provides subroutines for computing the clean spark spreads ("CSS") and the
+dispatch margins of gas-fired power plants from the historical data of the
+SQL database.
+
+CSS is defined as follows:
+
+    p^P - (p^G + tc + p^C * cf / 2204.62) * hr / 1e3 - om
+
+where p^P, p^G and p^C are the power ($/MWh), gas ($/mmBtu) and carbon
+($/tonne) prices, tc the gas transportation cost ($/mmBtu), cf the carbon
+factor (lb/mmBtu), hr the heat rate (btu/kWh) and om the variable O&M
+($/MWh).
+
+All the calculations work on aligned NumPy arrays and broadcast, e.g.,
+passing plant's attributes of shape (n, 1) computes n plants (or
+scenarios) at once.
+
+To do:
+  - None at the moment
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+
+from modules.bulk_writer import BulkWriter
+
+logger = logging.getLogger('make_dataset')
+
+# Pounds per metric tonne
+LB_PER_TONNE = 2204.62
+
+
+class AnalyticsError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+    pass
+
+
+def clean_spark_spread(power, gas, carbon, heatrate, om, tc=0.0,
+                       emission=0.0):
+    '''
+    Returns the clean spark spread ($/MWh) of a plant running at a heat rate
+    heatrate (btu/kWh) with a variable O&M om ($/MWh).
+    '''
+    power, gas, carbon = \
+        np.asarray(power), np.asarray(gas), np.asarray(carbon)
+    return power - (gas + tc + carbon * emission / LB_PER_TONNE) \
+        * heatrate / 1e3 - om
+
+
+def interpolate_css(generation, powermin, powermax, duct, css_pmin,
+                    css_pmax, css_duct):
+    '''
+    Returns the clean spark spread when producing generation (MWh/h),
+    linearly interpolated between the spreads at pmin, pmax and duct.
+    '''
+    generation = np.asarray(generation, dtype=np.float64)
+    return np.select(
+        [generation < powermin, generation < powermax, generation < duct],
+        [css_pmin,
+         _interpolate(powermin, powermax, css_pmin, css_pmax, generation),
+         _interpolate(powermax, duct, css_pmax, css_duct, generation)],
+        css_duct)
+
+
+def _interpolate(p1, p2, css1, css2, p):
+    '''
+    Gets css through linear interpolation.
+    '''
+    return (css2 - css1) / (p2 - p1) * (p - p1) + css1
+
+
+def actual_margin(generation, powermin, powermax, duct, css_pmin, css_pmax,
+                  css_duct):
+    '''
+    Returns the margin ($) realized by producing generation (MWh/h).
+    '''
+    return interpolate_css(generation, powermin, powermax, duct, css_pmin,
+                           css_pmax, css_duct) * generation
+
+
+def optimal_margin(powermax, duct, css_pmax, css_duct):
+    '''
+    Returns the margin ($) of the optimal dispatch, i.e., the plant runs at
+    pmax or duct when it is profitable and is off otherwise.
+    '''
+    return np.maximum(np.maximum(css_pmax * powermax, css_duct * duct), 0.0)
+
+
+def dispatch_margins(inputs, plant):
+    '''
+    Computes the clean spark spreads, the actual and optimal margins and the
+    dispatch opportunity (optimal less actual margin) of a plant given its
+    hourly inputs (power, gas, carbon and generation arrays). plant is a
+    dictionary of the attributes of tbl_ref_power_plants plus om_pmin, om,
+    om_duct, tc and emission.
+    '''
+    css = {
+        level: clean_spark_spread(inputs['power'], inputs['gas'],
+                                  inputs['carbon'], plant[heatrate],
+                                  plant[om], plant['tc'], plant['emission'])
+        for level, heatrate, om in (('pmin', 'heatrate_pmin', 'om_pmin'),
+                                    ('pmax', 'heatrate', 'om'),
+                                    ('duct', 'heatrate_duct', 'om_duct'))}
+    act_margin = actual_margin(inputs['generation'], plant['powermin'],
+                               plant['powermax'], plant['duct'],
+                               css['pmin'], css['pmax'], css['duct'])
+    opt_margin = optimal_margin(plant['powermax'], plant['duct'],
+                                css['pmax'], css['duct'])
+    return {
+        "css_pmin": css['pmin'],
+        "css_pmax": css['pmax'],
+        "css_duct": css['duct'],
+        "act_margin": act_margin,
+        "opt_margin": opt_margin,
+        "opportunity": opt_margin - act_margin
+    }
+
+
+def read_hourly_inputs(conn, plant_id):
+    '''
+    Reads the hourly power, gas and carbon prices and generation of a plant
+    from tbl_fact_hourly and returns them as aligned arrays (one value per
+    hour in UTC in key 'datehour_utc', local hour in key 'datehour').
+    Missing prices are linearly interpolated (daily prices by day) and only
+    the hours having all the inputs are kept.
+    '''
+    df = pd.read_sql_query(
+        'select datehour_utc, datehour, date, power, gas, carbon, generation '
+        'from tbl_fact_hourly where plant_id = ? order by datehour_utc;',
+        conn, params=(plant_id, ))
+    if df.empty:
+        logger.error('** No generation for plant {} in tbl_fact_hourly.'
+                     .format(plant_id))
+        raise AnalyticsError
+    datehours = pd.to_datetime(df['datehour_utc']).values
+    dates = pd.to_datetime(df['date']).values
+    power = _fill(pd.Series(df['power'].values, index=datehours), 'h')
+    gas = _fill(pd.Series(df['gas'].values, index=dates), 'D')
+    carbon = _fill(pd.Series(df['carbon'].values, index=dates), 'D')
+    inputs = {
+        "datehour_utc": datehours,
+        "datehour": pd.to_datetime(df['datehour']).values,
+        "power": power.reindex(datehours).values,
+        "gas": gas.reindex(dates).values,
+        "carbon": carbon.reindex(dates).values,
+        "generation": df['generation'].values.astype(np.float64)
+    }
+    keep = ~(np.isnan(inputs['power']) | np.isnan(inputs['gas']) |
+             np.isnan(inputs['carbon']))
+    return dict((col, values[keep]) for col, values in inputs.items())
+
+
+def _fill(series, freq):
+    '''
+    Resizes a series to all the periods (of frequency freq) between its first
+    and last values and linearly interpolates the missing ones.
+    '''
+    series = series[~series.index.duplicated()].dropna()
+    if series.empty:
+        return series
+    index = pd.date_range(series.index[0], series.index[-1], freq=freq)
+    return series.reindex(index).interpolate(method='time')
+
+
+def create_dispatch_margins(conn, plants, insert_batch_size=None):
+    '''
+    Populates tbl_calc_dispatch_margins with the hourly clean spark spreads
+    and margins of each plant of dictionary plants, which gives by plant's
+    name the attributes not found in the database (OMPmin, OM, OMDuct,
+    TransportCost and CarbonFactor). Inputs are read from tbl_fact_hourly.
+    '''
+    logger.info('. Computing dispatch margins')
+    with BulkWriter(conn, insert_batch_size) as writer:
+        cursor = conn.cursor()
+        for name, attributes in plants.items():
+            plant = get_plant(cursor, name, attributes)
+            cursor.execute('delete from tbl_calc_dispatch_margins '
+                           'where plant_id = ?;', (plant['id'],))
+            inputs = read_hourly_inputs(conn, plant['id'])
+            margins = dispatch_margins(inputs, plant)
+            writer.insert_arrays('tbl_calc_dispatch_margins', dict({
+                "datehour_utc": inputs['datehour_utc'],
+                "datehour": inputs['datehour'],
+                "plant_id": plant['id'],
+                "power": inputs['power'],
+                "gas": inputs['gas'],
+                "carbon": inputs['carbon'],
+                "generation": inputs['generation']
+            }, **margins))
+            _report(name, inputs['datehour'], margins)
+
+
+def get_plant(cursor, name, attributes):
+    '''
+    Returns the attributes of plant name from tbl_ref_power_plants combined
+    with the ones given in the configuration file: variable O&M, transport
+    cost and carbon factor, and the start cost and minimum uptime and
+    downtime used by the commitment (by default, 0, 1 and 1).
+    '''
+    cursor.execute('select * from tbl_ref_power_plants where name = ?;',
+                   (name,))
+    row = cursor.fetchone()
+    if row is None:
+        logger.error('** Plant {} not found in tbl_ref_power_plants.'
+                     .format(name))
+        raise AnalyticsError
+    plant = dict(zip([d[0] for d in cursor.description], row))
+    try:
+        plant.update({
+            "om_pmin": float(attributes['OMPmin']),
+            "om": float(attributes['OM']),
+            "om_duct": float(attributes['OMDuct']),
+            "tc": float(attributes.get('TransportCost', 0.0)),
+            "emission": float(attributes.get('CarbonFactor', 0.0)),
+            "start_cost": float(attributes.get('StartCost', 0.0)),
+            "min_up": int(attributes.get('MinUpTime', 1)),
+            "min_down": int(attributes.get('MinDownTime', 1))
+        })
+    except (KeyError, TypeError, ValueError) as err:
+        logger.error('** Invalid attributes for plant {}: {}.'
+                     .format(name, err))
+        raise AnalyticsError
+    return plant
+
+
+def _report(name, datehours, margins):
+    '''
+    Logs the yearly optimal and actual margins and dispatch opportunity.
+    '''
+    years = datehours.astype('datetime64[Y]').astype(int) + 1970
+    for year in np.unique(years):
+        in_year = years == year
+        logger.info('.. {} {}: optimal ${:,.2f}M, actual ${:,.2f}M, '
+                    'opportunity ${:,.2f}M'.format(
+                        name, year,
+                        margins['opt_margin'][in_year].sum() / 1e6,
+                        margins['act_margin'][in_year].sum() / 1e6,
+                        margins['opportunity'][in_year].sum() / 1e6))
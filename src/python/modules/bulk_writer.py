@@ -0,0 +1,184 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- bulk_writer.py --
+
+Provides a bulk writer inserting records into the SQL database with prepared
+statements (cursor.executemany) within a single transaction.
+
+To do:
+  - None at the moment
+"""
+
+import time
+import logging
+from itertools import islice
+from itertools import repeat
+import numpy as np
+
+from modules.instrumentation import count_rows
+
+logger = logging.getLogger('make_dataset')
+
+DEFAULT_BATCH_SIZE = 50000
+
+
+class BulkWriterError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+
+
+class BulkWriter(object):
+    '''
+    Inserts records into the database by batches of batch_size rows. All the
+    records inserted within a "with" block are written in a single
+    transaction which is rolled back if an error occurs.
+
+    Example:
+        with BulkWriter(conn) as writer:
+            writer.insert_arrays('tbl_hist_generation', {
+                "datehour_utc": utc,    # datetime64 arrays
+                "datehour": datehours,
+                "dst": dst,
+                "plant_id": 10000,      # scalar repeated over all rows
+                "generation": values})
+    '''
+
+    def __init__(self, conn, batch_size=DEFAULT_BATCH_SIZE):
+        self.conn = conn
+        self.batch_size = batch_size if batch_size else DEFAULT_BATCH_SIZE
+        self.stats = dict()  # Rows written and time spent per table
+
+    def __enter__(self):
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.conn.execute('begin;')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.conn.commit()
+            self.report()
+        else:
+            self.conn.rollback()
+        return False
+
+    def insert_rows(self, table, columns, rows):
+        '''
+        Inserts rows (an iterable of tuples whose values are ordered as
+        columns) into table and returns the number of rows inserted.
+        '''
+        statement = 'insert into {} ({}) values ({});'.format(
+            table, ', '.join(columns), ', '.join('?' * len(columns)))
+        cursor = self.conn.cursor()
+        rows = iter(rows)
+        nb_rows = 0
+        start = time.perf_counter()
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                break
+            try:
+                cursor.executemany(statement, batch)
+            except Exception as err:
+                raise BulkWriterError(
+                    'Cannot insert records into {}: {}'.format(table, err))
+            nb_rows += len(batch)
+        elapsed = time.perf_counter() - start
+        count_rows(rows_out=nb_rows)
+        prev_rows, prev_elapsed = self.stats.get(table, (0, 0.0))
+        self.stats[table] = (prev_rows + nb_rows, prev_elapsed + elapsed)
+        return nb_rows
+
+    def insert_arrays(self, table, data):
+        '''
+        Inserts columnar data into table where data maps each column name to
+        an array-like (e.g., NumPy array, Series) or to a scalar repeated
+        over all the rows.
+        '''
+        columns = list(data.keys())
+        nb_rows = max([len(val) for val in data.values()
+                       if not np.isscalar(val)] or [0])
+        values = [repeat(to_sql_scalar(val), nb_rows) if np.isscalar(val)
+                  else to_sql_values(val) for val in data.values()]
+        return self.insert_rows(table, columns, zip(*values))
+
+    def insert_frame(self, table, df):
+        '''
+        Inserts the rows of a dataframe into table.
+        '''
+        return self.insert_arrays(
+            table, dict((col, df[col]) for col in df.columns))
+
+    def report(self):
+        '''
+        Logs the number of rows written per table and the throughput.
+        '''
+        for table, (nb_rows, elapsed) in self.stats.items():
+            logger.info('.. {:,} rows written into {} ({:,.0f} rows/s)'
+                        .format(nb_rows, table,
+                                nb_rows / elapsed if elapsed else 0))
+
+
+def to_sql_values(values):
+    '''
+    Converts an array-like into a list of values that sqlite3 can bind.
+    Timestamps are written as 'YYYY-MM-DD HH:MM:SS' and NaN as NULL.
+    '''
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        strings = np.datetime_as_string(values.astype('datetime64[s]'))
+        strings = np.char.replace(strings, 'T', ' ').astype(object)
+        strings[np.isnat(values)] = None
+        return strings.tolist()
+    if values.dtype.kind == 'O':
+        return [to_sql_scalar(val) for val in values]
+    return values.tolist()
+
+
+def to_sql_scalar(val):
+    '''
+    Converts a scalar into a value that sqlite3 can bind.
+    '''
+    if val is None:
+        return None
+    if isinstance(val, np.datetime64):
+        return to_sql_values(np.array([val]))[0]
+    if hasattr(val, 'strftime'):
+        return val.strftime('%Y-%m-%d %H:%M:%S') \
+            if val == val else None  # NaT is not equal to itself
+    if isinstance(val, np.generic):
+        val = val.item()
+    if isinstance(val, float) and val != val:
+        return None
+    return val
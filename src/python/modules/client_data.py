@@ -40,16 +40,67 @@ To do:
 """
 
 import os
+import glob
+import fnmatch
 import datetime
-import math
 import logging
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+from functools import partial
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ERROR_CODES
 
+from modules.bulk_writer import BulkWriter
+from modules.bulk_writer import to_sql_scalar
+from modules.bulk_writer import to_sql_values
+from modules.data_quality import write_duplicates
+from modules.data_quality import clear_duplicates
+from modules.incremental import file_digest
+from modules.incremental import get_source
+from modules.incremental import record_source
+from modules.incremental import create_staging_table
+from modules.incremental import merge_staging_table
+from modules.instrumentation import stage
+from modules.instrumentation import count_rows
 from modules.utils import Months
-from modules.utils import convert_to_numeric
+from modules.utils import coerce_numeric
+from modules.utils import to_utc
 
 logger = logging.getLogger('make_dataset')
 
+# A sheet of a client's file loaded into table where header_row is the row
+# of the headers (0-based) followed by skip_rows ignored rows, select a tuple
+# (column, values) restricting the rows to those of the series (None for all
+# the rows), key a tuple (column, id) identifying the series (e.g.,
+# ('product_id', 1101)), time_col the column of the period and transform a
+# (picklable) function building the records from the rows of the sheet.
+# date_col is the column of the dates in the sheet (None if detected),
+# columns the columns needed (None for all of them) and period a tuple
+# (first day, last day) of the records kept (None for all the records)
+SheetSource = namedtuple('SheetSource', [
+    'f_in_name', 'sheet_name', 'header_row', 'skip_rows', 'select', 'table',
+    'key', 'time_col', 'transform', 'description', 'date_col', 'columns',
+    'period'])
+
+# Cells read as missing values when streaming (pandas' default NA strings
+# and Excel's error codes)
+MISSING_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null']) | frozenset(ERROR_CODES)
+
+
+# Keys of the specification of a source of client's data (see
+# _spec_sources)
+SPEC_KEYS = frozenset([
+    'Name', 'Layout', 'Files', 'Sheet', 'HeaderRow', 'SkipRows',
+    'DateColumn', 'ValueColumn', 'Table', 'Series', 'SeriesColumn',
+    'StartDate', 'EndDate'])
+
 
 class ClientDataError(Exception):
     '''
@@ -57,208 +108,931 @@ class ClientDataError(Exception):
     '''
 
 
-def populate_client_data(conn, parameters):
+class ReferenceIds(object):
+    '''
+    IDs of the products and plants by name, each reference table being read
+    once per run.
+    '''
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.ids = dict()
+
+    def get(self, table, column, value):
+        '''
+        Returns the ID of a product or a plant from a reference table.
+        '''
+        if (table, column) not in self.ids:
+            self.cursor.execute('select {}, id from {};'.format(column, table))
+            self.ids[(table, column)] = dict(self.cursor.fetchall())
+        if value not in self.ids[(table, column)]:
+            logger.error('** Cannot find \'{}\' in {}.'.format(value, table))
+            raise ClientDataError
+        return self.ids[(table, column)][value]
+
+
+def populate_client_data(conn, parameters, batch_size=0,
+                         insert_batch_size=None, incremental=False,
+                         workers=1, cache=None, timezone='UTC'):
     '''
     Populates the SQL database with client's data.
+
+    The sheets loaded are declared in parameters['Sources'] (see
+    _spec_sources); the entries 'Prices' and 'Generation' of earlier
+    configurations are still read (see _legacy_specs).
+
+    Hourly data are given in local time of the market (timezone, e.g.,
+    'US/Pacific') and stored by hour in UTC (see utils.to_utc) along with
+    their local hour and DST flag.
+
+    When batch_size is positive, workbooks are streamed by batches of
+    batch_size rows: each batch is transformed and inserted before the next
+    one is read, so memory does not grow with the size of the files. The
+    rows of a day are kept in the same batch (see _whole_days) so streamed
+    and whole loads write the same records.
+
+    All the records are written in a single transaction by batches of
+    insert_batch_size rows.
+
+    In incremental mode, the sources that did not change since the last load
+    are skipped and only the new or changed days of the others are written.
+
+    Records of a series given more than once for a period are written into
+    tbl_dq_issues (see data_quality) and only the first one is loaded.
+
+    When workers is greater than 1, the sheets are parsed and transformed by
+    a pool of workers processes while this process remains the only one
+    writing into the database.
+
+    With a parse cache (see ParseCache), the sheets of files that did not
+    change since they were last parsed are read from the cache.
+
+    Returns the first day ('YYYY-MM-DD') whose records were written, None if
+    nothing changed.
     '''
     logger.info('. Populating data associated with generating assets')
-    cursor = conn.cursor()
-    _populate_hourly_prices(conn, cursor, parameters['Prices']['Hourly'])
-    _populate_daily_prices(conn, cursor, parameters['Prices']['Daily'])
-    _populate_generation(conn, cursor, parameters['Generation'])
+    try:
+        pd.Timestamp('2000-01-01').tz_localize(timezone)
+    except (KeyError, ValueError, TypeError):
+        logger.error('** Unknown time zone \'{}\'.'.format(timezone))
+        raise ClientDataError
+    with BulkWriter(conn, insert_batch_size) as writer:
+        cursor = conn.cursor()
+        sources = _client_sources(cursor, parameters, timezone)
+        return _load_sources(writer, cursor, sources, batch_size,
+                             incremental, workers, cache)
 
 
-def _populate_hourly_prices(conn, cursor, parameters):
+def _client_sources(cursor, parameters, timezone='UTC'):
     '''
-    Populates hourly prices.
+    Lists the sheets of client's data given in the configuration.
+    '''
+    ids = ReferenceIds(cursor)
+    specs = parameters['Sources'] if 'Sources' in parameters \
+        else _legacy_specs(parameters)
+    sources = list()
+    for spec in specs:
+        sources.extend(_spec_sources(ids, spec, timezone))
+    return sources
+
+
+def _spec_sources(ids, spec, timezone='UTC'):
+    '''
+    Lists the sheets of a source of client's data given by its
+    specification, a dictionary with the keys:
+      - Layout: layout of the sheets (see LAYOUTS);
+      - Files: pattern of the files (e.g., 'data/generation *.xlsx') or list
+        of patterns; Excel, CSV and Parquet files are read according to
+        their extension (see READERS);
+      - Sheet: name of the sheet, the first one by default (Excel only);
+      - HeaderRow: row of the headers (0-based), default 0 (Excel and CSV);
+      - SkipRows: number of rows ignored after the headers, default 0 (Excel
+        and CSV);
+      - DateColumn and ValueColumn: column (header or 0-based index) of the
+        dates and values, defaults depending on the layout;
+      - Table: table loaded, default depending on the layout;
+      - Series: name of the product or plant (e.g., 'DAH', 'PP') or a
+        mapping of names: by value of SeriesColumn (e.g., {NODE_ABC: DAH})
+        if given, otherwise by pattern of the file names (e.g.,
+        {'generation PP2*': PP2});
+      - SeriesColumn: column identifying the series in the sheets;
+      - StartDate and EndDate: first and last days loaded, all the days by
+        default;
+      - Name: description used in the log.
+    '''
+    unknown = set(spec) - SPEC_KEYS
+    if unknown or 'Layout' not in spec or 'Files' not in spec or \
+            'Series' not in spec:
+        logger.error('** Invalid source {} (missing or unknown keys).'
+                     .format(spec))
+        raise ClientDataError
+    if spec['Layout'] not in LAYOUTS:
+        logger.error('** Unknown layout \'{}\' (expected one of {}).'
+                     .format(spec['Layout'], ', '.join(sorted(LAYOUTS))))
+        raise ClientDataError
+    layout = LAYOUTS[spec['Layout']]
+    patterns = spec['Files'] if isinstance(spec['Files'], list) \
+        else [spec['Files']]
+    f_in_names = sorted(set(f_in_name for pattern in patterns
+                            for f_in_name in glob.glob(pattern)))
+    if not f_in_names:
+        logger.error('** No file matches {}.'.format(', '.join(patterns)))
+        raise ClientDataError
+    keywords = dict((arg, spec.get(key, default))
+                    for key, (arg, default) in layout.columns.items())
+    if layout.local_time:
+        keywords['timezone'] = timezone
+    date_col = keywords['date_col']
+    period = None
+    if 'StartDate' in spec or 'EndDate' in spec:
+        period = tuple(str(spec[key]) if spec.get(key) is not None else None
+                       for key in ('StartDate', 'EndDate'))
+
+    sources = list()
+    for f_in_name in f_in_names:
+        for name, select in _series(spec, f_in_name):
+            series_id = ids.get(layout.ref_table, layout.ref_col, name)
+            keywords[layout.key_col] = series_id
+            # Columns read from columnar files (by name only)
+            columns = None
+            if 'ValueColumn' in layout.columns:
+                columns = [date_col, spec.get(
+                    'ValueColumn', layout.columns['ValueColumn'][1])] + \
+                    ([select[0]] if select is not None else [])
+                if not all(isinstance(col, str) for col in columns):
+                    columns = None
+            sources.append(SheetSource(
+                f_in_name, spec.get('Sheet'), spec.get('HeaderRow', 0),
+                spec.get('SkipRows', 0), select,
+                spec.get('Table', layout.table), (layout.key_col, series_id),
+                layout.time_col, partial(layout.transform, **keywords),
+                '{} ({})'.format(spec.get('Name', spec['Layout']), name),
+                date_col, tuple(columns) if columns else None, period))
+    return sources
+
+
+def _series(spec, f_in_name):
+    '''
+    Returns the series (name, select) of a file of a source (see
+    _spec_sources and SheetSource).
+    '''
+    if not isinstance(spec['Series'], dict):
+        return [(spec['Series'], None)]
+    series = dict()
+    if 'SeriesColumn' in spec:
+        for value, name in spec['Series'].items():
+            series.setdefault(name, list()).append(value)
+        return [(name, (spec['SeriesColumn'], tuple(values)))
+                for name, values in sorted(series.items())]
+    names = [name for pattern, name in spec['Series'].items()
+             if fnmatch.fnmatch(os.path.basename(f_in_name), pattern)]
+    if not names:
+        logger.warning('** Warning: no series for \'{}\' (skipped).'
+                       .format(f_in_name))
+    return [(name, None) for name in sorted(set(names))]
+
+
+def _legacy_specs(parameters):
+    '''
+    Returns the specifications of the sources given by the entries 'Prices'
+    (files of hourly and daily prices) and 'Generation' (files of PP or
+    dictionaries {File: ..., Plant: ...}) of earlier configurations.
+    '''
+    specs = list()
+    for f_in_name in parameters['Prices']['Hourly']:
+        specs.append({"Name": 'power spot prices', "Layout": 'hourly_prices',
+                      "Files": glob.escape(f_in_name), "Series": 'DAH'})
+    for f_in_name in parameters['Prices']['Daily']:
+        specs.append({"Name": 'gas cash prices', "Layout": 'daily_prices',
+                      "Files": glob.escape(f_in_name), "Sheet": 'Gas',
+                      "SkipRows": 3, "DateColumn": 3, "ValueColumn": 4,
+                      "Series": 'Z1'})
+        specs.append({"Name": 'carbon prices', "Layout": 'daily_prices',
+                      "Files": glob.escape(f_in_name), "Sheet": 'Carbon',
+                      "SkipRows": 4, "DateColumn": 0, "ValueColumn": 1,
+                      "Series": 'Carbon'})
+    for entry in parameters['Generation']:
+        if not isinstance(entry, dict):
+            entry = {"File": entry}
+        specs.append({"Name": 'generation', "Layout": 'generation',
+                      "Files": glob.escape(entry['File']), "SkipRows": 3,
+                      "Series": entry.get('Plant', 'PP')})
+    return specs
+
+
+def _load_sources(writer, cursor, sources, batch_size=0, incremental=False,
+                  workers=1, cache=None):
+    '''
+    Loads a list of sources (see SheetSource).
+
+    In incremental mode, the sources whose file did not change since the last
+    load are skipped (each file being hashed once); the records of the others
+    are staged and merged (see merge_staging_table). Otherwise, all the
+    records of the series loaded are deleted first and files are not hashed.
+
+    With a parse cache (see ParseCache), the records of a sheet already
+    parsed are read from the cache instead of the client's file, batch by
+    batch.
+
+    Returns the first day whose records were written (None if none).
     '''
-    f_in_name = parameters[0]  # There is only one file
+    pending = list()
+    first_days = list()
+    digests = dict()  # Content hashes by file (incremental mode only)
+    for source in sources:
+        digest, state = None, None
+        if incremental:
+            if source.f_in_name not in digests:
+                digests[source.f_in_name] = file_digest(source.f_in_name)
+            digest = digests[source.f_in_name]
+            state = get_source(cursor, source.f_in_name, source.sheet_name,
+                               source.table, source.key[1])
+            if state is not None and state[0] == digest:
+                logger.info('.. Skipping {} from \'{}\' (unchanged)'.format(
+                    source.description, os.path.basename(source.f_in_name)))
+                continue
+        pending.append((source, digest, state))
 
-    # -- Power prices --
+    for table, key in sorted(set((src.table, src.key)
+                                 for src, _, _ in pending)):
+        clear_duplicates(cursor, table, key)
 
-    logger.info('.. Reading \'{}\''.format(os.path.basename(f_in_name)))
+    if not incremental:
+        # Delete any previous records
+        for table, (key_col, key_id) in \
+                sorted(set((src.table, src.key) for src in sources)):
+            cursor.execute('delete from {} where {} = ?;'
+                           .format(table, key_col), (key_id, ))
 
-    # Put all the data into a dataframe
-    df = pd.read_excel(f_in_name)
+    if cache is not None:
+        to_parse = list()
+        for source, digest, state in pending:
+            key = cache.key(source)
+            batches = cache.get(key)
+            if batches is None:
+                to_parse.append((source, digest, state, key))
+                continue
+            logger.info('.. Reading {} from the parse cache'
+                        .format(source.description))
+            first_days.append(_write_source(writer, cursor, source, digest,
+                                            state, batches, incremental))
+    else:
+        to_parse = [(source, digest, state, None)
+                    for source, digest, state in pending]
 
-    # Get product ID's
-    cursor.execute(
+    # Each file is opened once for all its sources
+    by_file = OrderedDict()
+    for item in to_parse:
+        by_file.setdefault(item[0].f_in_name, list()).append(item)
+
+    if workers > 1 and len(by_file) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = dict(
+                (pool.submit(_parse_file, [item[0] for item in items],
+                             batch_size), items)
+                for items in by_file.values())
+            for future in as_completed(futures):
+                for (source, digest, state, key), arrays in \
+                        zip(futures[future], future.result()):
+                    first_days.append(_write_source(writer, cursor, source,
+                                                    digest, state, [arrays],
+                                                    incremental))
+                    if key is not None:
+                        entry = cache.put(key)
+                        entry.write(arrays)
+                        entry.close()
+    else:
+        for f_in_name, items in by_file.items():
+            with open_client_file(f_in_name, batch_size) as reader:
+                for source, digest, state, key in items:
+                    batches = _iter_sheet(reader, source)
+                    if key is not None:
+                        batches = _caching(cache, key, batches)
+                    first_days.append(_write_source(writer, cursor, source,
+                                                    digest, state, batches,
+                                                    incremental))
+
+    first_days = [day for day in first_days if day is not None]
+    return min(first_days) if first_days else None
+
+
+def _iter_sheet(reader, source):
+    '''
+    Reads a source from its file (see open_client_file) and yields its
+    records as dictionaries of arrays (one per column), one per batch of
+    rows.
+    '''
+    logger.info('.. Reading {} from \'{}\''.format(
+        source.description, os.path.basename(source.f_in_name)))
+    frames = reader.read_sheet(source.sheet_name, source.header_row,
+                               source.skip_rows, source.date_col,
+                               source.columns, source.period)
+    if reader.batch_size > 0:
+        frames = _whole_days(frames, source.date_col)
+    for df in frames:
+        if source.select is not None:
+            column, values = source.select
+            df = df[_column(df, column).isin(values).to_numpy()]
+        df2 = source.transform(df)
+        if source.period is not None:
+            df2 = _in_period(df2, source.period)
+        yield dict((col, df2[col].to_numpy()) for col in df2.columns)
+
+
+def _whole_days(frames, date_col=None):
+    '''
+    Regroups batches of rows of a sheet (dataframes) so that the rows of a
+    day are never split between two batches: the rows of the last day of a
+    batch are carried over to the next one. The records of a day (e.g., the
+    prices of several nodes, the hour repeated when DST ends) can then be
+    built from a single batch. The rows of a day must be consecutive; the
+    column of the dates (see _column) is detected if date_col is None.
+    '''
+    carried = None
+    for df in frames:
+        if carried is not None:
+            df = pd.concat([carried, df])
+            carried = None
+        days = _row_days(df, _date_column(df) if date_col is None
+                         else date_col)
+        valid = np.flatnonzero(~np.isnat(days))
+        if not len(valid):
+            yield df
+            continue
+        start = np.argmax(days == days[valid[-1]])
+        if start > 0:
+            yield df.iloc[:start]
+        carried = df.iloc[start:]
+    if carried is not None:
+        yield carried
+
+
+def _row_days(df, column):
+    '''
+    Returns the day of each row of a dataframe from its column of dates (see
+    _column), NaT for the rows without a date.
+    '''
+    values = _column(df, column)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.normalize().to_numpy(dtype='datetime64[ns]')
+    days = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    valid = _datetime_mask(values, datetime.date)
+    if valid.any():
+        days[valid] = pd.to_datetime(values[valid]).dt.normalize() \
+            .to_numpy(dtype='datetime64[ns]')
+    return days
+
+
+def _parse_file(sources, batch_size=0):
+    '''
+    Reads the sources of a workbook and returns the records of each of them
+    as a dictionary of arrays (used by the workers processes).
+    '''
+    with open_client_file(sources[0].f_in_name, batch_size) as reader:
+        return [_concatenate(list(_iter_sheet(reader, source)))
+                for source in sources]
+
+
+def _concatenate(batches):
+    '''
+    Concatenates batches of records (dictionaries of arrays).
+    '''
+    if not batches:
+        return dict()
+    return dict((col, np.concatenate([batch[col] for batch in batches]))
+                for col in batches[0])
+
+
+def _caching(cache, key, batches):
+    '''
+    Yields batches of records and writes them into the parse cache as they
+    go (see CacheWriter), the entry being stored once all of them have been
+    consumed.
+    '''
+    entry = cache.put(key)
+    try:
+        for batch in batches:
+            entry.write(batch)
+            yield batch
+        entry.close()
+    finally:
+        entry.discard()
+
+
+def _write_source(writer, cursor, source, digest, state, batches,
+                  incremental=False):
+    '''
+    Writes the records of a source (batches of dictionaries of arrays) and
+    records the source in the metadata table. Records whose period was
+    already written for the series are dropped and written into
+    tbl_dq_issues (see _duplicates). Returns the first day whose records
+    were written (None if none).
+    '''
+    target = create_staging_table(cursor, source.table, source.key[0],
+                                  source.time_col) \
+        if incremental else source.table
+    watermark = None
+    first = None
+    nb_duplicates = 0
+    batches = iter(batches)
+    while True:
+        # Reading and transforming the sheet (done by the workers processes
+        # beforehand if any)
+        with stage('read'):
+            batch = next(batches, None)
+            if batch:
+                count_rows(rows_in=len(batch[source.time_col]))
+        if batch is None:
+            break
+        if not batch or not len(batch[source.time_col]):
+            continue
+        with stage('write'):
+            duplicate = _duplicates(cursor, target, source, batch)
+            if duplicate.any():
+                nb_duplicates += int(duplicate.sum())
+                write_duplicates(
+                    writer, cursor, source.table, source.key,
+                    source.time_col,
+                    dict((col, val[duplicate]) for col, val in batch.items()),
+                    os.path.basename(source.f_in_name))
+                batch = dict((col, val[~duplicate])
+                             for col, val in batch.items())
+            writer.insert_arrays(target, batch)
+        latest = to_sql_scalar(np.max(batch[source.time_col]))
+        watermark = latest if watermark is None else max(watermark, latest)
+        earliest = to_sql_scalar(np.min(batch[source.time_col]))
+        first = earliest if first is None else min(first, earliest)
+    if nb_duplicates:
+        logger.warning('** Warning: {:,} duplicate record(s) of {} dropped '
+                       '(see tbl_dq_issues).'.format(nb_duplicates,
+                                                     source.description))
+    if incremental:
+        with stage('merge'):
+            _, first = merge_staging_table(
+                cursor, target, source.table, source.key, source.time_col,
+                state[1] if state is not None else None)
+    record_source(cursor, source.f_in_name, source.sheet_name, source.table,
+                  source.key[1], digest, watermark)
+    return first[:10] if first is not None else None
+
+
+def _duplicates(cursor, target, source, batch):
+    '''
+    Returns a boolean mask of the records of a batch whose period is
+    repeated in the batch (the first record being kept) or already in
+    target for the series of the source.
+    '''
+    periods = np.array(to_sql_values(batch[source.time_col]), dtype=object)
+    duplicate = np.ones(len(periods), dtype=bool)
+    duplicate[np.unique(periods, return_index=True)[1]] = False
+    cursor.execute('select {0} from {1} where {2} = ? and '
+                   '{0} between ? and ?;'.format(source.time_col, target,
+                                                 source.key[0]),
+                   (source.key[1], periods.min(), periods.max()))
+    loaded = [row[0] for row in cursor.fetchall()]
+    if loaded:
+        duplicate |= np.isin(periods, np.array(loaded, dtype=object))
+    return duplicate
+
+
+class ClientWorkbook(object):
+    '''
+    A client's workbook opened once and shared by all the sources of the
+    file: its container and shared strings are read once, whole sheets are
+    parsed once for all the sources reading them and streamed sheets are
+    read from a single read-only handle.
+
+    If batch_size is positive, sheets are streamed by batches of batch_size
+    rows; otherwise, each sheet is read as one dataframe.
+
+    Example:
+        with ClientWorkbook('gas and carbon prices.xlsx') as workbook:
+            for df in workbook.read_sheet('Gas', skip_rows=3):
+                ...
+    '''
+
+    def __init__(self, f_in_name, batch_size=0):
+        self.f_in_name = f_in_name
+        self.batch_size = batch_size
+        self.handle = None
+        self.sheets = dict()  # Whole sheets by (sheet name, header row)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Closes the workbook and releases the sheets read.
+        '''
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+        self.sheets.clear()
+
+    def read_sheet(self, sheet_name=None, header_row=0, skip_rows=0,
+                   date_col=None, columns=None, period=None):
+        '''
+        Reads a sheet (the first one by default) and yields its rows as
+        dataframes, the row header_row (0-based) of the sheet being the
+        header. The first skip_rows rows after the header are ignored.
+
+        Excel cells being typed, date_col, columns and period (see
+        SheetSource) are not used.
+        '''
+        if self.batch_size <= 0:
+            if self.handle is None:
+                self.handle = pd.ExcelFile(self.f_in_name)
+            key = (sheet_name, header_row)
+            if key not in self.sheets:
+                self.sheets[key] = self.handle.parse(sheet_name or 0,
+                                                     header=header_row)
+            yield self.sheets[key].iloc[skip_rows:]
+            return
+
+        if self.handle is None:
+            self.handle = load_workbook(self.f_in_name, read_only=True,
+                                        data_only=True)
+        ws = self.handle[sheet_name] if sheet_name \
+            else self.handle.worksheets[0]
+        rows = ws.iter_rows(min_row=header_row + 1, values_only=True)
+        header = next(rows, ())
+        columns = [col if col is not None else 'Unnamed: {}'.format(i)
+                   for i, col in enumerate(header)]
+        batch = list()
+        for i, row in enumerate(rows):
+            if i < skip_rows:
+                continue
+            # Empty, missing and error cells are read as NaN (as pandas does);
+            # trailing empty cells may not be stored in the file
+            row = row[:len(columns)] + (None, ) * (len(columns) - len(row))
+            batch.append([np.nan if val is None or (isinstance(val, str) and
+                                                    val in MISSING_VALUES)
+                          else val for val in row])
+            if len(batch) == self.batch_size:
+                yield pd.DataFrame(batch, columns=columns, dtype=object)
+                batch = list()
+        if batch:
+            yield pd.DataFrame(batch, columns=columns, dtype=object)
+
+
+class CsvFile(object):
+    '''
+    A client's CSV file, read with pandas' C parser and the same interface
+    as ClientWorkbook (a CSV file having a single sheet, the sheet name is
+    not used). Dates are parsed when read.
+    '''
+
+    def __init__(self, f_in_name, batch_size=0):
+        self.f_in_name = f_in_name
+        self.batch_size = batch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def read_sheet(self, sheet_name=None, header_row=0, skip_rows=0,
+                   date_col=None, columns=None, period=None):
         '''
-            select id
-            from tbl_ref_price_products
-            where product = \'DAH\';
-        ''')
-    product_id = cursor.fetchone()[0]
-
-    # Delete any previous records
-    cursor.execute('delete from tbl_hist_intradayprices ' +
-                   'where product_id = {};'.format(product_id))
-    conn.commit()
-
-    logger.info('.. Processing power spot prices')
-
-    list_of_records = list()
-    cur_row = 0
-    while cur_row < len(df.index):
-        if isinstance(df.iat[cur_row, 4], datetime.date):
-            # For each hour
-            for h in range(0, 24):
-                if not math.isnan(df.iat[cur_row, h + 6]):
-                    record = dict({
-                        "datehour": datetime.datetime(
-                            df.iat[cur_row, 4].year,
-                            df.iat[cur_row, 4].month,
-                            df.iat[cur_row, 4].day, h, 0),
-                        "product_id": product_id,
-                        "price": convert_to_numeric(df.iat[cur_row, h + 6])
-                    })
-                    list_of_records.append(record)
-        cur_row += 1
-    df2 = pd.DataFrame(list_of_records)
-    df2.to_sql('tbl_hist_intradayprices', conn,
-               if_exists='append', index=False)
-    conn.commit()
-
-
-def _populate_daily_prices(conn, cursor, parameters):
-    '''
-    Populates daily prices.
-    '''
-    f_in_name = parameters[0]  # There is only one file
-
-    # -- Gas prices --
-
-    logger.info('.. Reading gas prices from \'{}\''
-                .format(os.path.basename(f_in_name)))
-
-    # Put all the data into a dataframe
-    df = pd.read_excel(f_in_name, sheet_name='Gas')
-
-    # Get product ID's
-    cursor.execute(
+        Reads the file and yields its rows as dataframes (see
+        ClientWorkbook.read_sheet). The dates (date_col given by name) are
+        read as text and then parsed.
         '''
-            select id
-            from tbl_ref_price_products
-            where product = \'Z1\';
-        ''')
-    product_id = cursor.fetchone()[0]
-
-    # Delete any previous records
-    cursor.execute('delete from tbl_hist_dailyprices ' +
-                   'where product_id = {};'.format(product_id))
-    conn.commit()
-
-    logger.info('.. Processing gas cash prices')
-
-    list_of_records = list()
-    cur_row = 3
-    while cur_row < len(df.index):
-        if isinstance(df.iat[cur_row, 3], datetime.date):
-            try:
-                record = dict({
-                    "date": df.iat[cur_row, 3],
-                    "product_id": product_id,
-                    "bid": convert_to_numeric(df.iat[cur_row, 4]),
-                    "ask": convert_to_numeric(df.iat[cur_row, 4]),
-                    "bid_size": 0,
-                    "ask_size": 0
-                })
-                list_of_records.append(record)
-            except KeyError:
-                logger.warning('** Warning: Does not recognize price type ' +
-                               '\'{}\'.'.format(df.iat[cur_row, 0]))
-        cur_row += 1
-    df2 = pd.DataFrame(list_of_records)
-    df2.to_sql('tbl_hist_dailyprices', conn, if_exists='append', index=False)
-    conn.commit()
-
-    # -- Carbon prices --
-
-    logger.info('.. Reading carbon prices from \'{}\''
-                .format(os.path.basename(f_in_name)))
-
-    # Put all the data into a dataframe
-    df = pd.read_excel(f_in_name, sheet_name='Carbon')
-
-    # Get the product ID
-    cursor.execute(
+        dtype = {date_col: str} if isinstance(date_col, str) else None
+        chunks = pd.read_csv(
+            self.f_in_name, header=header_row, dtype=dtype,
+            na_values=MISSING_VALUES, engine='c', float_precision='round_trip',
+            chunksize=self.batch_size if self.batch_size > 0 else None)
+        if self.batch_size <= 0:
+            chunks = [chunks]
+        for df in chunks:
+            if skip_rows:
+                skipped = min(skip_rows, len(df))
+                df, skip_rows = df.iloc[skipped:], skip_rows - skipped
+            if date_col is not None:
+                df = _parse_dates(df, date_col)
+            yield df
+
+
+class ParquetFile(object):
+    '''
+    A client's Parquet file, read with the same interface as ClientWorkbook:
+    only the columns needed are read and, when the records are limited to a
+    period, only the rows of these days (filters pushed down to the reader,
+    the dates being stored as timestamps). Requires pyarrow or fastparquet.
+    '''
+
+    def __init__(self, f_in_name, batch_size=0):
+        self.f_in_name = f_in_name
+        self.batch_size = batch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def read_sheet(self, sheet_name=None, header_row=0, skip_rows=0,
+                   date_col=None, columns=None, period=None):
         '''
-            select id
-            from tbl_ref_price_products
-            where product = \'Carbon\';
-        ''')
-    product_id = cursor.fetchone()[0]
-
-    # Delete any previous records
-    cursor.execute('delete from tbl_hist_dailyprices ' +
-                   'where product_id = {};'.format(product_id))
-    conn.commit()
-
-    logger.info('.. Processing carbon prices')
-
-    list_of_records = list()
-    cur_row = 4
-    while cur_row < len(df.index):
-        if isinstance(df.iat[cur_row, 0], datetime.date):
-            record = dict({
-                "date": df.iat[cur_row, 0],
-                "product_id": product_id,
-                "bid": convert_to_numeric(df.iat[cur_row, 1]),
-                "ask": convert_to_numeric(df.iat[cur_row, 1]),
-                "bid_size": 0,
-                "ask_size": 0
-            })
-            list_of_records.append(record)
-        cur_row += 1
-    df2 = pd.DataFrame(list_of_records)
-    df2.to_sql('tbl_hist_dailyprices', conn, if_exists='append', index=False)
-    conn.commit()
-
-
-def _populate_generation(conn, cursor, parameters):
-    '''
-    Populates historical generation.
-    '''
-    f_in_name = parameters[0]  # There is only one file
-
-    logger.info('.. Reading generation from \'{}\''
-                .format(os.path.basename(f_in_name)))
-
-    # Put all the data into a dataframe
-    df = pd.read_excel(f_in_name)
-
-    # Get generating plant ID
-    cursor.execute(
+        Reads the file and yields its rows as one dataframe (see
+        ClientWorkbook.read_sheet). The sheet name, header row and rows
+        skipped are not used.
         '''
-            select id
-            from tbl_ref_power_plants
-            where name = \'PP\';
-        ''')
-    plant_id = cursor.fetchone()[0]
-
-    # Delete any previous records
-    cursor.execute('delete from tbl_hist_generation ' +
-                   'where plant_id = {};'.format(plant_id))
-    conn.commit()
-
-    logger.info('.. Processing generation for PP')
-
-    list_of_records = list()
-    cur_row = 3
-    while cur_row < len(df.index):
-        if isinstance(df.iat[cur_row, 1], datetime.datetime):
-            record = dict({
-                # Make sure we get a "clean" hour
-                "datehour": datetime.datetime(
-                    df.iat[cur_row, 1].year,
-                    df.iat[cur_row, 1].month,
-                    df.iat[cur_row, 1].day,
-                    df.iat[cur_row, 1].hour),
-                "plant_id": plant_id,
-                "generation": convert_to_numeric(df.iat[cur_row, 2])
-            })
-            list_of_records.append(record)
-        cur_row += 1
-    df2 = pd.DataFrame(list_of_records)
-    df2.to_sql('tbl_hist_generation', conn, if_exists='append', index=False)
-    conn.commit()
+        filters = list()
+        if period is not None and isinstance(date_col, str):
+            if period[0] is not None:
+                filters.append((date_col, '>=', pd.Timestamp(period[0])))
+            if period[1] is not None:
+                filters.append((date_col, '<', pd.Timestamp(period[1]) +
+                                pd.Timedelta(days=1)))
+        try:
+            df = pd.read_parquet(self.f_in_name,
+                                 columns=list(columns) if columns else None,
+                                 filters=filters or None)
+        except ImportError:
+            logger.error('** Reading \'{}\' requires pyarrow or '
+                         'fastparquet.'.format(self.f_in_name))
+            raise ClientDataError
+        if date_col is not None:
+            df = _parse_dates(df, date_col)
+        yield df
+
+
+# Readers of client's files by extension
+READERS = {
+    ".xlsx": ClientWorkbook,
+    ".xlsm": ClientWorkbook,
+    ".csv": CsvFile,
+    ".parquet": ParquetFile,
+    ".pq": ParquetFile
+}
+
+
+def open_client_file(f_in_name, batch_size=0):
+    '''
+    Opens a client's file with the reader of its extension (see READERS).
+    '''
+    extension = os.path.splitext(f_in_name)[1].lower()
+    if extension not in READERS:
+        logger.error('** Unknown format of \'{}\' (expected one of {}).'
+                     .format(f_in_name, ', '.join(sorted(READERS))))
+        raise ClientDataError
+    return READERS[extension](f_in_name, batch_size)
+
+
+def _melt_hourly_prices(df, product_id, timezone='UTC', date_col=None,
+                        series_col=None):
+    '''
+    Reshapes a wide sheet of hourly prices (one row per day and node, one
+    column per hour ending in local time) into long-format records in one
+    vectorized operation. The column of the dates is detected if date_col is
+    None; the nodes are given by column series_col (one node if None).
+
+    Hours follow the clock: the hour skipped when DST starts has no price
+    and the 25th hour, if any, is the second occurrence of the hour repeated
+    when DST ends. The prices of several nodes are averaged by hour (the
+    rows of a day being in the same batch when streaming, see _whole_days).
+    The prices of a node repeated for an hour are not averaged: they follow
+    the averages as duplicate records (see _write_source).
+    '''
+    detected_col, hour_cols, extra_col = _find_hourly_layout(df)
+
+    # Keep only the rows with a valid date
+    dates = pd.to_datetime(df[detected_col] if date_col is None
+                           else _column(df, date_col), errors='coerce')
+    valid = dates.notna().to_numpy()
+    dates = dates[valid].dt.normalize().to_numpy(dtype='datetime64[ns]')
+    nodes = _column(df, series_col)[valid].to_numpy() \
+        if series_col is not None else np.zeros(len(dates))
+
+    # Coerce all prices in bulk and flatten them row by row (day, hour)
+    cols = hour_cols + ([extra_col] if extra_col is not None else [])
+    prices = np.empty((len(dates), len(cols)), dtype=np.float64)
+    for i, col in enumerate(cols):
+        prices[:, i], _ = coerce_numeric(df.loc[valid, col], on_error='nan',
+                                         name='hour {}'.format(col))
+    hours = np.tile(np.arange(len(cols)), (len(dates), 1))
+    # The 25th hour is the first one of the day that is ambiguous
+    first_occurrence = np.ones(hours.shape, dtype=bool)
+    if extra_col is not None:
+        has_extra = np.flatnonzero(~np.isnan(prices[:, -1]))
+        repeated = _repeated_hours(dates[has_extra], timezone)
+        if (repeated < 0).any():
+            logger.warning('** Warning: {} price(s) of hour 25 on days '
+                           'without time change skipped.'
+                           .format(int((repeated < 0).sum())))
+        hours[has_extra, -1] = repeated
+        prices[has_extra[repeated < 0], -1] = np.nan
+        first_occurrence[:, -1] = False
+    local = (dates[:, np.newaxis] + hours.astype('timedelta64[h]')).ravel()
+    prices = prices.ravel()
+    nodes = np.repeat(nodes, len(cols))
+
+    # Skip the hours without a price
+    has_price = ~np.isnan(prices)
+    utc, dst = to_utc(local[has_price], timezone,
+                      first_occurrence.ravel()[has_price], 'power prices')
+    exists = ~np.isnat(utc)
+    df2 = pd.DataFrame({
+        "datehour_utc": utc[exists],
+        "datehour": local[has_price][exists],
+        "dst": dst[exists],
+        "product_id": product_id,
+        "price": prices[has_price][exists]
+    }, columns=['datehour_utc', 'datehour', 'dst', 'product_id', 'price'])
+    repeated = pd.DataFrame({
+        "node": nodes[has_price][exists],
+        "datehour_utc": df2['datehour_utc']
+    }).duplicated().to_numpy()
+    first = df2[~repeated]
+    if first['datehour_utc'].duplicated().any():
+        first = first.groupby('datehour_utc', as_index=False, sort=True).agg({
+            "datehour": 'first', "dst": 'first', "product_id": 'first',
+            "price": 'mean'})
+    if repeated.any():
+        first = pd.concat([first, df2[repeated]], ignore_index=True)
+    return first
+
+
+def _repeated_hours(dates, timezone):
+    '''
+    Returns the hour of each day (local midnight) repeated when DST ends,
+    -1 for the days without repeated hour.
+    '''
+    if not len(dates):
+        return np.zeros(0, dtype=np.int64)
+    local = (dates[:, np.newaxis] +
+             np.arange(24).astype('timedelta64[h]')[np.newaxis, :]).ravel()
+    ambiguous = pd.DatetimeIndex(local) \
+        .tz_localize(timezone, ambiguous='NaT', nonexistent='shift_forward') \
+        .isna().reshape(len(dates), 24)
+    return np.where(ambiguous.any(axis=1), ambiguous.argmax(axis=1), -1)
+
+
+def _find_hourly_layout(df):
+    '''
+    Detects the date column, the 24 hour columns (headers 1 to 24) and the
+    25th hour column (None if missing) of a sheet of hourly prices. Falls
+    back on the historical layout (date in the 5th column, hours starting at
+    the 7th column) when headers are missing.
+    '''
+    date_col = _date_column(df)
+    by_hour = dict()
+    for col in df.columns:
+        try:
+            h = int(str(col).strip())
+        except ValueError:
+            continue
+        if 1 <= h <= 25 and h not in by_hour:
+            by_hour[h] = col
+    if all(h in by_hour for h in range(1, 25)):
+        hour_cols = [by_hour[h] for h in range(1, 25)]
+        extra_col = by_hour.get(25)
+    else:
+        hour_cols = list(df.columns[6:30])
+        extra_col = df.columns[30] if len(df.columns) > 30 else None
+    return date_col, hour_cols, extra_col
+
+
+def _date_column(df):
+    '''
+    Returns the first column of dates of a sheet, the 5th column if none.
+    '''
+    return next((col for col in df.columns
+                 if pd.api.types.infer_dtype(df[col], skipna=True)
+                 in ('datetime64', 'datetime', 'date')), df.columns[4])
+
+
+def _daily_prices_records(df, product_id, date_col=0, price_col=1):
+    '''
+    Builds the records of daily prices from the rows of a sheet where the
+    date and the price are respectively in columns date_col and price_col.
+    Rows without a (numeric) price are skipped.
+    '''
+    rows = df[_datetime_mask(_column(df, date_col), datetime.date)]
+    prices, _ = coerce_numeric(_column(rows, price_col), on_error='nan',
+                               name='daily prices')
+    has_price = ~np.isnan(prices)
+    return pd.DataFrame({
+        "date": _column(rows, date_col).to_numpy()[has_price],
+        "product_id": product_id,
+        "bid": prices[has_price],
+        "ask": prices[has_price],
+        "bid_size": 0,
+        "ask_size": 0
+    }, columns=['date', 'product_id', 'bid', 'ask', 'bid_size', 'ask_size'])
+
+
+def _generation_records(df, plant_id, timezone='UTC', date_col=1,
+                        value_col=2):
+    '''
+    Builds the records of hourly generation from the rows of a sheet where
+    the hours, in local time (the hour repeated when DST ends appearing
+    twice), and the generation are respectively in columns date_col and
+    value_col. The rows of a day must be in the same batch when streaming
+    (see _whole_days) for the repeated hour to be told apart.
+    '''
+    rows = df[_datetime_mask(_column(df, date_col), datetime.datetime)]
+    generation, _ = coerce_numeric(_column(rows, value_col), on_error='nan',
+                                   name='generation')
+    # Make sure we get a "clean" hour
+    local = pd.to_datetime(_column(rows, date_col)).to_numpy(
+        dtype='datetime64[ns]').astype('datetime64[h]') \
+        .astype('datetime64[ns]')
+    utc, dst = to_utc(local, timezone, name='generation')
+    exists = ~np.isnat(utc)
+    return pd.DataFrame({
+        "datehour_utc": utc[exists],
+        "datehour": local[exists],
+        "dst": dst[exists],
+        "plant_id": plant_id,
+        "generation": generation[exists]
+    }, columns=['datehour_utc', 'datehour', 'dst', 'plant_id', 'generation'])
+
+
+def _datetime_mask(values, cls):
+    '''
+    Returns a boolean mask of the values that are instances of cls (e.g.,
+    datetime.date), excluding missing dates (NaT).
+    '''
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.notna().to_numpy()
+    return np.fromiter((isinstance(v, cls) and v == v for v in values),
+                       dtype=bool, count=len(values))
+
+
+def _column(df, column):
+    '''
+    Returns a column of a dataframe given by its header or, if an integer,
+    its position (0-based).
+    '''
+    if isinstance(column, int):
+        if column >= len(df.columns):
+            logger.error('** No column {} in a sheet of {} columns.'
+                         .format(column, len(df.columns)))
+            raise ClientDataError
+        return df.iloc[:, column]
+    if column not in df.columns:
+        logger.error('** No column \'{}\' in sheet (columns: {}).'
+                     .format(column, ', '.join(str(c) for c in df.columns)))
+        raise ClientDataError
+    return df[column]
+
+
+def _parse_dates(df, column):
+    '''
+    Returns a copy of a dataframe whose column (see _column) is converted to
+    dates, invalid dates becoming NaT.
+    '''
+    dates = pd.to_datetime(_column(df, column), errors='coerce')
+    df = df.copy()
+    df[dates.name] = dates
+    return df
+
+
+def _in_period(df, period):
+    '''
+    Returns the records (local datehour or date) of the days of period, a
+    tuple (first day, last day) where None stands for no limit.
+    '''
+    days = pd.to_datetime(df['datehour'] if 'datehour' in df.columns
+                          else df['date']).dt.normalize()
+    keep = np.ones(len(df), dtype=bool)
+    if period[0] is not None:
+        keep &= (days >= pd.Timestamp(period[0])).to_numpy()
+    if period[1] is not None:
+        keep &= (days <= pd.Timestamp(period[1])).to_numpy()
+    return df[keep]
+
+
+# Layouts of client's sheets: function building the records, table loaded,
+# column identifying the series, column of the period, reference table (and
+# column) of the names of the series, keys of the source specification
+# passed to the function (see _spec_sources) with their argument and default
+# value and whether the function converts local times
+SheetLayout = namedtuple('SheetLayout', [
+    'transform', 'table', 'key_col', 'time_col', 'ref_table', 'ref_col',
+    'columns', 'local_time'])
+
+LAYOUTS = {
+    "hourly_prices": SheetLayout(
+        _melt_hourly_prices, 'tbl_hist_intradayprices', 'product_id',
+        'datehour_utc', 'tbl_ref_price_products', 'product',
+        {"DateColumn": ('date_col', None),
+         "SeriesColumn": ('series_col', None)}, True),
+    "daily_prices": SheetLayout(
+        _daily_prices_records, 'tbl_hist_dailyprices', 'product_id', 'date',
+        'tbl_ref_price_products', 'product',
+        {"DateColumn": ('date_col', 0), "ValueColumn": ('price_col', 1)},
+        False),
+    "generation": SheetLayout(
+        _generation_records, 'tbl_hist_generation', 'plant_id',
+        'datehour_utc', 'tbl_ref_power_plants', 'name',
+        {"DateColumn": ('date_col', 1), "ValueColumn": ('value_col', 2)},
+        True)
+}
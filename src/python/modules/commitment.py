@@ -0,0 +1,253 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- commitment.py --
+
+Provides subroutines for computing the optimal hourly commitment of gas-fired
+power plants given their clean spark spreads (see analytics.py), a start
+cost and minimum uptime and downtime, i.e., the dispatch a scheduler could
+have achieved in hindsight while meeting the dynamic constraints of the
+plant.
+
+When online, a plant runs at the level (pmin, pmax or duct) with the highest
+margin in each hour. The commitment is solved by dynamic programming over
+min_up + min_down states (online or offline for 1, 2, ... hours), i.e., in
+O(hours x states) operations. Hourly spreads may have one column per plant
+or price scenario, which are solved at once, and several plants (or batches
+of scenarios) can be solved by a pool of processes (see commit_plants).
+
+To do:
+  - None at the moment
+"""
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from modules.analytics import get_plant
+from modules.bulk_writer import BulkWriter
+
+logger = logging.getLogger('make_dataset')
+
+# Dynamic constraints of a plant: start cost ($ per start), minimum uptime
+# and downtime (hours)
+Constraints = namedtuple('Constraints',
+                         ['start_cost', 'min_up', 'min_down'])
+
+
+class CommitmentError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+    pass
+
+
+def online_margin(powermin, powermax, duct, css_pmin, css_pmax, css_duct):
+    '''
+    Returns the margin ($) and generation (MWh) of each hour if the plant is
+    online, running at the most profitable of pmin, pmax and duct.
+    '''
+    margins = np.stack(np.broadcast_arrays(
+        np.asarray(css_pmin, dtype=np.float64) * powermin,
+        np.asarray(css_pmax, dtype=np.float64) * powermax,
+        np.asarray(css_duct, dtype=np.float64) * duct))
+    level = margins.argmax(axis=0)
+    return np.take_along_axis(margins, level[np.newaxis], axis=0)[0], \
+        np.array([powermin, powermax, duct], dtype=np.float64)[level]
+
+
+def optimal_commitment(reward, start_cost=0.0, min_up=1, min_down=1):
+    '''
+    Returns the commitment (True when online) maximizing the sum of reward
+    ($ earned in each hour online) less start_cost ($ paid at each start)
+    while staying online (offline) at least min_up (min_down) hours in a row.
+    reward has one value per hour or one row per hour and one column per
+    plant or scenario (start_cost is then a scalar or one value by column).
+    The plant may be online or offline before the first hour.
+    '''
+    reward = np.asarray(reward, dtype=np.float64)
+    is_vector = reward.ndim == 1
+    if is_vector:
+        reward = reward[:, np.newaxis]
+    if reward.ndim != 2 or np.isnan(reward).any():
+        logger.error('** Hourly margins must be a vector or a matrix '
+                     'without missing values.')
+        raise CommitmentError
+    if int(min_up) < 1 or int(min_down) < 1:
+        logger.error('** Minimum uptime and downtime must be at least 1 '
+                     'hour (got {} and {}).'.format(min_up, min_down))
+        raise CommitmentError
+    min_up, min_down = int(min_up), int(min_down)
+    hours, columns = reward.shape
+    start_cost = np.broadcast_to(np.asarray(start_cost, dtype=np.float64),
+                                 (columns, ))
+
+    # States 0..min_up-1: online for 1, 2, ..., min_up or more hours;
+    # states min_up..: offline for 1, 2, ..., min_down or more hours. Each
+    # state is reached from one state (pred1) or the best of two (pred2 is
+    # the same state when there is no choice).
+    states = min_up + min_down
+    pred1 = np.concatenate([[states - 1], np.arange(min_up - 1),
+                            [min_up - 1], np.arange(min_up, states - 1)])
+    pred2 = pred1.copy()
+    pred2[min_up - 1] = min_up - 1  # Remains online
+    pred2[states - 1] = states - 1  # Remains offline
+    cost1 = np.zeros((states, columns))
+    cost1[0] = -start_cost
+    cost2 = np.where((pred2 == pred1)[:, np.newaxis], cost1, 0.0)
+
+    value = np.full((states, columns), -np.inf)
+    value[[min_up - 1, states - 1]] = 0.0
+    from_pred2 = np.empty((hours, states, columns), dtype=bool)
+    for hour in range(hours):
+        value1 = value[pred1] + cost1
+        value2 = value[pred2] + cost2
+        from_pred2[hour] = value2 > value1
+        value = np.maximum(value1, value2)
+        value[:min_up] += reward[hour]
+
+    # Trace back the states of the best commitment
+    state = value.argmax(axis=0)
+    cols = np.arange(columns)
+    online = np.empty((hours, columns), dtype=bool)
+    for hour in range(hours - 1, -1, -1):
+        online[hour] = state < min_up
+        state = np.where(from_pred2[hour, state, cols], pred2[state],
+                         pred1[state])
+    return online[:, 0] if is_vector else online
+
+
+def commit_plant(plant, css):
+    '''
+    Returns the optimal commitment of a plant (dictionary of the attributes
+    of tbl_ref_power_plants plus constraints, see Constraints) given its
+    clean spark spreads (dictionary of arrays css_pmin, css_pmax and
+    css_duct, with one row per hour and possibly one column per scenario):
+    online and startup flags, generation (MWh) and margin net of the start
+    costs ($) of each hour.
+    '''
+    constraints = plant['constraints']
+    reward, generation = online_margin(
+        plant['powermin'], plant['powermax'], plant['duct'],
+        css['css_pmin'], css['css_pmax'], css['css_duct'])
+    online = optimal_commitment(reward, constraints.start_cost,
+                                constraints.min_up, constraints.min_down)
+    startup = np.zeros_like(online)
+    startup[1:] = online[1:] & ~online[:-1]
+    return {
+        "online": online.astype(np.int64),
+        "startup": startup.astype(np.int64),
+        "generation": np.where(online, generation, 0.0),
+        "margin": np.where(online, reward, 0.0) -
+        startup * constraints.start_cost
+    }
+
+
+def _commit_plant(job):
+    '''
+    Unpacks the arguments of commit_plant (used by the workers processes).
+    '''
+    return commit_plant(*job)
+
+
+def commit_plants(jobs, workers=1):
+    '''
+    Returns the optimal commitment of a list of (plant, css) pairs (see
+    commit_plant), computed by a pool of workers processes when workers is
+    greater than 1.
+    '''
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(_commit_plant, jobs))
+    return [commit_plant(*job) for job in jobs]
+
+
+def create_commitment(conn, plants, insert_batch_size=None, workers=1):
+    '''
+    Populates tbl_calc_commitment with the optimal commitment of each plant
+    of dictionary plants, which gives by plant's name its attributes (see
+    analytics.get_plant), including StartCost, MinUpTime and MinDownTime.
+    Clean spark spreads and actual margins are read from
+    tbl_calc_dispatch_margins.
+    '''
+    logger.info('. Computing optimal commitment')
+    cursor = conn.cursor()
+    jobs, hours = [], []
+    for name, attributes in plants.items():
+        plant = get_plant(cursor, name, attributes)
+        plant['constraints'] = Constraints(
+            plant['start_cost'], plant['min_up'], plant['min_down'])
+        df = pd.read_sql_query(
+            'select datehour_utc, datehour, css_pmin, css_pmax, css_duct, '
+            'act_margin from tbl_calc_dispatch_margins '
+            'where plant_id = ? order by datehour_utc;',
+            conn, params=(plant['id'], ))
+        if df.empty:
+            logger.error('** No dispatch margins for plant {} in '
+                         'tbl_calc_dispatch_margins.'.format(name))
+            raise CommitmentError
+        jobs.append((plant, dict((col, df[col].to_numpy()) for col in
+                                 ('css_pmin', 'css_pmax', 'css_duct'))))
+        hours.append(df)
+
+    results = commit_plants(jobs, workers)
+
+    with BulkWriter(conn, insert_batch_size) as writer:
+        for (plant, _), df, result in zip(jobs, hours, results):
+            cursor.execute('delete from tbl_calc_commitment '
+                           'where plant_id = ?;', (plant['id'],))
+            opportunity = result['margin'] - df['act_margin'].to_numpy()
+            writer.insert_arrays('tbl_calc_commitment', dict({
+                "datehour_utc": df['datehour_utc'].to_numpy(),
+                "datehour": df['datehour'].to_numpy(),
+                "plant_id": plant['id'],
+                "opportunity": opportunity
+            }, **result))
+            _report(plant['name'], df['datehour'].to_numpy(), result,
+                    opportunity)
+
+
+def _report(name, datehours, result, opportunity):
+    '''
+    Logs the yearly starts, hours online, margin and dispatch opportunity.
+    '''
+    years = np.array([d[:4] for d in datehours])
+    for year in np.unique(years):
+        in_year = years == year
+        logger.info('.. {} {}: {} starts, {} hours online, margin ${:,.2f}M, '
+                    'opportunity ${:,.2f}M'.format(
+                        name, year, result['startup'][in_year].sum(),
+                        result['online'][in_year].sum(),
+                        result['margin'][in_year].sum() / 1e6,
+                        opportunity[in_year].sum() / 1e6))
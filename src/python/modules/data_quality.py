@@ -0,0 +1,339 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- data_quality.py --
+
+Provides the validation of the historical tables once client's data is
+loaded. Issues are written into tbl_dq_issues (one row per issue, a run of
+consecutive missing periods being one issue):
+  - missing: periods of the calendar (tbl_util_hourly_periods, in UTC, so
+    DST days have 23 or 25 hours) or weekdays (tbl_util_daily_periods)
+    without a value (or a null one) between the first and last values of a
+    series;
+  - duplicate: records of a series given more than once for a period, found
+    when they are loaded (see client_data) since the primary keys of the
+    historical tables would reject them; the first record is kept;
+  - bid_ask: daily prices with a bid above the ask or a negative size;
+  - outlier: values more than z_score standard deviations away from the
+    mean of their series.
+
+Checks are set-based SQL queries or vectorized NumPy operations over whole
+series. Duplicates are kept in tbl_dq_issues until their series is loaded
+again.
+
+To do:
+  - None at the moment
+"""
+
+import logging
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from modules.bulk_writer import BulkWriter
+from modules.utils import to_utc
+
+logger = logging.getLogger('make_dataset')
+
+CHECKS = ('missing', 'duplicate', 'bid_ask', 'outlier')
+
+# Hourly series: table, key column, value column and reference table and
+# column of their names
+HOURLY_SERIES = (
+    ('tbl_hist_intradayprices', 'product_id', 'price',
+     'tbl_ref_price_products', 'product'),
+    ('tbl_hist_generation', 'plant_id', 'generation',
+     'tbl_ref_power_plants', 'name'))
+
+# Historical tables: table, key column, value column (the one of the
+# duplicates) and reference table and column of their names
+HISTORICAL_TABLES = HOURLY_SERIES + (
+    ('tbl_hist_dailyprices', 'product_id', 'bid', 'tbl_ref_price_products',
+     'product'), )
+
+
+class DataQualityError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+    pass
+
+
+def validate_data(conn, z_score=6.0, timezone='UTC', interval=60,
+                  insert_batch_size=None):
+    '''
+    Checks the historical tables, replaces the issues of tbl_dq_issues with
+    the ones found and returns the number of issues by check (duplicates
+    being the ones found by the last loads, see write_duplicates).
+    '''
+    logger.info('. Validating client\'s data')
+    cursor = conn.cursor()
+    cursor.execute('delete from tbl_dq_issues where check_name <> ?;',
+                   ('duplicate', ))
+    counts = OrderedDict((check, 0) for check in CHECKS)
+    counts['duplicate'] = cursor.execute(
+        'select count(*) from tbl_dq_issues where check_name = ?;',
+        ('duplicate', )).fetchone()[0]
+    with BulkWriter(conn, insert_batch_size) as writer:
+        for table, key_col, value_col, ref_table, ref_col in HOURLY_SERIES:
+            names = _names(cursor, ref_table, ref_col)
+            df = pd.read_sql_query(
+                'select {0}, datehour_utc, {1} from {2} '
+                'order by {0}, datehour_utc;'.format(key_col, value_col,
+                                                     table), conn)
+            issues = [_missing_hours(cursor, df, timezone, interval),
+                      _outliers(df, z_score)]
+            _write(writer, counts, table, names, issues)
+
+        names = _names(cursor, 'tbl_ref_price_products', 'product')
+        df = pd.read_sql_query(
+            'select product_id, date, (bid + ask) / 2.0 '
+            'from tbl_hist_dailyprices order by product_id, date;', conn)
+        issues = [_missing_days(cursor), _bid_ask(cursor),
+                  _outliers(df, z_score)]
+        _write(writer, counts, 'tbl_hist_dailyprices', names, issues)
+
+    for check, count in counts.items():
+        logger.info('.. {:,} {} issue(s)'.format(count, check))
+    return counts
+
+
+def check_thresholds(counts, max_issues):
+    '''
+    Raises DataQualityError if the number of issues of a check exceeds its
+    maximum in dictionary max_issues (checks not given are not limited).
+    '''
+    exceeded = ['{} ({:,} > {:,})'.format(check, counts[check],
+                                          max_issues[check])
+                for check in CHECKS
+                if check in max_issues and counts[check] > max_issues[check]]
+    if exceeded:
+        logger.error('** Too many data quality issues: {} (see '
+                     'tbl_dq_issues).'.format(', '.join(exceeded)))
+        raise DataQualityError
+
+
+def write_duplicates(writer, cursor, table, key, time_col, records,
+                     origin):
+    '''
+    Inserts into tbl_dq_issues the records (dictionary of arrays) of a
+    series identified by key (column, id) dropped when loading table because
+    their period (column time_col) was already loaded from origin or an
+    earlier source.
+    '''
+    value_col, names = None, dict()
+    for hist_table, _, col, ref_table, ref_col in HISTORICAL_TABLES:
+        if hist_table == table:
+            value_col, names = col, _names(cursor, ref_table, ref_col)
+    periods = records[time_col]
+    _write(writer, OrderedDict(duplicate=0), table, names, [(
+        'duplicate', np.full(len(periods), key[1]), periods,
+        np.ones(len(periods), dtype=np.int64),
+        records[value_col] if value_col in records
+        else np.full(len(periods), np.nan),
+        np.full(len(periods), 'duplicate record of \'{}\' dropped'
+                .format(origin), dtype=object))])
+
+
+def clear_duplicates(cursor, table, key):
+    '''
+    Deletes the duplicates of a series identified by key (column, id) from
+    tbl_dq_issues before it is loaded again.
+    '''
+    names = dict()
+    for hist_table, _, _, ref_table, ref_col in HISTORICAL_TABLES:
+        if hist_table == table:
+            names = _names(cursor, ref_table, ref_col)
+    cursor.execute('delete from tbl_dq_issues where table_name = ? and '
+                   'series = ? and check_name = ?;',
+                   (table, str(names.get(key[1], key[1])), 'duplicate'))
+
+
+def _names(cursor, ref_table, ref_col):
+    '''
+    Returns the names of the products or plants by id.
+    '''
+    return dict(cursor.execute('select id, {} from {};'
+                               .format(ref_col, ref_table)).fetchall())
+
+
+def _write(writer, counts, table, names, issues):
+    '''
+    Inserts issues (list of (check, key ids, periods, numbers of periods,
+    values, details) with arrays) into tbl_dq_issues.
+    '''
+    for check, ids, periods, lengths, values, details in issues:
+        if len(ids) == 0:
+            continue
+        counts[check] += len(ids)
+        writer.insert_arrays('tbl_dq_issues', {
+            "table_name": table,
+            "series": np.array([str(names.get(key_id, key_id))
+                                for key_id in ids], dtype=object),
+            "check_name": check,
+            "period": periods,
+            "periods": lengths,
+            "value": values,
+            "detail": details
+        })
+
+
+def _runs(ids, offsets):
+    '''
+    Groups sorted offsets (by id) into runs of consecutive values and
+    returns the positions of their first offsets and their lengths.
+    '''
+    first = np.ones(len(offsets), dtype=bool)
+    first[1:] = (ids[1:] != ids[:-1]) | (offsets[1:] != offsets[:-1] + 1)
+    starts = np.flatnonzero(first)
+    return starts, np.diff(np.append(starts, len(offsets)))
+
+
+def _missing_hours(cursor, df, timezone, interval):
+    '''
+    Finds the periods (in UTC) of the calendar missing (or null) between the
+    first and last values of each series of df (key, datehour_utc, value).
+    '''
+    first, last = cursor.execute(
+        'select min(datehour), max(datehour) from tbl_util_hourly_periods;'
+    ).fetchone()
+    if first is None or df.empty:
+        return _no_issue('missing')
+    (first, last), _ = to_utc(pd.to_datetime([first, last]), timezone,
+                              name='tbl_util_hourly_periods')
+    step = np.timedelta64(interval, 'm')
+    ids = df.iloc[:, 0].to_numpy()
+    offsets = (pd.to_datetime(df.iloc[:, 1]).to_numpy() - first) // step
+    in_calendar = (offsets >= 0) & (offsets <= (last - first) // step) & \
+        df.iloc[:, 2].notna().to_numpy()
+    ids, offsets = ids[in_calendar], offsets[in_calendar]
+    missing_ids, missing = list(), list()
+    for key_id in np.unique(ids):
+        present = offsets[ids == key_id]
+        expected = np.arange(present.min(), present.max() + 1)
+        gaps = np.setdiff1d(expected, present, assume_unique=True)
+        missing_ids.append(np.full(len(gaps), key_id))
+        missing.append(gaps)
+    if not missing:
+        return _no_issue('missing')
+    ids, missing = np.concatenate(missing_ids), np.concatenate(missing)
+    starts, lengths = _runs(ids, missing)
+    return ('missing', ids[starts], first + missing[starts] * step, lengths,
+            np.full(len(starts), np.nan),
+            np.array(['{} period(s) of {} min (UTC)'.format(n, interval)
+                      for n in lengths], dtype=object))
+
+
+def _missing_days(cursor):
+    '''
+    Finds the weekdays missing between the first and last daily prices of
+    each product.
+    '''
+    rows = cursor.execute(
+        '''
+            with ranges as (
+                select product_id, min(date) as first, max(date) as last
+                from tbl_hist_dailyprices
+                group by product_id)
+            select r.product_id, d.date
+            from ranges r
+            join tbl_util_daily_periods d
+                on d.date between r.first and r.last
+            where d.weekday <= 5 and not exists (
+                select 1 from tbl_hist_dailyprices p
+                where p.product_id = r.product_id and p.date = d.date)
+            order by r.product_id, d.date;
+        ''').fetchall()
+    if not rows:
+        return _no_issue('missing')
+    ids = np.array([row[0] for row in rows])
+    dates = pd.to_datetime([row[1] for row in rows]).to_numpy()
+    days = (dates - dates[0]) // np.timedelta64(1, 'D')
+    # Runs of weekdays: a weekend does not break a run
+    weekdays = days - 2 * ((days + pd.Timestamp(dates[0]).weekday()) // 7)
+    starts, lengths = _runs(ids, weekdays)
+    return ('missing', ids[starts], dates[starts], lengths,
+            np.full(len(starts), np.nan),
+            np.array(['{} weekday(s)'.format(n) for n in lengths],
+                     dtype=object))
+
+
+def _bid_ask(cursor):
+    '''
+    Finds the daily prices with a bid above the ask or a negative size.
+    '''
+    rows = cursor.execute(
+        '''
+            select product_id, date, bid, ask, bid_size, ask_size
+            from tbl_hist_dailyprices
+            where bid > ask or bid_size < 0 or ask_size < 0
+            order by product_id, date;
+        ''').fetchall()
+    if not rows:
+        return _no_issue('bid_ask')
+    return ('bid_ask', np.array([row[0] for row in rows]),
+            np.array([row[1] for row in rows], dtype=object),
+            np.ones(len(rows), dtype=np.int64),
+            np.array([row[2] - row[3] for row in rows]),
+            np.array(['bid {}, ask {}, sizes {} and {}'.format(*row[2:])
+                      for row in rows], dtype=object))
+
+
+def _outliers(df, z_score):
+    '''
+    Finds the values of df (key, period, value) more than z_score standard
+    deviations away from the mean of their series.
+    '''
+    if df.empty:
+        return _no_issue('outlier')
+    ids = df.iloc[:, 0].to_numpy()
+    values = df.iloc[:, 2].to_numpy(dtype=np.float64)
+    stats = df.iloc[:, [0, 2]].groupby(df.columns[0]).agg(['mean', 'std'])
+    mean = stats.iloc[:, 0].reindex(ids).to_numpy()
+    std = stats.iloc[:, 1].reindex(ids).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (values - mean) / std
+    outlier = np.abs(z) > z_score
+    if not outlier.any():
+        return _no_issue('outlier')
+    return ('outlier', ids[outlier],
+            df.iloc[:, 1].to_numpy()[outlier],
+            np.ones(int(outlier.sum()), dtype=np.int64), values[outlier],
+            np.array(['z-score {:.1f}'.format(score)
+                      for score in z[outlier]], dtype=object))
+
+
+def _no_issue(check):
+    '''
+    Returns an empty list of issues (see _write).
+    '''
+    return (check, [], None, None, None, None)
@@ -0,0 +1,236 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- fact_tables.py --
+
+Provides subroutines for materializing the joins of the historical data
+with the utility tables that every analysis needs (e.g., tbl_fact_hourly)
+and their aggregates by day and period (tbl_rollup_*).
+
+To do:
+  - None at the moment
+"""
+
+import logging
+import pandas as pd
+
+from modules.instrumentation import count_rows
+
+logger = logging.getLogger('make_dataset')
+
+# Products of the prices joined to the generation of the plants
+DEFAULT_PRODUCTS = {"Power": 'DAH', "Gas": 'Z1', "Carbon": 'Carbon'}
+
+
+class FactTablesError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+    pass
+
+
+def refresh_fact_hourly(conn, products=None, since=None):
+    '''
+    Populates tbl_fact_hourly with one row per plant and hour of generation,
+    joined to the power price, the gas and carbon prices
+    (mid of the daily prices), the period type and the season.
+
+    When since ('YYYY-MM-DD') is given, only the hours from the day before
+    on (in UTC, which covers the local hours of that day whatever the time
+    zone) are rebuilt; otherwise the whole table is.
+    '''
+    products = dict(DEFAULT_PRODUCTS, **(products or {}))
+    logger.info('. Refreshing tbl_fact_hourly{}'
+                .format(' from {}'.format(since) if since else ''))
+    cursor = conn.cursor()
+    params = dict(since=_day_before(since) if since else '')
+    for commodity in ('Power', 'Gas', 'Carbon'):
+        cursor.execute('select id from tbl_ref_price_products '
+                       'where product = ?;', (products[commodity], ))
+        row = cursor.fetchone()
+        if row is None:
+            logger.error('** Product {} not found in tbl_ref_price_products.'
+                         .format(products[commodity]))
+            raise FactTablesError
+        params[commodity.lower()] = row[0]
+
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('begin;')
+    try:
+        cursor.execute('delete from tbl_fact_hourly '
+                       'where datehour_utc >= :since;', params)
+        cursor.execute(
+            '''
+                insert into tbl_fact_hourly (plant_id, datehour_utc,
+                    datehour, dst, date, power, gas, carbon, generation,
+                    periodtype, season)
+                select gen.plant_id, gen.datehour_utc, gen.datehour, gen.dst,
+                    gen.date, power.price, (gas.bid + gas.ask) / 2.0,
+                    (carbon.bid + carbon.ask) / 2.0,
+                    coalesce(gen.generation, 0.0), hours.periodtype,
+                    days.season
+                from (
+                    select *, datetime(date(datehour)) as date
+                    from tbl_hist_generation
+                    where datehour_utc >= :since) gen
+                left join tbl_hist_intradayprices power
+                    on power.datehour_utc = gen.datehour_utc and
+                        power.product_id = :power
+                left join tbl_hist_dailyprices gas
+                    on gas.date = gen.date and gas.product_id = :gas
+                left join tbl_hist_dailyprices carbon
+                    on carbon.date = gen.date and carbon.product_id = :carbon
+                left join tbl_util_hourly_periods hours
+                    on hours.datehour = gen.datehour
+                left join tbl_util_daily_periods days
+                    on days.date = gen.date;
+            ''', params)
+        count_rows(rows_out=cursor.rowcount)
+        logger.info('.. {:,} rows written into tbl_fact_hourly'
+                    .format(cursor.rowcount))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def refresh_rollups(conn, since=None):
+    '''
+    Populates the rollups of tbl_fact_hourly and tbl_calc_dispatch_margins:
+    tbl_rollup_daily by plant, date and period type, and tbl_rollup_periods
+    by plant, month (MonthID), quarter (QuarterID) or year and season, and
+    period type.
+
+    When since ('YYYY-MM-DD') is given, only the days from the day before on
+    and the periods including them are rebuilt; otherwise the whole tables
+    are.
+    '''
+    logger.info('. Refreshing rollup tables{}'
+                .format(' from {}'.format(since) if since else ''))
+    cursor = conn.cursor()
+    params = dict(since=_day_before(since) if since else '')
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('begin;')
+    try:
+        cursor.execute('delete from tbl_rollup_daily where date >= :since;',
+                       params)
+        cursor.execute(
+            '''
+                insert into tbl_rollup_daily
+                select fact.plant_id, fact.date, fact.periodtype,
+                    count(*), count(fact.power), avg(fact.power),
+                    min(fact.power), max(fact.power), sum(fact.generation),
+                    min(fact.generation), max(fact.generation),
+                    count(calc.css_pmax), avg(calc.css_pmax),
+                    min(calc.css_pmax), max(calc.css_pmax),
+                    coalesce(sum(calc.act_margin), 0.0),
+                    coalesce(sum(calc.opt_margin), 0.0),
+                    coalesce(sum(calc.opportunity), 0.0)
+                from tbl_fact_hourly fact
+                left join tbl_calc_dispatch_margins calc
+                    on calc.datehour_utc = fact.datehour_utc and
+                        calc.plant_id = fact.plant_id
+                where fact.date >= :since and fact.periodtype is not null
+                group by fact.plant_id, fact.date, fact.periodtype;
+            ''', params)
+        count_rows(rows_out=cursor.rowcount)
+        logger.info('.. {:,} rows written into tbl_rollup_daily'
+                    .format(cursor.rowcount))
+
+        # Periods including at least one of the days rebuilt
+        cursor.execute(
+            '''
+                create temp table rollup_periods as
+                select date, 'month' as period, monthid as period_id
+                from tbl_util_daily_periods
+                union all
+                select date, 'quarter', quarterid
+                from tbl_util_daily_periods
+                union all
+                select date, 'season', year || '-' || season
+                from tbl_util_daily_periods;
+            ''')
+        cursor.execute(
+            '''
+                create temp table rollup_changes as
+                select distinct period, period_id from temp.rollup_periods
+                where date >= :since;
+            ''', params)
+        cursor.execute(
+            '''
+                delete from tbl_rollup_periods
+                where (period, period_id) in
+                    (select period, period_id from temp.rollup_changes);
+            ''')
+        cursor.execute(
+            '''
+                insert into tbl_rollup_periods
+                select daily.plant_id, periods.period, periods.period_id,
+                    daily.periodtype, min(daily.date), max(daily.date),
+                    count(*), sum(daily.hours), sum(daily.power_count),
+                    sum(daily.power_mean * daily.power_count) /
+                        nullif(sum(daily.power_count), 0),
+                    min(daily.power_min), max(daily.power_max),
+                    sum(daily.generation_sum), min(daily.generation_min),
+                    max(daily.generation_max), sum(daily.css_count),
+                    sum(daily.css_mean * daily.css_count) /
+                        nullif(sum(daily.css_count), 0),
+                    min(daily.css_min), max(daily.css_max),
+                    sum(daily.act_margin_sum), sum(daily.opt_margin_sum),
+                    sum(daily.opportunity_sum)
+                from tbl_rollup_daily daily
+                join temp.rollup_periods periods
+                    on periods.date = daily.date
+                where (periods.period, periods.period_id) in
+                    (select period, period_id from temp.rollup_changes)
+                group by daily.plant_id, periods.period, periods.period_id,
+                    daily.periodtype;
+            ''')
+        count_rows(rows_out=cursor.rowcount)
+        logger.info('.. {:,} rows written into tbl_rollup_periods'
+                    .format(cursor.rowcount))
+        cursor.execute('drop table temp.rollup_periods;')
+        cursor.execute('drop table temp.rollup_changes;')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _day_before(day):
+    '''
+    Returns the midnight of the day before day ('YYYY-MM-DD').
+    '''
+    return (pd.Timestamp(day) - pd.Timedelta(days=1)) \
+        .strftime('%Y-%m-%d %H:%M:%S')
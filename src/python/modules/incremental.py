@@ -0,0 +1,194 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- incremental.py --
+
+Provides subroutines for loading client's data incrementally: each source
+(file and sheet) is recorded in tbl_meta_sources with a content hash and the
+latest period loaded (watermark), so unchanged sources are skipped and only
+new or changed days are written. Files are only hashed by incremental loads:
+the sources recorded by other loads are loaded again by the next incremental
+one.
+
+To do:
+  - None at the moment
+"""
+
+import os
+import datetime
+import hashlib
+import logging
+
+logger = logging.getLogger('make_dataset')
+
+META_TABLE = 'tbl_meta_sources'
+LOADS_TABLE = 'tbl_meta_loads'
+
+
+def file_digest(f_name, block_size=1 << 20):
+    '''
+    Returns the SHA-256 hash of a file.
+    '''
+    digest = hashlib.sha256()
+    with open(f_name, 'rb') as f_in:
+        for block in iter(lambda: f_in.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_source(cursor, f_name, sheet_name, table, key_id):
+    '''
+    Returns the content hash and the watermark recorded for a source, or
+    None if the source has never been loaded.
+    '''
+    cursor.execute(
+        '''
+            select content_hash, watermark
+            from {}
+            where file_name = ? and sheet_name = ? and
+                target_table = ? and key_id = ?;
+        '''.format(META_TABLE),
+        (os.path.realpath(f_name), sheet_name or '', table, key_id))
+    return cursor.fetchone()
+
+
+def record_source(cursor, f_name, sheet_name, table, key_id, digest,
+                  watermark):
+    '''
+    Records the content hash of a source (None if not computed, i.e., loaded
+    without --incremental) and the latest period loaded from it.
+    '''
+    cursor.execute(
+        '''
+            insert or replace into {} (file_name, sheet_name, target_table,
+                key_id, file_size, content_hash, watermark, loaded_at)
+            values (?, ?, ?, ?, ?, ?, ?, ?);
+        '''.format(META_TABLE),
+        (os.path.realpath(f_name), sheet_name or '', table, key_id,
+         os.path.getsize(f_name), digest or '', watermark,
+         datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+
+
+def record_load(conn, incremental=False, first_day=None):
+    '''
+    Records a load of the database that changed its data and returns the new
+    load version (see query_service).
+    '''
+    cursor = conn.cursor()
+    cursor.execute(
+        '''
+            insert into {} (loaded_at, incremental, first_day)
+            values (?, ?, ?);
+        '''.format(LOADS_TABLE),
+        (datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+         int(incremental), first_day if incremental else None))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def create_staging_table(cursor, table, key_col=None, time_col=None):
+    '''
+    Creates an empty temporary table with the same columns as table, keyed
+    by (time_col, key_col) if given like the historical tables, and returns
+    its name.
+    '''
+    staging = 'temp.stg_{}'.format(table)
+    cursor.execute('drop table if exists {};'.format(staging))
+    cursor.execute('create table {} as select * from {} where 0;'
+                   .format(staging, table))
+    if key_col is not None and time_col is not None:
+        cursor.execute('create unique index temp.stg_{0}_idx_key '
+                       'on stg_{0} ({1}, {2});'.format(table, time_col,
+                                                       key_col))
+    return staging
+
+
+def merge_staging_table(cursor, staging, table, key, time_col, watermark):
+    '''
+    Merges the records of a staging table into table for the series
+    identified by key (column, id). Records after the watermark of the source
+    are appended; before, only the days whose records differ from the ones in
+    the database are replaced. Without watermark (source never loaded), all
+    the days covered by the staging table are compared. Returns the number of
+    records written and the first day written (None if none).
+    '''
+    key_col, key_id = key
+    cursor.execute('select min({t}), max({t}) from {stg};'
+                   .format(t=time_col, stg=staging))
+    first, last = cursor.fetchone()
+    # Records up to the watermark are compared with the ones in the database
+    if watermark is None or (last is not None and last < watermark):
+        watermark = last
+    params = dict(key_id=key_id, first=first or '', watermark=watermark or '')
+    cursor.execute(
+        '''
+            create temp table stg_days as
+            select date({t}) as day from (
+                select * from {stg} where {t} <= :watermark
+                except
+                select * from {tbl}
+                where {k} = :key_id and {t} between :first and :watermark)
+            union
+            select date({t}) from (
+                select * from {tbl}
+                where {k} = :key_id and {t} between :first and :watermark
+                except
+                select * from {stg});
+        '''.format(t=time_col, k=key_col, stg=staging, tbl=table), params)
+    try:
+        cursor.execute(
+            '''
+                delete from {tbl}
+                where {k} = :key_id and {t} >= :first and
+                    date({t}) in (select day from temp.stg_days);
+            '''.format(t=time_col, k=key_col, tbl=table), params)
+        cursor.execute(
+            '''
+                insert into {tbl}
+                select * from {stg}
+                where {t} > :watermark or
+                    date({t}) in (select day from temp.stg_days);
+            '''.format(t=time_col, stg=staging, tbl=table), params)
+        nb_rows = cursor.rowcount
+        cursor.execute('select count(*), min(day) from temp.stg_days;')
+        nb_days, first_day = cursor.fetchone()
+        cursor.execute('select date(min({t})) from {stg} '
+                       'where {t} > :watermark;'
+                       .format(t=time_col, stg=staging), params)
+        first_new = cursor.fetchone()[0]
+        logger.info('.. {:,} records merged into {} ({} days replaced)'
+                    .format(nb_rows, table, nb_days))
+    finally:
+        cursor.execute('drop table temp.stg_days;')
+        cursor.execute('drop table {};'.format(staging))
+    changed = [day for day in (first_day, first_new) if day is not None]
+    return nb_rows, min(changed) if changed else None
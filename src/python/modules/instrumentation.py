@@ -0,0 +1,216 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- instrumentation.py --
+
+Provides a light instrumentation layer recording, for each stage of a run
+(stages can be nested, e.g., 'Populating client's data / read'), the wall
+and CPU time, the rows read and written, the throughput and the peak
+memory, and writing them as a JSON run report.
+
+Usage:
+  with stage('Creating utility tables'):
+      ...
+      count_rows(rows_out=nb_rows)
+  write_report('run_report.json')
+
+To do:
+  - None at the moment
+"""
+
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class StageRecord(object):
+    '''
+    Measures of a stage, accumulated over all the times it is entered.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0  # (s)
+        self.cpu = 0.0  # (s), including the worker processes
+        self.rows_in = 0  # Records built from the client's data
+        self.rows_out = 0  # Rows written into the database
+        self.peak_rss = None  # (MB) peak memory of the process so far
+
+    def as_dict(self):
+        '''
+        Returns the measures as an ordered dictionary.
+        '''
+        rows = self.rows_out or self.rows_in
+        return OrderedDict([
+            ('name', self.name),
+            ('calls', self.calls),
+            ('wall_s', round(self.wall, 6)),
+            ('cpu_s', round(self.cpu, 6)),
+            ('rows_in', self.rows_in),
+            ('rows_out', self.rows_out),
+            ('rows_per_s',
+             round(rows / self.wall, 1) if rows and self.wall else None),
+            ('peak_rss_mb', self.peak_rss)
+        ])
+
+
+class RunReport(object):
+    '''
+    Stages of a run in the order they are first entered.
+    '''
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.stack = list()
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.info = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        '''
+        Records the time spent in a stage, nested in the current one.
+        '''
+        full_name = ' / '.join([s.name for s in self.stack[-1:]] + [name])
+        record = self.stages.get(full_name)
+        if record is None:
+            record = self.stages[full_name] = StageRecord(full_name)
+        self.stack.append(record)
+        start_wall, start_cpu = time.perf_counter(), _cpu_time()
+        try:
+            yield record
+        finally:
+            record.calls += 1
+            record.wall += time.perf_counter() - start_wall
+            record.cpu += _cpu_time() - start_cpu
+            record.peak_rss = _peak_rss()
+            self.stack.pop()
+
+    def count_rows(self, rows_in=0, rows_out=0):
+        '''
+        Adds rows to the current stage and the stages including it.
+        '''
+        for record in self.stack:
+            record.rows_in += rows_in
+            record.rows_out += rows_out
+
+    def as_dict(self):
+        '''
+        Returns the report as an ordered dictionary.
+        '''
+        import platform  # Only needed for the report (slow to import)
+        return OrderedDict([
+            ('started', self.started),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+            ('info', self.info),
+            ('peak_rss_mb', _peak_rss()),
+            ('stages', [r.as_dict() for r in self.stages.values()])
+        ])
+
+    def write(self, f_name):
+        '''
+        Writes the report as JSON into file f_name.
+        '''
+        import json
+        with open(f_name, 'w') as f_out:
+            json.dump(self.as_dict(), f_out, indent=2)
+            f_out.write('\n')
+
+
+# Report of the current run
+_run_report = RunReport()
+
+
+def stage(name):
+    '''
+    Context manager recording a stage of the current run.
+    '''
+    return _run_report.stage(name)
+
+
+def count_rows(rows_in=0, rows_out=0):
+    '''
+    Adds rows read and written to the current stage of the current run.
+    '''
+    _run_report.count_rows(rows_in, rows_out)
+
+
+def run_report():
+    '''
+    Returns the report of the current run.
+    '''
+    return _run_report
+
+
+def reset_report():
+    '''
+    Starts a new run report.
+    '''
+    global _run_report
+    _run_report = RunReport()
+    return _run_report
+
+
+def write_report(f_name):
+    '''
+    Writes the report of the current run as JSON into file f_name.
+    '''
+    _run_report.write(f_name)
+
+
+def _cpu_time():
+    '''
+    Returns the CPU time (user and system) of the process and of its
+    terminated children (e.g., worker processes).
+    '''
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _peak_rss():
+    '''
+    Returns the peak resident memory of the process (MB), None if unknown.
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    scale = 1 << 20 if sys.platform == 'darwin' else 1 << 10
+    return round(peak / scale, 1)
@@ -0,0 +1,131 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- load_profile.py --
+
+Provides the SQLite settings used while bulk loading the database: PRAGMAs
+and postponing the creation of secondary indexes until the data is loaded.
+
+To do:
+  - None at the moment
+"""
+
+import logging
+
+logger = logging.getLogger('make_dataset')
+
+# PRAGMAs set for each load profile ('default' keeps SQLite's settings)
+LOAD_PROFILES = {
+    'default': [],
+    'fast': [
+        ('journal_mode', 'MEMORY'),   # Rollback journal kept in memory
+        ('synchronous', 'OFF'),       # No fsync while loading
+        ('cache_size', -262144),      # 256 MB page cache
+        ('temp_store', 'MEMORY'),     # Temporary B-trees (e.g., sorts)
+        ('mmap_size', 268435456)      # 256 MB memory-mapped I/O
+    ]
+}
+
+# Tables whose secondary indexes are postponed in a fast load
+LOADED_TABLES = ('tbl_hist_%', 'tbl_util_%')
+
+
+class LoadProfileError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+
+
+def apply_load_profile(conn, profile):
+    '''
+    Sets the PRAGMAs associated with a load profile and returns the values
+    they had before (see restore_pragmas).
+    '''
+    if profile not in LOAD_PROFILES:
+        raise LoadProfileError('Unknown load profile \'{}\''.format(profile))
+    saved = list()
+    for pragma, value in LOAD_PROFILES[profile]:
+        saved.append((pragma, conn.execute('pragma {};'.format(pragma))
+                      .fetchone()[0]))
+        logger.info('.. pragma {} = {}'.format(pragma, value))
+        conn.execute('pragma {} = {};'.format(pragma, value))
+    return saved
+
+
+def restore_pragmas(conn, saved, wal=False):
+    '''
+    Restores the PRAGMAs changed by a load profile (saved, see
+    apply_load_profile). The journal mode is the only one saved in the
+    file, when it is WAL; the others only apply to the connection. With wal,
+    the database is left in write-ahead logging mode so readers (e.g., the
+    query service) are not blocked by later loads; otherwise, it keeps the
+    journal mode it had before the load.
+    '''
+    for pragma, value in saved:
+        if pragma != 'journal_mode' or not wal:
+            conn.execute('pragma {} = {};'.format(pragma, value))
+    if wal:
+        conn.execute('pragma journal_mode = WAL;')
+
+
+def drop_secondary_indexes(conn, tables=LOADED_TABLES):
+    '''
+    Drops the secondary indexes (i.e., not associated with a primary key or
+    a unique constraint) of the tables matching the patterns of tables.
+    Returns the SQL statements that recreate them.
+    '''
+    cursor = conn.cursor()
+    cursor.execute(
+        '''
+            select name, sql
+            from sqlite_master
+            where type = \'index\' and sql is not null and ({});
+        '''.format(' or '.join(['tbl_name like ?'] * len(tables))),
+        tables)
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute('drop index if exists {};'.format(name))
+    conn.commit()
+    logger.info('.. {} secondary indexes postponed'.format(len(indexes)))
+    return [sql for _, sql in indexes]
+
+
+def create_indexes(conn, statements):
+    '''
+    Creates the indexes dropped by drop_secondary_indexes and refreshes the
+    statistics used by the query planner.
+    '''
+    cursor = conn.cursor()
+    for sql in statements:
+        cursor.execute(sql)
+    cursor.execute('analyze;')
+    conn.commit()
@@ -0,0 +1,203 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- parse_cache.py --
+
+Provides a cache of the parsed client's files: the long-format records built
+from a sheet are stored as uncompressed NumPy arrays (one .npz file per
+sheet), so a file that did not change is never parsed twice. The records are
+written and read back batch by batch, so a streamed sheet is never held in
+memory as a whole. The cache has a size cap and evicts the least recently
+used entries.
+
+To do:
+  - None at the moment
+"""
+
+import os
+import hashlib
+import json
+import logging
+import zipfile
+from collections import OrderedDict
+import numpy as np
+
+logger = logging.getLogger('make_dataset')
+
+# Changing how records are built must invalidate the cache
+CACHE_VERSION = 6
+
+
+class ParseCache(object):
+    '''
+    Cache of the records parsed from client's files.
+    '''
+
+    def __init__(self, directory, max_size_mb=1024):
+        self.directory = directory
+        self.max_size = int(max_size_mb * 2 ** 20)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source):
+        '''
+        Returns the key of a source (see client_data.SheetSource), which
+        changes with the path, size and modification time of its file.
+        '''
+        stat = os.stat(source.f_in_name)
+        transform = getattr(source.transform, 'func', source.transform)
+        keywords = getattr(source.transform, 'keywords', dict())
+        identity = [
+            CACHE_VERSION, os.path.realpath(source.f_in_name), stat.st_size,
+            stat.st_mtime_ns, source.sheet_name, source.header_row,
+            source.skip_rows, source.select, source.table, list(source.key),
+            source.time_col, source.date_col, source.columns, source.period,
+            transform.__name__, sorted(keywords.items())]
+        return hashlib.sha256(json.dumps(identity, default=str)
+                              .encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, '{}.npz'.format(key))
+
+    def get(self, key):
+        '''
+        Returns an iterator over the batches of records (dictionaries of
+        arrays) stored under key, each batch being read when reached, or None
+        if there is no such entry.
+        '''
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            data = np.load(path, allow_pickle=False)
+        except (OSError, ValueError, zipfile.BadZipFile) as err:
+            logger.warning('** Warning: Ignoring corrupted cache entry ' +
+                           '\'{}\' ({}).'.format(path, err))
+            os.remove(path)
+            return None
+        os.utime(path)  # Most recently used
+        return _read_batches(data)
+
+    def put(self, key):
+        '''
+        Returns a writer (see CacheWriter) storing batches of records under
+        key.
+        '''
+        return CacheWriter(self, key)
+
+    def _evict(self):
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+            logger.info('.. Evicted \'{}\' from the parse cache'
+                        .format(name))
+
+
+class CacheWriter(object):
+    '''
+    Writes the batches of records (dictionaries of arrays) of an entry of the
+    parse cache as they are given. The entry is only stored, and the cache
+    trimmed, when the writer is closed after the last batch; it is dropped
+    if a batch cannot be cached (e.g., arrays of objects) or if the writer is
+    discarded.
+
+    Example:
+        writer = cache.put(key)
+        for batch in batches:
+            writer.write(batch)
+        writer.close()
+    '''
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.path = cache._path(key)
+        self.tmp_path = '{}.tmp.npz'.format(self.path[:-4])
+        self.archive = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_STORED,
+                                       allowZip64=True)
+        self.batches = 0
+
+    def write(self, arrays):
+        '''
+        Adds a batch of records to the entry.
+        '''
+        if self.archive is None:
+            return
+        if any(np.asarray(val).dtype.kind == 'O' for val in arrays.values()):
+            self.discard()  # Only plain arrays are cached
+            return
+        for col, val in arrays.items():
+            name = '{:06d}/{}.npy'.format(self.batches, col)
+            with self.archive.open(name, 'w', force_zip64=True) as f_out:
+                np.lib.format.write_array(f_out, np.asarray(val),
+                                          allow_pickle=False)
+        self.batches += 1
+
+    def close(self):
+        '''
+        Stores the entry written so far.
+        '''
+        if self.archive is None:
+            return
+        self.archive.close()
+        self.archive = None
+        os.replace(self.tmp_path, self.path)
+        self.cache._evict()
+
+    def discard(self):
+        '''
+        Drops the entry written so far.
+        '''
+        if self.archive is None:
+            return
+        self.archive.close()
+        self.archive = None
+        os.remove(self.tmp_path)
+
+
+def _read_batches(data):
+    '''
+    Yields the batches of records of an entry (see CacheWriter) opened with
+    np.load, then closes it.
+    '''
+    with data:
+        batches = OrderedDict()
+        for name in data.files:
+            batches.setdefault(name.split('/', 1)[0], list()).append(name)
+        for names in batches.values():
+            yield dict((name.split('/', 1)[1], data[name]) for name in names)
@@ -0,0 +1,428 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- query_service.py --
+
+Provides canned, parameterized queries over the processed database (prices,
+generation, facts, dispatch margins, commitment and rollups of a product or a
+plant over a range of days). Queries run on a pool of read-only connections
+and their results are kept in an LRU cache, dropped as soon as make_dataset
+records a new load version (see tbl_meta_loads). An optional local HTTP
+endpoint (asyncio) serves the same queries as JSON.
+
+Example:
+    service = QueryService('../../data/processed/tutorial1.db')
+    result = service.query('power_prices', product='DAH',
+                           start='2015-01-01', end='2015-01-31')
+    df = pd.DataFrame(list(result.rows), columns=result.columns)
+
+To do:
+  - None at the moment
+"""
+
+import os
+import json
+import queue
+import asyncio
+import datetime
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+from urllib.request import pathname2url
+
+logger = logging.getLogger('make_dataset')
+
+DEFAULT_MMAP_SIZE = 268435456  # 256 MB memory-mapped I/O per connection
+
+# Range of days used when start or end is not given
+FIRST_DAY = '1900-01-01'
+LAST_DAY = '2999-12-31'
+
+# A canned query: SQL statement with named parameters, parameters required
+# (besides start and end, the first and last days) and description
+CannedQuery = namedtuple('CannedQuery', ['sql', 'params', 'description'])
+
+# Rows of a query (tuples, shared with the cache) and load version read
+QueryResult = namedtuple('QueryResult', ['columns', 'rows', 'version'])
+
+# Hourly tables are scanned through their primary key on the hour in UTC
+# (a day of margin on each side) and filtered on the local hour
+QUERIES = {
+    "power_prices": CannedQuery(
+        '''
+            select h.datehour_utc, h.datehour, h.dst, h.price
+            from tbl_hist_intradayprices h
+            join tbl_ref_price_products p on p.id = h.product_id
+            where p.product = :product and
+                h.datehour_utc >= datetime(:start, '-1 day') and
+                h.datehour_utc < datetime(:end, '+2 days') and
+                h.datehour >= :start and h.datehour < date(:end, '+1 day')
+            order by h.datehour_utc;
+        ''', ('product', ), 'Hourly prices of a product'),
+    "daily_prices": CannedQuery(
+        '''
+            select d.date, d.bid, d.ask, d.bid_size, d.ask_size
+            from tbl_hist_dailyprices d
+            join tbl_ref_price_products p on p.id = d.product_id
+            where p.product = :product and
+                d.date >= :start and d.date < date(:end, '+1 day')
+            order by d.date;
+        ''', ('product', ), 'Daily prices of a product'),
+    "generation": CannedQuery(
+        '''
+            select g.datehour_utc, g.datehour, g.dst, g.generation
+            from tbl_hist_generation g
+            join tbl_ref_power_plants p on p.id = g.plant_id
+            where p.name = :plant and
+                g.datehour_utc >= datetime(:start, '-1 day') and
+                g.datehour_utc < datetime(:end, '+2 days') and
+                g.datehour >= :start and g.datehour < date(:end, '+1 day')
+            order by g.datehour_utc;
+        ''', ('plant', ), 'Hourly generation of a plant'),
+    "facts": CannedQuery(
+        '''
+            select f.datehour_utc, f.datehour, f.dst, f.power, f.gas,
+                f.carbon, f.generation, f.periodtype, f.season
+            from tbl_fact_hourly f
+            join tbl_ref_power_plants p on p.id = f.plant_id
+            where p.name = :plant and
+                f.datehour_utc >= datetime(:start, '-1 day') and
+                f.datehour_utc < datetime(:end, '+2 days') and
+                f.datehour >= :start and f.datehour < date(:end, '+1 day')
+            order by f.datehour_utc;
+        ''', ('plant', ), 'Hourly prices and generation of a plant'),
+    "dispatch_margins": CannedQuery(
+        '''
+            select m.datehour_utc, m.datehour, m.power, m.gas, m.carbon,
+                m.generation, m.css_pmin, m.css_pmax, m.css_duct,
+                m.act_margin, m.opt_margin, m.opportunity
+            from tbl_calc_dispatch_margins m
+            join tbl_ref_power_plants p on p.id = m.plant_id
+            where p.name = :plant and
+                m.datehour_utc >= datetime(:start, '-1 day') and
+                m.datehour_utc < datetime(:end, '+2 days') and
+                m.datehour >= :start and m.datehour < date(:end, '+1 day')
+            order by m.datehour_utc;
+        ''', ('plant', ), 'Hourly dispatch margins of a plant'),
+    "commitment": CannedQuery(
+        '''
+            select c.datehour_utc, c.datehour, c.online, c.startup,
+                c.generation, c.margin, c.opportunity
+            from tbl_calc_commitment c
+            join tbl_ref_power_plants p on p.id = c.plant_id
+            where p.name = :plant and
+                c.datehour_utc >= datetime(:start, '-1 day') and
+                c.datehour_utc < datetime(:end, '+2 days') and
+                c.datehour >= :start and c.datehour < date(:end, '+1 day')
+            order by c.datehour_utc;
+        ''', ('plant', ), 'Hourly optimal commitment of a plant'),
+    "rollup_daily": CannedQuery(
+        '''
+            select r.*
+            from tbl_rollup_daily r
+            join tbl_ref_power_plants p on p.id = r.plant_id
+            where p.name = :plant and
+                r.date >= :start and r.date < date(:end, '+1 day')
+            order by r.date, r.periodtype;
+        ''', ('plant', ), 'Daily aggregates of a plant by type of period'),
+    "rollup_periods": CannedQuery(
+        '''
+            select r.*
+            from tbl_rollup_periods r
+            join tbl_ref_power_plants p on p.id = r.plant_id
+            where p.name = :plant and r.period = :period and
+                r.last_date >= :start and r.first_date < date(:end, '+1 day')
+            order by r.period_id, r.periodtype;
+        ''', ('plant', 'period'),
+        'Aggregates of a plant by month, quarter or season')
+}
+
+
+class QueryServiceError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+
+
+class ConnectionPool(object):
+    '''
+    Pool of at most size read-only connections to a SQLite database, opened
+    when first needed and shared by threads.
+
+    Example:
+        pool = ConnectionPool('tutorial1.db')
+        with pool.connection() as conn:
+            conn.execute('select ...')
+    '''
+
+    def __init__(self, db_name, size=4, mmap_size=DEFAULT_MMAP_SIZE):
+        self.uri = 'file:{}?mode=ro'.format(
+            pathname2url(os.path.realpath(db_name)))
+        self.size = size
+        self.mmap_size = mmap_size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute('pragma query_only = 1;')
+        conn.execute('pragma mmap_size = {};'.format(self.mmap_size))
+        return conn
+
+    @contextmanager
+    def connection(self, timeout=None):
+        '''
+        Borrows a connection, waiting at most timeout seconds (None for no
+        limit) if all of them are in use.
+        '''
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.size
+                if can_open:
+                    self.opened += 1
+            if can_open:
+                try:
+                    conn = self._open()
+                except sqlite3.Error:
+                    with self.lock:
+                        self.opened -= 1
+                    raise
+            else:
+                try:
+                    conn = self.idle.get(timeout=timeout)
+                except queue.Empty:
+                    raise QueryServiceError('No connection available')
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    def close(self):
+        '''
+        Closes the idle connections.
+        '''
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self.lock:
+                self.opened -= 1
+
+
+class QueryService(object):
+    '''
+    Runs the canned queries (see QUERIES) on a pool of read-only connections
+    and caches the results of the cache_size latest queries for the current
+    load version of the database.
+    '''
+
+    def __init__(self, db_name, pool_size=4, cache_size=128,
+                 mmap_size=DEFAULT_MMAP_SIZE):
+        if not os.path.exists(db_name):
+            raise QueryServiceError('No database \'{}\''.format(db_name))
+        self.pool = ConnectionPool(db_name, pool_size, mmap_size)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.version = None  # Load version of the results cached
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.executor = None  # Threads running the queries of query_async
+
+    def load_version(self):
+        '''
+        Returns the version of the latest load (0 if none was recorded).
+        '''
+        with self.pool.connection() as conn:
+            try:
+                row = conn.execute(
+                    'select max(version) from tbl_meta_loads;').fetchone()
+            except sqlite3.OperationalError:  # Created before the versions
+                return 0
+        return row[0] or 0
+
+    def query(self, name, **params):
+        '''
+        Returns the result of the canned query name (see QUERIES) for the
+        parameters given (e.g., product='DAH', start='2015-01-01',
+        end='2015-12-31'), from the cache if the database has not been
+        loaded since it was computed.
+        '''
+        values = _parameters(name, params)
+        key = (name, tuple(sorted(values.items())))
+        version = self.load_version()
+        with self.lock:
+            if version != self.version:
+                self.cache.clear()
+                self.version = version
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+        with self.pool.connection() as conn:
+            try:
+                cursor = conn.execute(QUERIES[name].sql, values)
+            except sqlite3.Error as err:
+                raise QueryServiceError('Query \'{}\' failed: {}'
+                                        .format(name, err))
+            result = QueryResult([col[0] for col in cursor.description],
+                                 tuple(cursor.fetchall()), version)
+        with self.lock:
+            if version == self.version:
+                self.cache[key] = result
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return result
+
+    async def query_async(self, name, **params):
+        '''
+        Coroutine running query in one of pool_size threads.
+        '''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.pool.size)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, partial(self.query, name, **params))
+
+    def close(self):
+        '''
+        Closes the connections and the threads of the service.
+        '''
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.pool.close()
+
+
+def _parameters(name, params):
+    '''
+    Checks the parameters of a canned query and returns their values.
+    '''
+    if name not in QUERIES:
+        raise QueryServiceError('Unknown query \'{}\' (expected one of {})'
+                                .format(name, ', '.join(sorted(QUERIES))))
+    expected = QUERIES[name].params + ('start', 'end')
+    missing = [p for p in QUERIES[name].params if p not in params]
+    unknown = [p for p in params if p not in expected]
+    if missing or unknown:
+        raise QueryServiceError(
+            'Query \'{}\' expects {} (missing: {}, unknown: {})'.format(
+                name, ', '.join(expected), ', '.join(missing) or '-',
+                ', '.join(unknown) or '-'))
+    values = dict((p, str(params[p])) for p in QUERIES[name].params)
+    for p, default in (('start', FIRST_DAY), ('end', LAST_DAY)):
+        values[p] = str(params.get(p) or default)
+        try:
+            datetime.datetime.strptime(values[p], '%Y-%m-%d')
+        except ValueError:
+            raise QueryServiceError('Invalid {} \'{}\' (expected YYYY-MM-DD)'
+                                    .format(p, values[p]))
+    return values
+
+
+async def _handle_request(service, reader, writer):
+    '''
+    Answers a HTTP request: GET /queries lists the canned queries and
+    GET /query/<name>?<parameters> returns the result of a query as JSON.
+    '''
+    status, body = 200, None
+    try:
+        request_line = (await reader.readline()).decode('latin-1')
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass  # Headers are not used
+        method, target = (request_line.split(' ') + ['', ''])[:2]
+        url = urlsplit(target)
+        if method != 'GET':
+            status, body = 405, {"error": 'Only GET is supported'}
+        elif url.path == '/queries':
+            body = dict((name, {"params": list(q.params) + ['start', 'end'],
+                                "description": q.description})
+                        for name, q in sorted(QUERIES.items()))
+        elif url.path.startswith('/query/'):
+            result = await service.query_async(url.path[len('/query/'):],
+                                               **dict(parse_qsl(url.query)))
+            body = {"columns": result.columns, "rows": result.rows,
+                    "version": result.version}
+        else:
+            status, body = 404, {"error": 'Unknown path'}
+    except QueryServiceError as err:
+        status, body = 400, {"error": str(err)}
+    except Exception as err:
+        logger.error('** Error in answering a request: {}'.format(err))
+        status, body = 500, {"error": 'Internal error'}
+    payload = json.dumps(body).encode('utf-8')
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                 'Content-Length: {}\r\nConnection: close\r\n\r\n'
+                 .format(status, _REASONS[status], len(payload))
+                 .encode('latin-1') + payload)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def serve(service, host='127.0.0.1', port=8050):
+    '''
+    Serves the canned queries of service over HTTP until interrupted.
+    '''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(asyncio.start_server(
+        partial(_handle_request, service), host, port))
+    logger.info('. Serving queries on http://{}:{}/queries'
+                .format(host, port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
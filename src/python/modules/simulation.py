@@ -0,0 +1,273 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- simulation.py --
+
+Provides a Monte Carlo simulation of the clean spark spreads and margins of
+the gas-fired plants: paths of power, gas and carbon prices are resampled
+from the history of tbl_fact_hourly by blocks of consecutive days.
+
+The days to simulate are split into blocks of block_days days and each block
+is drawn among the historical blocks starting on the same weekday and in the
+same season, so every hour keeps its hour of the week (weekhour) and season
+and the prices of a block keep their joint moves. Days are periods of local
+time (24 * 60 / interval periods): the hour skipped when DST starts is
+interpolated and the repeated one is dropped. Missing daily prices are
+interpolated as in analytics.py.
+
+Paths are computed with NumPy by chunks of chunk_size paths (bounding the
+memory used), optionally by a pool of processes. Chunk k draws its blocks
+from the k-th child of the seed (see numpy.random.SeedSequence), so the
+results only depend on the seed and chunk_size, not on the number of
+processes.
+
+To do:
+  - None at the moment
+"""
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from modules.analytics import clean_spark_spread
+from modules.analytics import optimal_margin
+from modules.analytics import get_plant
+from modules.bulk_writer import BulkWriter
+from modules.utils import get_seasons
+
+logger = logging.getLogger('make_dataset')
+
+# Historical prices by day: power (days, periods per day), gas and carbon
+# (days), days without missing values (valid), weekday and season of the
+# days (first one in dates)
+History = namedtuple('History', ['dates', 'weekdays', 'seasons', 'power',
+                                 'gas', 'carbon', 'valid'])
+
+# Block of days simulated: position and number of its days and positions of
+# the historical days that can start it
+Block = namedtuple('Block', ['position', 'days', 'candidates'])
+
+
+class SimulationError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+    pass
+
+
+def _calendar(dates, seasons):
+    '''
+    Returns the weekdays (0 for Monday) and seasons of dates.
+    '''
+    return pd.DatetimeIndex(dates).weekday.values, get_seasons(dates, seasons)
+
+
+def load_history(conn, plant_id, seasons='northern', interval=60):
+    '''
+    Reads the hourly prices of a plant from tbl_fact_hourly and returns them
+    by local day (see History).
+    '''
+    df = pd.read_sql_query(
+        'select datehour, power, gas, carbon from tbl_fact_hourly '
+        'where plant_id = ? order by datehour_utc;',
+        conn, params=(plant_id, ))
+    if df.empty:
+        logger.error('** No prices for plant {} in tbl_fact_hourly.'
+                     .format(plant_id))
+        raise SimulationError
+    datehours = pd.DatetimeIndex(pd.to_datetime(df['datehour']))
+    days = datehours.normalize()
+    dates = pd.date_range(days.min(), days.max())
+    row = ((days - dates[0]) // pd.Timedelta(days=1)).values
+    col = (datehours.hour.values * 60 + datehours.minute.values) // interval
+    power = np.full((len(dates), 24 * 60 // interval), np.nan)
+    power[row, col] = df['power'].to_numpy(dtype=np.float64)
+    # Hour skipped when DST starts
+    power = pd.DataFrame(power).interpolate(
+        axis=1, limit=1, limit_area='inside').to_numpy()
+    gas, carbon = np.full(len(dates), np.nan), np.full(len(dates), np.nan)
+    gas[row] = df['gas'].to_numpy(dtype=np.float64)
+    carbon[row] = df['carbon'].to_numpy(dtype=np.float64)
+    # Daily prices are not published on weekends and holidays (see
+    # analytics.read_hourly_inputs)
+    gas, carbon = [pd.Series(values).interpolate(limit_area='inside')
+                   .to_numpy() for values in (gas, carbon)]
+    valid = ~(np.isnan(power).any(axis=1) | np.isnan(gas) | np.isnan(carbon))
+    weekdays, day_seasons = _calendar(dates, seasons)
+    return History(dates.values, weekdays, day_seasons, power, gas, carbon,
+                   valid)
+
+
+def block_plan(history, start_date, end_date, block_days=7,
+               seasons='northern'):
+    '''
+    Splits the days from start_date to end_date into blocks of block_days
+    days and returns them with the historical days that can start each of
+    them (see Block): same weekday and season, followed by days without
+    missing values.
+    '''
+    dates = pd.date_range(start_date, end_date)
+    if len(dates) == 0 or block_days < 1:
+        logger.error('** Invalid simulation period {} to {} or block of {} '
+                     'days.'.format(start_date, end_date, block_days))
+        raise SimulationError
+    weekdays, day_seasons = _calendar(dates, seasons)
+    # Number of valid days in a row from each historical day
+    run = np.zeros(len(history.valid) + 1, dtype=np.int64)
+    for i in range(len(history.valid) - 1, -1, -1):
+        run[i] = run[i + 1] + 1 if history.valid[i] else 0
+    plan = list()
+    for position in range(0, len(dates), block_days):
+        days = min(block_days, len(dates) - position)
+        candidates = np.flatnonzero(
+            (run[:-1] >= days) &
+            (history.weekdays == weekdays[position]) &
+            (history.seasons == day_seasons[position]))
+        if len(candidates) == 0:
+            logger.error('** No historical block of {} days starting on a '
+                         'weekday {} in {} for simulating {}.'.format(
+                             days, weekdays[position] + 1,
+                             day_seasons[position],
+                             dates[position].date()))
+            raise SimulationError
+        plan.append(Block(position, days, candidates))
+    return plan
+
+
+def simulate_chunk(history, plan, plant, paths, seed):
+    '''
+    Simulates paths of the days of plan (see block_plan) and returns the
+    mean prices and clean spark spreads and the optimal margin ($) of each
+    path (arrays of length paths).
+    '''
+    rng = np.random.default_rng(seed)
+    days = plan[-1].position + plan[-1].days
+    index = np.empty((paths, days), dtype=np.int64)
+    for block in plan:
+        starts = block.candidates[rng.integers(len(block.candidates),
+                                               size=paths)]
+        index[:, block.position:block.position + block.days] = \
+            starts[:, np.newaxis] + np.arange(block.days)
+    power = history.power[index]
+    gas = history.gas[index][..., np.newaxis]
+    carbon = history.carbon[index][..., np.newaxis]
+    css_pmax = clean_spark_spread(power, gas, carbon, plant['heatrate'],
+                                  plant['om'], plant['tc'],
+                                  plant['emission'])
+    css_duct = clean_spark_spread(power, gas, carbon, plant['heatrate_duct'],
+                                  plant['om_duct'], plant['tc'],
+                                  plant['emission'])
+    margin = optimal_margin(plant['powermax'], plant['duct'], css_pmax,
+                            css_duct)
+    return {
+        "power_mean": power.mean(axis=(1, 2)),
+        "gas_mean": gas.mean(axis=(1, 2)),
+        "carbon_mean": carbon.mean(axis=(1, 2)),
+        "css_pmax_mean": css_pmax.mean(axis=(1, 2)),
+        "css_duct_mean": css_duct.mean(axis=(1, 2)),
+        "opt_margin": margin.sum(axis=(1, 2))
+    }
+
+
+def _simulate_chunk(job):
+    '''
+    Unpacks the arguments of simulate_chunk (used by the workers processes).
+    '''
+    return simulate_chunk(*job)
+
+
+def simulate_margins(history, plan, plant, paths, seed=None, chunk_size=250,
+                     workers=1):
+    '''
+    Simulates paths paths of the days of plan by chunks of chunk_size paths,
+    computed by a pool of workers processes when workers is greater than 1,
+    and returns the statistics of each path (see simulate_chunk).
+    '''
+    sizes = [min(chunk_size, paths - start)
+             for start in range(0, paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(history, plan, plant, size, chunk_seed)
+            for size, chunk_seed in zip(sizes, seeds)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_simulate_chunk, jobs))
+    else:
+        chunks = [simulate_chunk(*job) for job in jobs]
+    return dict((col, np.concatenate([chunk[col] for chunk in chunks]))
+                for col in chunks[0])
+
+
+def create_simulated_margins(conn, plants, simulation, seasons='northern',
+                             interval=60, insert_batch_size=None, workers=1):
+    '''
+    Populates tbl_calc_simulated_margins with the statistics of the paths
+    simulated for each plant of dictionary plants (see analytics) given the
+    parameters of dictionary simulation: StartDate and EndDate (days
+    simulated), Paths, BlockDays (7 by default), Seed (none by default) and
+    ChunkSize (250 by default).
+    '''
+    logger.info('. Simulating margins')
+    try:
+        start_date, end_date = simulation['StartDate'], simulation['EndDate']
+        paths = int(simulation['Paths'])
+        block_days = int(simulation.get('BlockDays', 7))
+        seed = simulation.get('Seed')
+        chunk_size = int(simulation.get('ChunkSize', 250))
+    except (KeyError, TypeError, ValueError) as err:
+        logger.error('** Invalid simulation parameters: {}.'.format(err))
+        raise SimulationError
+    if paths < 1 or block_days < 1 or chunk_size < 1:
+        logger.error('** Invalid simulation parameters: Paths, BlockDays '
+                     'and ChunkSize must be positive.')
+        raise SimulationError
+    with BulkWriter(conn, insert_batch_size) as writer:
+        cursor = conn.cursor()
+        for name, attributes in plants.items():
+            plant = get_plant(cursor, name, attributes)
+            history = load_history(conn, plant['id'], seasons, interval)
+            plan = block_plan(history, start_date, end_date, block_days,
+                              seasons)
+            stats = simulate_margins(history, plan, plant, paths, seed,
+                                     chunk_size, workers)
+            cursor.execute('delete from tbl_calc_simulated_margins '
+                           'where plant_id = ?;', (plant['id'],))
+            writer.insert_arrays('tbl_calc_simulated_margins', dict({
+                "plant_id": plant['id'],
+                "path": np.arange(1, paths + 1)
+            }, **stats))
+            p5, p50, p95 = np.percentile(stats['opt_margin'], [5, 50, 95])
+            logger.info('.. {} {} to {}: optimal margin ${:,.2f}M (P5), '
+                        '${:,.2f}M (P50), ${:,.2f}M (P95) over {:,} paths'
+                        .format(name, start_date, end_date, p5 / 1e6,
+                                p50 / 1e6, p95 / 1e6, paths))
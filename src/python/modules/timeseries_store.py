@@ -0,0 +1,325 @@
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- timeseries_store.py --
+
+Provides a columnar store of the historical series of the database: one
+dense NumPy array (.npy) per product and plant, aligned on a calendar
+starting on StartDate, with NaN where a value is missing, and a JSON
+manifest (manifest.json) describing them.
+
+Each export writes its arrays into a new directory of the store and then
+replaces the manifest, which names that directory, so a reader opening the
+store sees either the previous export or the new one, never a mix of both.
+The arrays of the previous export are kept (a reader may have opened the
+previous manifest just before it was replaced); older ones are removed.
+
+Hourly prices and generation are indexed by the number of periods (of
+Interval minutes) in UTC since midnight (local time) of StartDate, so DST
+days have 23 or 25 periods and no period is skipped or repeated. Daily
+prices (mid of bid and ask) are indexed by the number of days since
+StartDate. Arrays are opened memory-mapped and read-only: slicing a range of
+days does not copy nor read the rest of the file, and the pages are shared
+by all the processes reading the store.
+
+Example:
+    store = TimeSeriesStore('../../data/processed/store')
+    power = store.read('prices/DAH', '2015-01-01', '2015-12-31')
+    datehours = store.datehours('prices/DAH', '2015-01-01', '2015-12-31')
+
+To do:
+  - None at the moment
+"""
+
+import os
+import re
+import json
+import glob
+import shutil
+import datetime
+import logging
+import sqlite3
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('make_dataset')
+
+MANIFEST = 'manifest.json'
+STORE_VERSION = 1
+
+# Prefix of the directories of the arrays of each export
+ARRAYS_PREFIX = 'arrays-'
+
+# Series exported: prefix of their names, SQL query returning (id, time,
+# value) and axis (periods or days)
+SERIES = (
+    ('prices', 'tbl_ref_price_products', 'product',
+     'select product_id, datehour_utc, price from tbl_hist_intradayprices;',
+     'periods'),
+    ('daily', 'tbl_ref_price_products', 'product',
+     'select product_id, date, (bid + ask) / 2.0 from tbl_hist_dailyprices;',
+     'days'),
+    ('generation', 'tbl_ref_power_plants', 'name',
+     'select plant_id, datehour_utc, generation from tbl_hist_generation;',
+     'periods'))
+
+
+class TimeSeriesStoreError(Exception):
+    '''
+    Class used for throwing errors.
+    '''
+    pass
+
+
+def _calendar(start_date, end_date, timezone, interval):
+    '''
+    Returns the first period in UTC and the numbers of periods and days of
+    the calendar from start_date to end_date (included).
+    '''
+    first, last = [pd.Timestamp(d).tz_localize(timezone).tz_convert('UTC')
+                   .tz_localize(None) for d in
+                   (start_date, pd.Timestamp(end_date) +
+                    pd.Timedelta(days=1))]
+    periods = (last - first) // pd.Timedelta(minutes=interval)
+    days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+    return first, periods, days
+
+
+def export_store(conn, directory, start_date, end_date, timezone='UTC',
+                 interval=60):
+    '''
+    Exports the series of tbl_hist_intradayprices (prices/<product>),
+    tbl_hist_dailyprices (daily/<product>) and tbl_hist_generation
+    (generation/<plant>) from start_date to end_date into directory. The
+    arrays are written into a new directory and the manifest, replaced
+    atomically, is written last, so readers never see a partial store.
+    '''
+    logger.info('. Exporting time series into \'{}\''.format(directory))
+    os.makedirs(directory, exist_ok=True)
+    arrays_dir = os.path.join(directory, '{}{}-{}'.format(
+        ARRAYS_PREFIX, datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'),
+        os.getpid()))
+    os.makedirs(arrays_dir)
+    try:
+        manifest = _export_arrays(conn, arrays_dir, start_date, end_date,
+                                  timezone, interval)
+    except BaseException:
+        shutil.rmtree(arrays_dir, ignore_errors=True)
+        raise
+    previous = _read_manifest(directory, missing_ok=True)
+    tmp_name = os.path.join(directory, MANIFEST + '.tmp')
+    with open(tmp_name, 'w') as f_out:
+        json.dump(manifest, f_out, indent=2, sort_keys=True)
+    os.replace(tmp_name, os.path.join(directory, MANIFEST))
+
+    # Arrays of the exports before the previous one
+    kept = set([manifest['arrays']] +
+               ([previous['arrays']] if previous is not None else []))
+    for path in glob.glob(os.path.join(directory, ARRAYS_PREFIX + '*')):
+        if os.path.basename(path) not in kept:
+            shutil.rmtree(path, ignore_errors=True)
+    return manifest
+
+
+def _export_arrays(conn, arrays_dir, start_date, end_date, timezone,
+                   interval):
+    '''
+    Writes the arrays of the series into arrays_dir (see export_store) and
+    returns the manifest describing them.
+    '''
+    first, periods, days = _calendar(start_date, end_date, timezone,
+                                     interval)
+    origins = {
+        "periods": (first.to_datetime64(),
+                    np.timedelta64(interval, 'm'), periods),
+        "days": (pd.Timestamp(start_date).to_datetime64(),
+                 np.timedelta64(1, 'D'), days)
+    }
+    cursor = conn.cursor()
+    series = dict()
+    for prefix, ref_table, ref_col, query, axis in SERIES:
+        names = dict(cursor.execute('select id, {} from {};'
+                                    .format(ref_col, ref_table)).fetchall())
+        df = pd.read_sql_query(query, conn)
+        if df.empty:
+            continue
+        ids = df.iloc[:, 0].to_numpy()
+        origin, step, length = origins[axis]
+        offsets = pd.to_datetime(df.iloc[:, 1]).to_numpy() - origin
+        index = offsets // step
+        keep = (offsets % step == np.timedelta64(0)) & \
+            (index >= 0) & (index < length)
+        values = df.iloc[:, 2].to_numpy(dtype=np.float64)
+        for key_id in np.unique(ids):
+            in_series = keep & (ids == key_id)
+            name = '{}/{}'.format(prefix, names.get(key_id, key_id))
+            array = np.full(length, np.nan)
+            array[index[in_series]] = values[in_series]
+            f_name = '{}.npy'.format(re.sub(r'[^\w.-]', '_',
+                                            name.replace('/', '_')))
+            np.save(os.path.join(arrays_dir, f_name), array)
+            count = int(np.isfinite(array).sum())
+            series[name] = {"file": f_name, "axis": axis,
+                            "id": int(key_id), "count": count}
+            logger.info('.. {}: {:,} values ({:,} missing)'.format(
+                name, count, length - count))
+
+    try:
+        load_version = cursor.execute(
+            'select max(version) from tbl_meta_loads;').fetchone()[0] or 0
+    except sqlite3.OperationalError:  # Created before the load versions
+        load_version = 0
+    manifest = {
+        "version": STORE_VERSION,
+        "load_version": load_version,
+        "created": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        "start_date": str(pd.Timestamp(start_date).date()),
+        "end_date": str(pd.Timestamp(end_date).date()),
+        "timezone": timezone,
+        "interval": interval,
+        "first_period_utc": str(first),
+        "periods": int(periods),
+        "days": int(days),
+        "arrays": os.path.basename(arrays_dir),
+        "series": series
+    }
+    return manifest
+
+
+def _read_manifest(directory, missing_ok=False):
+    '''
+    Returns the manifest of the store in directory.
+    '''
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as f_in:
+            manifest = json.load(f_in)
+    except FileNotFoundError:
+        if missing_ok:
+            return None
+        logger.error('** No time series store in \'{}\'.'.format(directory))
+        raise TimeSeriesStoreError
+    except ValueError:
+        logger.error('** Invalid manifest in \'{}\'.'.format(directory))
+        raise TimeSeriesStoreError
+    if manifest.get('version') != STORE_VERSION:
+        if missing_ok:
+            return None
+        logger.error('** Time series store in \'{}\' has version {} '
+                     '(expected {}).'.format(directory,
+                                             manifest.get('version'),
+                                             STORE_VERSION))
+        raise TimeSeriesStoreError
+    return manifest
+
+
+class TimeSeriesStore(object):
+    '''
+    Reader of a store written by export_store. Arrays are memory-mapped the
+    first time they are read, from the export of the manifest read when the
+    store was opened: they remain readable as long as at most one export
+    happens before they are first read.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = _read_manifest(directory)
+        self.first_period = np.datetime64(self.manifest['first_period_utc'])
+        self.first_day = np.datetime64(self.manifest['start_date'])
+        self.arrays = dict()
+
+    def names(self):
+        '''
+        Returns the names of the series (e.g., prices/DAH, daily/Z1,
+        generation/PP).
+        '''
+        return sorted(self.manifest['series'])
+
+    def _series(self, name):
+        if name not in self.manifest['series']:
+            logger.error('** No series {} in the time series store.'
+                         .format(name))
+            raise TimeSeriesStoreError
+        return self.manifest['series'][name]
+
+    def bounds(self, name, start=None, end=None):
+        '''
+        Returns the positions [i, j) of the days start to end (included,
+        local dates as strings or datetimes) in the array of series name.
+        '''
+        axis = self._series(name)['axis']
+        length = self.manifest[axis]
+        positions = list()
+        for day, shift, default in ((start, 0, 0), (end, 1, length)):
+            if day is None:
+                positions.append(default)
+                continue
+            day = pd.Timestamp(day).normalize() + pd.Timedelta(days=shift)
+            if axis == 'days':
+                offset = (day - pd.Timestamp(self.first_day)).days
+            else:
+                utc = day.tz_localize(self.manifest['timezone']) \
+                    .tz_convert('UTC').tz_localize(None)
+                offset = (utc - pd.Timestamp(self.first_period)) // \
+                    pd.Timedelta(minutes=self.manifest['interval'])
+            positions.append(min(max(offset, 0), length))
+        return positions[0], positions[1]
+
+    def read(self, name, start=None, end=None):
+        '''
+        Returns the values of series name from day start to day end
+        (included, whole series by default) as a read-only view of the
+        memory-mapped array.
+        '''
+        if name not in self.arrays:
+            try:
+                self.arrays[name] = np.load(
+                    os.path.join(self.directory, self.manifest['arrays'],
+                                 self._series(name)['file']),
+                    mmap_mode='r')
+            except FileNotFoundError:
+                logger.error('** Series {} of the time series store was '
+                             'replaced by later exports (open the store '
+                             'again).'.format(name))
+                raise TimeSeriesStoreError
+        i, j = self.bounds(name, start, end)
+        return self.arrays[name][i:j]
+
+    def datehours(self, name, start=None, end=None):
+        '''
+        Returns the UTC datetimes (dates for daily series) of the values
+        returned by read.
+        '''
+        i, j = self.bounds(name, start, end)
+        if self._series(name)['axis'] == 'days':
+            return self.first_day + np.arange(i, j).astype('timedelta64[D]')
+        return self.first_period + np.arange(i, j) * \
+            np.timedelta64(self.manifest['interval'], 'm')
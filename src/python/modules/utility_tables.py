@@ -39,61 +39,84 @@ To do:
   - None at the moment
 """
 
-import datetime
 import logging
+import numpy as np
 import pandas as pd
 
-from modules.utils import get_season
+from modules.bulk_writer import BulkWriter
+from modules.instrumentation import stage
+from modules.utils import get_seasons
+from modules.utils import season_table
 
 logger = logging.getLogger('client_data')
 
+# Length of the periods (in minutes) supported by tbl_util_hourly_periods
+INTERVALS = (60, 30, 15, 5)
+
 
 class UtilTablesError(Exception):
     pass
 
 
-def create_utility_tables(conn, start_date, end_date, start_peak, end_peak):
+def create_utility_tables(conn, start_date, end_date, start_peak, end_peak,
+                          insert_batch_size=None, interval=60,
+                          seasons='northern'):
     '''
-    Populates tables used to provide attributes to days and hours.
+    Populates tables used to provide attributes to days and hours (or
+    periods of interval minutes). See utils.season_table for seasons.
     '''
     logger.info('. Creating utility talbes')
-    cursor = conn.cursor()
-    _create_hourly_periods(conn, cursor, start_date, end_date,
-                           start_peak, end_peak)
-    _create_daily_periods(conn, cursor, start_date, end_date)
-
-
-def _create_hourly_periods(conn, cursor, start_date, end_date,
-                           start_peak, end_peak):
+    if interval not in INTERVALS:
+        logger.error('** Interval of {} minutes not supported (use {}).'
+                     .format(interval, ', '.join(map(str, INTERVALS))))
+        raise UtilTablesError
+    try:
+        season_table(seasons)
+    except (ValueError, TypeError) as err:
+        logger.error('** Invalid seasons {}: {}.'.format(seasons, err))
+        raise UtilTablesError
+    with BulkWriter(conn, insert_batch_size) as writer:
+        cursor = conn.cursor()
+        with stage('hourly periods'):
+            _create_hourly_periods(writer, cursor, start_date, end_date,
+                                   start_peak, end_peak, interval)
+        with stage('daily periods'):
+            _create_daily_periods(writer, cursor, start_date, end_date,
+                                  seasons)
+
+
+def _create_hourly_periods(writer, cursor, start_date, end_date,
+                           start_peak, end_peak, interval=60):
     '''
-    Populates attributes associated hours.
+    Populates attributes associated hours (or periods of interval minutes,
+    column hour being then the period of the day).
     '''
     logger.info('.. Creating hourly table')
 
     # Delete any previous records
     cursor.execute('delete from tbl_util_hourly_periods;')
-    conn.commit()
 
-    list_of_records = list()
     range_of_dates = pd.date_range(start_date, end_date)
-    for d in range_of_dates:
-        for h in range(0, 24):
-            record = dict({
-                "date": d,
-                "hour": h + 1,
-                "datehour": datetime.datetime(d.year, d.month, d.day, h),
-                "weekhour": d.weekday() * 24 + h + 1,
-                "periodtype": 'On-Peak' if d.weekday() < 6 and
-                h >= start_peak and h <= end_peak
-                else 'Off-Peak'
-            })
-            list_of_records.append(record)
-    df = pd.DataFrame(list_of_records)
-    df.to_sql('tbl_util_hourly_periods', conn, if_exists='append', index=False)
-    conn.commit()
-
-
-def _create_daily_periods(conn, cursor, start_date, end_date):
+    nb_days = len(range_of_dates)
+    periods_per_day = 24 * 60 // interval
+
+    # One row per period: days are repeated and periods are tiled
+    dates = np.repeat(range_of_dates.values, periods_per_day)
+    weekdays = np.repeat(range_of_dates.weekday.values, periods_per_day)
+    minutes = np.tile(np.arange(periods_per_day) * interval, nb_days)
+    hours = minutes // 60
+    on_peak = (weekdays < 6) & (hours >= start_peak) & (hours <= end_peak)
+    writer.insert_arrays('tbl_util_hourly_periods', {
+        "date": dates,
+        "hour": np.tile(np.arange(1, periods_per_day + 1), nb_days),
+        "datehour": dates + minutes.astype('timedelta64[m]'),
+        "weekhour": weekdays * 24 + hours + 1,
+        "periodtype": np.where(on_peak, 'On-Peak', 'Off-Peak')
+    })
+
+
+def _create_daily_periods(writer, cursor, start_date, end_date,
+                          seasons='northern'):
     '''
     Populates attributes associated hours.
     '''
@@ -101,23 +124,26 @@ def _create_daily_periods(conn, cursor, start_date, end_date):
 
     # Delete any previous records
     cursor.execute('delete from tbl_util_daily_periods;')
-    conn.commit()
 
-    list_of_records = list()
     range_of_dates = pd.date_range(start_date, end_date)
-    for d in range_of_dates:
-        record = dict({
-            "Date": d,
-            "Year": d.year,
-            "Month": d.month,
-            "Week": d.isocalendar()[1],
-            "Weekday": d.weekday() + 1,
-            "QuarterID": "Q{}".format(d.year * 10 + (d.month - 1) // 3 + 1),
-            "MonthID": "M{}".format(d.year * 100 + d.month),
-            "WeekID": "W{}".format(d.year * 100 + d.isocalendar()[1]),
-            "Season": get_season(d)
-        })
-        list_of_records.append(record)
-    df = pd.DataFrame(list_of_records)
-    df.to_sql('tbl_util_daily_periods', conn, if_exists='append', index=False)
-    conn.commit()
+    years = range_of_dates.year.values
+    months = range_of_dates.month.values
+    weeks = range_of_dates.isocalendar().week.values.astype(np.int64)
+    writer.insert_arrays('tbl_util_daily_periods', {
+        "Date": range_of_dates.values,
+        "Year": years,
+        "Month": months,
+        "Week": weeks,
+        "Weekday": range_of_dates.weekday.values + 1,
+        "QuarterID": _ids('Q', years * 10 + (months - 1) // 3 + 1),
+        "MonthID": _ids('M', years * 100 + months),
+        "WeekID": _ids('W', years * 100 + weeks),
+        "Season": get_seasons(range_of_dates, seasons)
+    })
+
+
+def _ids(prefix, values):
+    '''
+    Builds identifiers such as 'M201501' from a prefix and integers.
+    '''
+    return np.char.add(prefix, values.astype(str)).astype(object)
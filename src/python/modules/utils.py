@@ -36,7 +36,13 @@ Provides some utilities.
 """
 
 import datetime
+import logging
 from datetime import date
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('make_dataset')
 
 Months = {
     "January": 1,
@@ -53,6 +59,14 @@ Months = {
     "December": 12
 }
 
+# First day (month, day) of each season; the year starts in the last season
+Seasons = {
+    "northern": [('spring', 3, 21), ('summer', 6, 21),
+                 ('autumn', 9, 23), ('winter', 12, 21)],
+    "southern": [('autumn', 3, 21), ('winter', 6, 21),
+                 ('spring', 9, 23), ('summer', 12, 21)]
+}
+
 
 def convert_to_numeric(val):
     '''
@@ -66,19 +80,139 @@ def convert_to_numeric(val):
     return val2
 
 
-def get_season(d):
+def coerce_numeric(values, on_error='nan', name='values'):
     '''
-    Provides the season for a given date d.
+    Converts an array-like (e.g., a column of a dataframe) into floats in one
+    vectorized operation. Empty cells become NaN; cells that cannot be
+    converted are errors, counted and logged once with their location, and
+    handled according to on_error:
+      - 'zero': replaced by 0 (as convert_to_numeric does)
+      - 'nan': replaced by NaN
+      - 'drop': removed from the values returned
+      - 'raise': a ValueError is raised
+    Returns the values and a mask of the cells in error (same length as the
+    input, so callers can drop the same rows from other columns).
+    '''
+    if on_error not in ('zero', 'nan', 'drop', 'raise'):
+        raise ValueError('Unknown on_error \'{}\''.format(on_error))
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    numeric = pd.to_numeric(series, errors='coerce') \
+        .to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+    if not pd.api.types.is_numeric_dtype(series):
+        # pd.to_numeric may round text (e.g., read from CSV files) to the
+        # last digit; numbers given as text are converted exactly
+        text = np.fromiter((isinstance(v, str) for v in series),
+                           dtype=bool, count=len(series)) & ~np.isnan(numeric)
+        if text.any():
+            numeric[text] = series.to_numpy(dtype=object)[text] \
+                .astype(np.float64)
+    errors = np.isnan(numeric) & series.notna().to_numpy()
+    nb_errors = int(errors.sum())
+    if nb_errors:
+        locations = ', '.join(str(label) for label in series.index[errors][:5])
+        message = '{} non-numeric value(s) in {} (rows {}{})'.format(
+            nb_errors, name, locations, ', ...' if nb_errors > 5 else '')
+        if on_error == 'raise':
+            raise ValueError(message)
+        logger.warning('** Warning: {}.'.format(message))
+        if on_error == 'zero':
+            numeric[errors] = 0
+        elif on_error == 'drop':
+            numeric = numeric[~errors]
+    return numeric, errors
+
+
+def to_utc(local, timezone, ambiguous=None, name='datetimes'):
+    '''
+    Converts naive local datetimes of a market (in timezone, e.g.,
+    'US/Pacific') to naive UTC datetimes in one vectorized operation.
+
+    The hour repeated when DST ends is ambiguous: ambiguous (array of
+    booleans, True for DST) tells which occurrence is which; by default, the
+    first occurrence of a datetime is DST and the next ones standard time.
+    Local datetimes skipped when DST starts do not exist: they are logged
+    once and become NaT.
+
+    Returns the UTC datetimes and the DST flags (1 when the local datetime
+    is daylight saving time, 0 otherwise).
+    '''
+    local = pd.DatetimeIndex(local)
+    if ambiguous is None:
+        ambiguous = ~local.duplicated(keep='first')
+    utc = local.tz_localize(timezone,
+                            ambiguous=np.asarray(ambiguous, dtype=bool),
+                            nonexistent='NaT') \
+        .tz_convert('UTC').tz_localize(None)
+    nonexistent = utc.isna() & local.notna()
+    if nonexistent.any():
+        logger.warning('** Warning: {} non-existent local time(s) in {} '
+                       '({}) skipped.'.format(
+                           int(nonexistent.sum()), name,
+                           ', '.join(str(d) for d in local[nonexistent][:5])))
+
+    # DST when the UTC offset is larger than the standard one of the year
+    offsets = (local - utc).to_numpy(dtype='timedelta64[ns]')
+    years = local.year.to_numpy(dtype=np.float64, na_value=np.nan)
+    standard = np.zeros(len(local), dtype='timedelta64[ns]')
+    for year in np.unique(years[~np.isnan(years)]):
+        standard[years == year] = min(
+            pd.Timestamp(int(year), month, 1).tz_localize(timezone)
+            .utcoffset() for month in (1, 7))
+    dst = np.where(utc.isna(), 0, offsets > standard).astype(np.int8)
+    return utc.to_numpy(dtype='datetime64[ns]'), dst
+
+
+def season_table(seasons='northern'):
     '''
+    Returns an array of 366 seasons indexed by the day of a leap year (0 for
+    January 1st, 59 for February 29th) where seasons is either a hemisphere
+    (see Seasons) or a list of (season, month, day) giving the first day of
+    each season.
+    '''
+    if isinstance(seasons, str):
+        if seasons not in Seasons:
+            raise ValueError('Unknown seasons \'{}\''.format(seasons))
+        seasons = Seasons[seasons]
+    return _season_table(tuple(tuple(season) for season in seasons))
+
+
+@lru_cache(maxsize=None)
+def _season_table(seasons):
     Y = 2016  # dummy leap year to allow input X-02-29 (leap day)
-    seasons = [('winter', (date(Y, 1, 1), date(Y, 3, 20))),
-               ('spring', (date(Y, 3, 21), date(Y, 6, 20))),
-               ('summer', (date(Y, 6, 21), date(Y, 9, 22))),
-               ('autumn', (date(Y, 9, 23), date(Y, 12, 20))),
-               ('winter', (date(Y, 12, 21), date(Y, 12, 31)))]
+    seasons = sorted(seasons, key=lambda season: (season[1], season[2]))
+    starts = [date(Y, month, day).timetuple().tm_yday - 1
+              for _, month, day in seasons]
+    names = np.array([name for name, _, _ in seasons], dtype=object)
+    # Days before the first start belong to the last season of the year
+    table = names[np.searchsorted(starts, np.arange(366), side='right') - 1]
+    table.setflags(write=False)
+    return table
+
+
+def get_seasons(dates, seasons='northern'):
+    '''
+    Provides the seasons of an array of dates (e.g., DatetimeIndex, NumPy
+    datetime64 array) in one lookup of the season table.
+    '''
+    dates = pd.DatetimeIndex(dates)
+    # Day of a leap year, i.e., shifted by one after February in other years
+    days = dates.dayofyear.values - 1 + \
+        ((~dates.is_leap_year) & (dates.month > 2))
+    return season_table(seasons)[days]
+
+
+def get_season(d, seasons='northern'):
+    '''
+    Provides the season for a given date d.
+    '''
     if isinstance(d, datetime.datetime):
-        dd = date(Y, d.month, d.day)
-        return next(season for season, (start, end) in seasons
-                    if start <= dd <= end)
+        day = d.timetuple().tm_yday - 1
+        if d.month > 2 and not _is_leap_year(d.year):
+            day += 1
+        return season_table(seasons)[day]
     else:
         raise ValueError('The date provided to get_season is not a valid date')
+
+
+def _is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
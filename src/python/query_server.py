@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+
+"""
+Copyright (c) 2019, Pyxidr and/or its affiliates. All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions
+are met:
+
+  - Redistributions of source code must retain the above copyright
+    notice, this list of conditions and the following disclaimer.
+
+  - Redistributions in binary form must reproduce the above copyright
+    notice, this list of conditions and the following disclaimer in the
+    documentation and/or other materials provided with the distribution.
+
+  - Neither the name of Pyxidr or the names of its
+    contributors may be used to endorse or promote products derived
+    from this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS
+IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO,
+THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+PURPOSE ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR
+CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF
+LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING
+NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+===============================================================================
+
+-- query_server.py --
+
+Utility used to serve the canned queries of a SQLite database populated by
+make_dataset as JSON over HTTP (e.g., GET /query/power_prices?product=DAH&
+start=2015-01-01&end=2015-01-31; GET /queries lists them).
+
+To do:
+  - None at the moment
+"""
+
+import sys
+import argparse
+import logging
+
+from modules.query_service import QueryService
+from modules.query_service import QueryServiceError
+from modules.query_service import serve
+
+__version__ = "0.1a"
+
+logger = logging.getLogger('make_dataset')
+
+
+def query_server():
+    '''
+    Implementation of query_server.
+    '''
+
+    # Define and read the various user's options
+    _description = 'Serves canned queries of a SQLite database over HTTP'
+    _epilog = 'Contact research@pyxidr.com for further information.'
+    aparser = argparse.ArgumentParser(description=_description,
+                                      epilog=_epilog)
+    aparser.add_argument('-v', '--version', action='version',
+                         version='%(prog)s {}'.format(__version__))
+    aparser.add_argument('-d', '--db', dest='database',
+                         help='SQLite database file', required=True)
+    aparser.add_argument('-V', '--verbose', dest='verbose',
+                         action='store_true', help='verbose')
+    aparser.add_argument('--host', dest='host', default='127.0.0.1',
+                         help='address to listen on, default 127.0.0.1')
+    aparser.add_argument('--port', dest='port', type=int, default=8050,
+                         help='port to listen on, default 8050')
+    aparser.add_argument('--pool_size', dest='pool_size', type=int,
+                         default=4,
+                         help='number of read-only connections, default 4')
+    aparser.add_argument('--cache_size', dest='cache_size', type=int,
+                         default=128,
+                         help='number of query results cached, default 128')
+
+    args = aparser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(format='%(message)s', level=logging.INFO)
+
+    try:
+        service = QueryService(args.database, args.pool_size,
+                               args.cache_size)
+    except QueryServiceError as err:
+        logger.error('** Error in opening the database: {}'.format(err))
+        sys.exit(2)
+    try:
+        serve(service, args.host, args.port)
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    query_server()
@@ -38,6 +38,9 @@
  * - Table name starts with tbl_
  *     . Reference data are followed by Ref_ (they are usually "manually" populated)
  *     . Historical data are followed by Hist_ (they should be automatically populated)
+ *     . Facts joining historical and utility data are followed by Fact_
+ *     . Aggregates of the facts are followed by Rollup_
+ *     . Calculated data are followed by Calc_ (they are derived from the other tables)
  * - View name starts with qry_
  *
  * Instructions:
@@ -150,18 +153,18 @@ values
 ***********************/
 
 -- tbl_Hist_Generation: Actual generation
+-- Hours are stored in UTC so the hour repeated when DST ends has its own key
 
 create table if not exists tbl_hist_generation
 (
-    datehour timestamp not null,
+    datehour_utc timestamp not null,
+    datehour timestamp not null,  -- Local hour of the market
+    dst smallint not null,        -- 1 if datehour is daylight saving time
     plant_id integer not null,
     generation real default 0.0,  -- MWh
-    -- primary key (datehour, plant_id),  -- Doesn't work as some days have twice 2am due to time change
+    primary key (datehour_utc, plant_id),
     foreign key (plant_id) references tbl_ref_power_plants(id)
-);
-
-create index if not exists tbl_hist_generation_idx_datehour on tbl_hist_generation (datehour);
-create index if not exists tbl_hist_generation_idx_plant_id on tbl_hist_generation (plant_id);
+) without rowid;
 
 -- Tables related to historical prices
 
@@ -183,15 +186,46 @@ create table if not exists tbl_hist_dailyprices
 
 create table if not exists tbl_hist_intradayprices
 (
-    datehour timestamp not null,  -- Could be hourly, 30-min or 5-min periods
+    datehour_utc timestamp not null,  -- Could be hourly, 30-min or 5-min periods
+    datehour timestamp not null,      -- Local period of the market
+    dst smallint not null,            -- 1 if datehour is daylight saving time
     product_id integer not null,
     price real not null,
-    -- primary key (datehour, product_id),  -- Doesn't work as some days have twice 2am due to time change
+    primary key (datehour_utc, product_id),
     foreign key (product_id) references tbl_ref_priceproducts(id)
+) without rowid;
+
+/*********************************************
+**                                          **
+**  Metadata about the loaded client's data **
+**                                          **
+**********************************************/
+
+-- tbl_meta_sources: Files (and sheets) loaded into the historical tables
+
+create table if not exists tbl_meta_sources
+(
+    file_name varchar(255) not null,
+    sheet_name varchar(50) not null,    -- Empty string for the first sheet
+    target_table varchar(50) not null,
+    key_id integer not null,            -- product_id or plant_id
+    file_size integer not null,         -- (bytes)
+    content_hash varchar(64) not null,  -- SHA-256 of the file (empty if not loaded incrementally)
+    watermark timestamp,                -- Latest period loaded
+    loaded_at timestamp not null,
+    primary key (file_name, sheet_name, target_table, key_id)
 );
 
-create index if not exists tbl_hist_intradayprices_idx_datehour on tbl_hist_intradayprices (datehour);
-create index if not exists tbl_hist_intradayprices_idx_product_id on tbl_hist_intradayprices (product_id);
+-- tbl_meta_loads: Loads of the database; the latest version tells readers
+-- (e.g., the query service) that the data changed
+
+create table if not exists tbl_meta_loads
+(
+    version integer primary key autoincrement,
+    loaded_at timestamp not null,
+    incremental integer not null,       -- 1 for an incremental load
+    first_day date                      -- First day written (null if all)
+);
 
 /*********************************************
 **                                          **
@@ -239,3 +273,178 @@ create table if not exists tbl_util_hourly_periods
 create index if not exists tbl_util_hourly_periods_idx_datehour on tbl_util_hourly_periods (datehour);
 create index if not exists tbl_util_hourly_periods_idx_weekhour on tbl_util_hourly_periods (weekhour);
 create index if not exists tbl_util_hourly_periods_idx_periodtype on tbl_util_hourly_periods (periodtype);
+
+/*********************************************
+**                                          **
+**  Facts (materialized joins)              **
+**                                          **
+**********************************************/
+
+-- tbl_fact_hourly: Generation of the plants joined to prices and periods
+-- (clustered by plant and hour so reading a plant is a range scan)
+
+create table if not exists tbl_fact_hourly
+(
+    plant_id integer not null,
+    datehour_utc timestamp not null,
+    datehour timestamp not null,  -- Local hour of the market
+    dst smallint not null,        -- 1 if datehour is daylight saving time
+    date date not null,           -- Local date
+    power real,                   -- Power price ($/MWh)
+    gas real,                     -- Gas price ($/mmBtu)
+    carbon real,                  -- Carbon price ($/tonne)
+    generation real not null,     -- MWh
+    periodtype varchar(10),
+    season varchar(10),
+    primary key (plant_id, datehour_utc)
+) without rowid;
+
+create index if not exists tbl_fact_hourly_idx_datehour_utc on tbl_fact_hourly (datehour_utc);
+create index if not exists tbl_fact_hourly_idx_periodtype on tbl_fact_hourly (periodtype, season);
+
+-- tbl_rollup_daily: Aggregates of tbl_fact_hourly and tbl_calc_dispatch_margins
+-- by plant, day and period type
+
+create table if not exists tbl_rollup_daily
+(
+    plant_id integer not null,
+    date date not null,
+    periodtype varchar(10) not null,
+    hours integer not null,
+    power_count integer not null,  -- Hours with a power price
+    power_mean real,               -- ($/MWh)
+    power_min real,
+    power_max real,
+    generation_sum real not null,  -- MWh
+    generation_min real not null,
+    generation_max real not null,
+    css_count integer not null,    -- Hours with a clean spark spread
+    css_mean real,                 -- Clean spark spread at pmax ($/MWh)
+    css_min real,
+    css_max real,
+    act_margin_sum real not null,  -- ($)
+    opt_margin_sum real not null,  -- ($)
+    opportunity_sum real not null, -- ($)
+    primary key (plant_id, date, periodtype)
+) without rowid;
+
+create index if not exists tbl_rollup_daily_idx_date on tbl_rollup_daily (date);
+
+-- tbl_rollup_periods: Aggregates of tbl_rollup_daily by plant, period and
+-- period type where period is 'month' (period_id is MonthID), 'quarter'
+-- (QuarterID) or 'season' (year-season, e.g., '2015-winter')
+
+create table if not exists tbl_rollup_periods
+(
+    plant_id integer not null,
+    period varchar(10) not null,
+    period_id varchar(20) not null,
+    periodtype varchar(10) not null,
+    first_date date not null,
+    last_date date not null,
+    days integer not null,
+    hours integer not null,
+    power_count integer not null,
+    power_mean real,
+    power_min real,
+    power_max real,
+    generation_sum real not null,
+    generation_min real not null,
+    generation_max real not null,
+    css_count integer not null,
+    css_mean real,
+    css_min real,
+    css_max real,
+    act_margin_sum real not null,
+    opt_margin_sum real not null,
+    opportunity_sum real not null,
+    primary key (plant_id, period, period_id, periodtype)
+) without rowid;
+
+create index if not exists tbl_rollup_periods_idx_period on tbl_rollup_periods (period, period_id);
+
+/*********************************************
+**                                          **
+**  Data quality                            **
+**                                          **
+**********************************************/
+
+-- tbl_dq_issues: Issues found in the historical tables (see data_quality.py)
+
+create table if not exists tbl_dq_issues
+(
+    table_name varchar(50) not null,
+    series varchar(50) not null,      -- Product or plant
+    check_name varchar(20) not null,  -- missing, duplicate, bid_ask or outlier
+    period timestamp not null,        -- First period of the issue (hour in UTC or day)
+    periods integer not null,         -- Number of periods of the issue
+    value real,                       -- Value (outlier, duplicate dropped) or bid - ask (bid_ask)
+    detail varchar(255)
+);
+
+create index if not exists tbl_dq_issues_idx_check_name on tbl_dq_issues (check_name);
+
+/*********************************************
+**                                          **
+**  Calculated data                         **
+**                                          **
+**********************************************/
+
+-- tbl_calc_dispatch_margins: Hourly clean spark spreads and margins of the plants
+
+create table if not exists tbl_calc_dispatch_margins
+(
+    datehour_utc timestamp not null,
+    datehour timestamp not null,  -- Local hour of the market
+    plant_id integer not null,
+    power real not null,          -- Power price ($/MWh)
+    gas real not null,            -- Gas price ($/mmBtu)
+    carbon real not null,         -- Carbon price ($/tonne)
+    generation real not null,     -- MWh
+    css_pmin real not null,       -- Clean spark spread at pmin ($/MWh)
+    css_pmax real not null,       -- Clean spark spread at pmax ($/MWh)
+    css_duct real not null,       -- Clean spark spread with duct firing ($/MWh)
+    act_margin real not null,     -- Margin of the actual generation ($)
+    opt_margin real not null,     -- Margin of the optimal dispatch ($)
+    opportunity real not null,    -- opt_margin - act_margin ($)
+    primary key (datehour_utc, plant_id),
+    foreign key (plant_id) references tbl_ref_power_plants(id)
+);
+
+create index if not exists tbl_calc_dispatch_margins_idx_plant_id on tbl_calc_dispatch_margins (plant_id);
+
+-- tbl_calc_commitment: Hourly optimal commitment of the plants given their
+-- start cost and minimum uptime and downtime
+
+create table if not exists tbl_calc_commitment
+(
+    datehour_utc timestamp not null,
+    datehour timestamp not null,  -- Local hour of the market
+    plant_id integer not null,
+    online smallint not null,     -- 1 if the plant is committed
+    startup smallint not null,    -- 1 if the plant starts in this hour
+    generation real not null,     -- Optimal generation (MWh)
+    margin real not null,         -- Margin net of the start cost ($)
+    opportunity real not null,    -- margin - act_margin of tbl_calc_dispatch_margins ($)
+    primary key (datehour_utc, plant_id),
+    foreign key (plant_id) references tbl_ref_power_plants(id)
+);
+
+create index if not exists tbl_calc_commitment_idx_plant_id on tbl_calc_commitment (plant_id);
+
+-- tbl_calc_simulated_margins: Prices, clean spark spreads and optimal margin
+-- of the plants along each path of the Monte Carlo simulation
+
+create table if not exists tbl_calc_simulated_margins
+(
+    plant_id integer not null,
+    path integer not null,
+    power_mean real not null,     -- Mean power price ($/MWh)
+    gas_mean real not null,       -- Mean gas price ($/mmBtu)
+    carbon_mean real not null,    -- Mean carbon price ($/tonne)
+    css_pmax_mean real not null,  -- Mean clean spark spread at pmax ($/MWh)
+    css_duct_mean real not null,  -- Mean clean spark spread with duct firing ($/MWh)
+    opt_margin real not null,     -- Margin of the optimal dispatch over the period ($)
+    primary key (plant_id, path),
+    foreign key (plant_id) references tbl_ref_power_plants(id)
+);